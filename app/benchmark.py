@@ -0,0 +1,326 @@
+import asyncio
+import statistics
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from .config import setup_logging
+from .openrouter import make_openrouter_request_with_retry, collect_stream
+from .results import open_result_writer
+from .prompts import PromptSource
+from .sketch import BenchmarkStats
+from .store import prompt_hash
+from .utils import percentile, result_fieldnames
+
+logger = setup_logging()
+
+STREAM_STATS_KEYS = ("ttft_stats", "itl_stats", "tokens_per_second_stats")
+
+
+def _truncate(text: str) -> str:
+    return text[:100] + ("..." if len(text) > 100 else "")
+
+
+async def _completion_metrics(prompt: str, model: str, **options: Any) -> Dict[str, Any]:
+    response, latency = await make_openrouter_request_with_retry(prompt, model, **options)
+    data = response.json()
+    generated_text = data["choices"][0]["message"]["content"]
+    return {
+        "text": generated_text,
+        "latency_seconds": round(latency, 3),
+        "tokens_used": data.get("usage", {}).get("total_tokens", 0),
+    }
+
+
+async def _stream_metrics(prompt: str, model: str, **options: Any) -> Dict[str, Any]:
+    """Метрики потокового запроса: TTFT, межтокенные интервалы, токены/с.
+
+    Все моменты берутся из time.perf_counter(); до заголовков ответа
+    учитывается латентность, которую вернул make_openrouter_request_with_retry.
+    """
+    response, header_latency = await make_openrouter_request_with_retry(
+        prompt, model, stream=True, **options
+    )
+    headers_at = time.perf_counter()
+    stream = await collect_stream(response)
+    chunk_times = stream["chunk_times"]
+    usage = stream["usage"]
+
+    generation = header_latency + (stream["ended_at"] - headers_at)
+    ttft = header_latency + (chunk_times[0] - headers_at) if chunk_times else None
+    gaps = [b - a for a, b in zip(chunk_times, chunk_times[1:])]
+    output_tokens = usage.get("completion_tokens") or len(chunk_times)
+    decode_time = stream["ended_at"] - chunk_times[0] if len(chunk_times) > 1 else 0
+    if decode_time <= 0:
+        decode_time = generation
+
+    return {
+        "text": stream["text"],
+        "latency_seconds": round(generation, 3),
+        "tokens_used": usage.get("total_tokens", output_tokens),
+        "ttft_seconds": round(ttft, 3) if ttft is not None else None,
+        "itl_mean_seconds": round(statistics.mean(gaps), 4) if gaps else None,
+        "itl_p95_seconds": round(percentile(gaps, 95), 4) if gaps else None,
+        "tokens_per_second": round(output_tokens / decode_time, 2) if decode_time else 0,
+        "itl_gaps": gaps,
+    }
+
+
+async def run_benchmark_request(
+    run_id: int,
+    prompt_id: int,
+    prompt: str,
+    model: str,
+    stream: bool = False,
+    options: Optional[Dict[str, Any]] = None,
+) -> Optional[Dict[str, Any]]:
+    """Выполняет один запрос бенчмарка; возвращает строку результата или None при ошибке.
+
+    options — параметры промпта из файла (max_tokens, temperature).
+    """
+    options = options or {}
+    try:
+        if stream:
+            metrics = await _stream_metrics(prompt, model, **options)
+        else:
+            metrics = await _completion_metrics(prompt, model, **options)
+    except Exception as e:
+        logger.error(
+            "Error during benchmark request: %s",
+            e,
+            exc_info=True,
+            extra={"model": model, "run_id": run_id, "prompt_id": prompt_id},
+        )
+        return None
+
+    generated_text = metrics.pop("text")
+    return {
+        "run_id": run_id,
+        "prompt_id": prompt_id,
+        "prompt": _truncate(prompt),
+        "prompt_hash": prompt_hash(prompt),
+        "response": _truncate(generated_text),
+        "model": model,
+        "response_length": len(generated_text),
+        "timestamp": datetime.now().isoformat(),
+        **metrics,
+    }
+
+
+def model_comparison(
+    model_stats: Dict[str, BenchmarkStats],
+    errors: Dict[str, int],
+    wall_time: float,
+    stream: bool = False,
+) -> Dict[str, Dict[str, Any]]:
+    """Сравнение моделей одного прогона: перцентили латентности, TTFT, токены/с, ошибки."""
+    comparison = {}
+    for model, stats in model_stats.items():
+        ok = stats.latency.count
+        failed = errors.get(model, 0)
+        entry = {
+            "requests": ok + failed,
+            "errors": failed,
+            "error_rate": round(failed / (ok + failed), 4) if ok + failed else 0.0,
+            "latency_stats": stats.latency.summary(3),
+            "tokens_stats": stats.tokens.summary(1),
+            "requests_per_second": round(ok / wall_time, 3) if wall_time else 0.0,
+        }
+        if stream:
+            entry["ttft_stats"] = stats.ttft.summary(3)
+            entry["tokens_per_second_stats"] = stats.tokens_per_second.summary(2)
+        comparison[model] = entry
+    return comparison
+
+
+async def run_benchmark(
+    prompts: PromptSource,
+    models: List[str],
+    runs: int,
+    concurrency: int = 1,
+    stream: bool = False,
+    skip: Optional[Set[Tuple[int, int, str]]] = None,
+    on_result: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+    on_error: Optional[Callable[[str], None]] = None,
+    stats: Optional[BenchmarkStats] = None,
+    model_stats: Optional[Dict[str, BenchmarkStats]] = None,
+    keep_results: bool = True,
+) -> Dict[str, Any]:
+    """Прогоняет runs × prompts × models запросов, держа в работе не больше concurrency одновременно.
+
+    Задания раздаются воркерам через ограниченную очередь в порядке
+    (run_id, prompt_id), а внутри одного промпта — по всем моделям подряд,
+    начиная каждый раз со следующей модели. Так модели идут вперемешку в
+    общем пуле и одинаково попадают под дрейф нагрузки OpenRouter за время
+    прогона. Каждый результат сразу учитывается в скетчах stats и в
+    скетчах своей модели в model_stats (в потоковом режиме — вместе с
+    межтокенными интервалами), так что память под статистику не растет с
+    числом запросов. Тройки (run_id, prompt_id, model) из skip не
+    выполняются (возобновление бенчмарка); каждый готовый результат сразу
+    передается в on_result, о каждой ошибке сообщается через on_error(model).
+
+    Промпты читаются из prompts по мере того, как воркеры освобождают место
+    в очереди, — файл не загружается целиком. С keep_results=False строки
+    не копятся в памяти (только в stats и on_result), results будет пустым.
+    """
+    concurrency = max(1, concurrency)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    results: List[Dict[str, Any]] = []
+    if stats is None:
+        stats = BenchmarkStats()
+    if model_stats is None:
+        model_stats = {}
+    for model in models:
+        model_stats.setdefault(model, BenchmarkStats())
+    errors: Dict[str, int] = {model: 0 for model in models}
+    previous_count = stats.latency.count
+
+    async def producer() -> None:
+        n = 0
+        for run_id in range(runs):
+            prompt_id = 0
+            async for item in prompts.items():
+                prompt_id += 1
+                for k in range(len(models)):
+                    model = models[(n + k) % len(models)]
+                    if skip and (run_id + 1, prompt_id, model) in skip:
+                        continue
+                    await queue.put((run_id + 1, prompt_id, item, model))
+                n += 1
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def worker() -> None:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            run_id, prompt_id, prompt, model = item
+            options = {k: v for k, v in prompt.items() if k != "prompt"}
+            r = await run_benchmark_request(
+                run_id, prompt_id, prompt["prompt"], model, stream, options
+            )
+            if r is None:
+                errors[model] += 1
+                if on_error is not None:
+                    on_error(model)
+            else:
+                gaps = r.pop("itl_gaps", ())
+                stats.add(r, gaps)
+                model_stats[model].add(r, gaps)
+                if keep_results:
+                    results.append(r)
+                if on_result is not None:
+                    await on_result(r)
+
+    start = time.perf_counter()
+    async with asyncio.TaskGroup() as tg:
+        tg.create_task(producer())
+        for _ in range(concurrency):
+            tg.create_task(worker())
+    wall_time = time.perf_counter() - start
+
+    order = {model: i for i, model in enumerate(models)}
+    results.sort(key=lambda r: (r["run_id"], r["prompt_id"], order.get(r["model"], 0)))
+    completed = stats.latency.count - previous_count
+    return {
+        "results": results,
+        "stats": stats,
+        "model_stats": model_stats,
+        "errors": sum(errors.values()),
+        "errors_by_model": errors,
+        "wall_time_seconds": round(wall_time, 3),
+        "requests_per_second": round(completed / wall_time, 3) if wall_time else 0.0,
+    }
+
+
+async def execute_benchmark(
+    prompts: PromptSource,
+    models: List[str],
+    runs: int,
+    concurrency: int = 1,
+    stream: bool = False,
+    benchmark_id: Optional[str] = None,
+    resume: bool = False,
+    on_result: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+    on_error: Optional[Callable[[str], None]] = None,
+    stats: Optional[BenchmarkStats] = None,
+    keep_results: bool = True,
+) -> Dict[str, Any]:
+    """Полный бенчмарк: построчная запись CSV, прогон и итоговая статистика.
+
+    Возвращает {"results": все строки (пустой список при keep_results=False),
+    "summary": поля BenchmarkResponse или None, если ни один запрос не удался}. Для нескольких моделей в summary
+    добавляется comparison — статистика каждой модели за общий прогон.
+    Ошибки открытия файла результатов (FileNotFoundError/ValueError при
+    возобновлении) пробрасываются наружу. Переданный stats обновляется по
+    ходу прогона (текущие перцентили джоба).
+    """
+    writer, previous = open_result_writer(
+        benchmark_id, result_fieldnames(stream), resume=resume
+    )
+
+    async def record(r: Dict[str, Any]) -> None:
+        await writer.write(r)
+        if on_result is not None:
+            await on_result(r)
+
+    if stats is None:
+        stats = BenchmarkStats()
+    model_stats = {model: BenchmarkStats() for model in models}
+    for r in previous:
+        stats.add(r)
+        if r["model"] in model_stats:
+            model_stats[r["model"]].add(r)
+    done = {(r["run_id"], r["prompt_id"], r["model"]) for r in previous}
+    try:
+        outcome = await run_benchmark(
+            prompts,
+            models,
+            runs,
+            concurrency,
+            stream,
+            skip=done,
+            on_result=record,
+            on_error=on_error,
+            stats=stats,
+            model_stats=model_stats,
+            keep_results=keep_results,
+        )
+    finally:
+        await writer.close()
+
+    all_results: List[Dict[str, Any]] = []
+    if keep_results:
+        order = {model: i for i, model in enumerate(models)}
+        all_results = previous + outcome["results"]
+        all_results.sort(
+            key=lambda r: (r["run_id"], r["prompt_id"], order.get(r["model"], 0))
+        )
+    if not stats.latency.count:
+        return {"results": all_results, "summary": None}
+
+    summary = {
+        "model": ", ".join(models),
+        "runs": runs,
+        "total_prompts": prompts.count,
+        "latency_stats": stats.latency_stats(),
+        "tokens_stats": stats.tokens_stats(),
+        "concurrency": concurrency,
+        "wall_time_seconds": outcome["wall_time_seconds"],
+        "requests_per_second": outcome["requests_per_second"],
+        "stream": stream,
+        "benchmark_id": writer.benchmark_id,
+        "results_file": writer.path,
+    }
+    if stream:
+        summary.update(stats.stream_stats())
+    if len(models) > 1:
+        summary["models"] = models
+        summary["comparison"] = model_comparison(
+            model_stats,
+            outcome["errors_by_model"],
+            outcome["wall_time_seconds"],
+            stream,
+        )
+    return {"results": all_results, "summary": summary}
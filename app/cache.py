@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Dict, Optional, Tuple
+
+from .config import (
+    setup_logging,
+    CACHE_MAX_ENTRIES,
+    CACHE_MAX_BYTES,
+    CACHE_TTL_SECONDS,
+    CACHE_DISK_PATH,
+    SHARED_STATE_ENABLED,
+    SHARED_STATE_PATH,
+    SHARED_STATE_BUSY_TIMEOUT,
+)
+
+logger = setup_logging()
+
+# Примерный оверхед на запись в памяти сверх размера текста ответа
+ENTRY_OVERHEAD_BYTES = 256
+REPLAY_CHUNK_CHARS = 64
+
+
+def make_cache_key(
+    model: str, prompt: str, max_tokens: Optional[int], temperature: Optional[float]
+) -> str:
+    """Ключ кэша по (model, prompt, max_tokens, temperature)."""
+    raw = json.dumps([model, prompt, max_tokens, temperature], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """LRU-кэш ответов с TTL и ограничением по числу записей и байтам.
+
+    Необязательный дисковый уровень (SQLite) переживает перезапуск: промах в
+    памяти проверяется на диске, найденная запись поднимается обратно в LRU.
+    Дисковые операции выполняются в отдельном потоке, чтобы не блокировать
+    event loop. При нескольких воркерах дисковый уровень по умолчанию живет в
+    общей базе (SHARED_STATE_PATH): ответ, полученный одним воркером, находят
+    и остальные.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        max_bytes: int = CACHE_MAX_BYTES,
+        ttl: float = CACHE_TTL_SECONDS,
+        disk_path: Optional[str] = CACHE_DISK_PATH,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_path = disk_path or None
+        self._entries: "OrderedDict[str, Tuple[float, int, Dict[str, Any]]]" = (
+            OrderedDict()
+        )
+        self._bytes = 0
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            directory = os.path.dirname(self.disk_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(
+                self.disk_path, timeout=SHARED_STATE_BUSY_TIMEOUT, check_same_thread=False
+            )
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.commit()
+        return self._db
+
+    def _disk_get(self, key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        with self._db_lock:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT value, expires_at FROM response_cache WHERE key = ?",
+                    (key,),
+                )
+                .fetchone()
+            )
+        if row is None or row[1] <= time.time():
+            return None
+        return row[1], json.loads(row[0])
+
+    def _disk_set(self, key: str, value: Dict[str, Any], expires_at: float) -> None:
+        with self._db_lock:
+            db = self._connect()
+            db.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires_at),
+            )
+            db.execute(
+                "DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),)
+            )
+            db.commit()
+
+    def _remember(self, key: str, value: Dict[str, Any], expires_at: float) -> None:
+        size = len(str(value.get("response", "")).encode("utf-8")) + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._entries[key] = (expires_at, size, value)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Возвращает закэшированный ответ или None (с учетом TTL)."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, size, value = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+            self._bytes -= size
+
+        if self.disk_path:
+            try:
+                found = await asyncio.to_thread(self._disk_get, key)
+            except sqlite3.Error as e:
+                logger.warning(f"Cache disk read failed: {e}")
+                found = None
+            if found is not None:
+                expires_at, value = found
+                self._remember(key, value, expires_at)
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        """Сохраняет ответ в памяти и (если включено) на диске."""
+        expires_at = time.time() + self.ttl
+        self._remember(key, value, expires_at)
+        if self.disk_path:
+            try:
+                await asyncio.to_thread(self._disk_set, key, value, expires_at)
+            except sqlite3.Error as e:
+                logger.warning(f"Cache disk write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "disk_path": self.disk_path,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+async def replay_stream(text: str) -> AsyncGenerator[str, None]:
+    """Отдает закэшированный ответ в том же SSE-формате, что и stream_generator."""
+    for i in range(0, len(text), REPLAY_CHUNK_CHARS):
+        chunk = text[i : i + REPLAY_CHUNK_CHARS]
+        yield f'data: {{"content": {json.dumps(chunk)}}}\n\n'
+    yield 'data: {"done": true}\n\n'
+
+
+response_cache = ResponseCache(
+    disk_path=CACHE_DISK_PATH or (SHARED_STATE_PATH if SHARED_STATE_ENABLED else None)
+)
@@ -1,10 +1,32 @@
 from dotenv import load_dotenv
+import atexit
 import os
 import logging
 
+from .logs import (
+    JsonFormatter,
+    SamplingFilter,
+    file_handler,
+    start_queue_logging,
+    stop_queue_logging,
+)
+
 load_dotenv()
 
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+# Базовый URL апстрима; для офлайн-нагрузочных тестов — локальный мок
+# (python -m app.mock_openrouter), например http://127.0.0.1:8001/api/v1
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+OPENROUTER_API_URL = f"{OPENROUTER_BASE_URL.rstrip('/')}/chat/completions"
+OPENROUTER_MODELS_URL = f"{OPENROUTER_BASE_URL.rstrip('/')}/models"
+
+# Пул соединений общего HTTP-клиента к OpenRouter
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "200"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "50"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "30"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() in ("1", "true", "yes")
 
 
 def get_openrouter_api_key() -> str:
@@ -14,6 +36,112 @@ def get_openrouter_api_key() -> str:
     return OPENROUTER_API_KEY
 
 
+# Верхняя граница параллелизма одного бенчмарка (параметр формы concurrency)
+MAX_BENCHMARK_CONCURRENCY = int(os.getenv("MAX_BENCHMARK_CONCURRENCY", "32"))
+# Сводка per_prompt в статистике бенчмарка — только по первым N промптам
+# файла (по скетчу на промпт), чтобы память не росла с размером файла; 0 — без нее
+STATS_MAX_PROMPTS = int(os.getenv("STATS_MAX_PROMPTS", "100"))
+
+# POST /generate/batch: максимум элементов в пачке, параллелизм по умолчанию
+# и его верхняя граница (поле concurrency запроса)
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+BATCH_DEFAULT_CONCURRENCY = int(os.getenv("BATCH_DEFAULT_CONCURRENCY", "8"))
+MAX_BATCH_CONCURRENCY = int(os.getenv("MAX_BATCH_CONCURRENCY", "32"))
+
+# Кэш ответов /generate (LRU + TTL, опционально с дисковым уровнем SQLite)
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "3600"))
+CACHE_DISK_PATH = os.getenv("CACHE_DISK_PATH", "")
+
+# Схлопывание одинаковых одновременных запросов /generate в один вызов апстрима
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+# Адаптивный token bucket на модель, общий для /generate и /benchmark.
+# Выключен по умолчанию: включенный сразу ограничивает модель
+# RATE_LIMIT_INITIAL_RPS запросами в секунду, пока скорость не подрастет
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+RATE_LIMIT_INITIAL_RPS = float(os.getenv("RATE_LIMIT_INITIAL_RPS", "5"))
+RATE_LIMIT_MIN_RPS = float(os.getenv("RATE_LIMIT_MIN_RPS", "0.05"))
+RATE_LIMIT_MAX_RPS = float(os.getenv("RATE_LIMIT_MAX_RPS", "50"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+RATE_LIMIT_INCREASE_RPS = float(os.getenv("RATE_LIMIT_INCREASE_RPS", "0.1"))
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "120"))
+
+# Окно латентностей по модели, hedging запросов и circuit breaker
+LATENCY_WINDOW = int(os.getenv("LATENCY_WINDOW", "200"))
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "90"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "5"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "5"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_COOLDOWN_SECONDS = float(os.getenv("CIRCUIT_COOLDOWN_SECONDS", "30"))
+
+# Построчная запись результатов бенчмарка: отдельный CSV на каждый benchmark_id
+BENCHMARK_RESULTS_DIR = os.getenv("BENCHMARK_RESULTS_DIR", "benchmark_results")
+RESULTS_FLUSH_EVERY = int(os.getenv("RESULTS_FLUSH_EVERY", "20"))
+RESULTS_FSYNC_INTERVAL = float(os.getenv("RESULTS_FSYNC_INTERVAL", "1.0"))
+
+# Общее индексированное хранилище результатов всех бенчмарков (SQLite)
+RESULTS_STORE_ENABLED = os.getenv("RESULTS_STORE_ENABLED", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+RESULTS_DB_PATH = os.getenv(
+    "RESULTS_DB_PATH", os.path.join(BENCHMARK_RESULTS_DIR, "results.db")
+)
+
+# Фоновые бенчмарки (POST /benchmark с background=true)
+MAX_CONCURRENT_BENCHMARK_JOBS = int(os.getenv("MAX_CONCURRENT_BENCHMARK_JOBS", "2"))
+MAX_QUEUED_BENCHMARK_JOBS = int(os.getenv("MAX_QUEUED_BENCHMARK_JOBS", "20"))
+BENCHMARK_JOB_HISTORY = int(os.getenv("BENCHMARK_JOB_HISTORY", "100"))
+
+# Несколько воркеров (python main.py --workers N): лимиты моделей, кэш ответов
+# и фоновые бенчмарки хранятся в общей SQLite (WAL), чтобы воркеры делили
+# одну квоту и видели джобы друг друга. Включается автоматически при WORKERS > 1.
+WORKERS = int(os.getenv("WORKERS", "1"))
+SHARED_STATE_ENABLED = os.getenv(
+    "SHARED_STATE_ENABLED", "true" if WORKERS > 1 else "false"
+).lower() in ("1", "true", "yes")
+SHARED_STATE_PATH = os.getenv(
+    "SHARED_STATE_PATH", os.path.join(BENCHMARK_RESULTS_DIR, "shared_state.db")
+)
+SHARED_STATE_BUSY_TIMEOUT = float(os.getenv("SHARED_STATE_BUSY_TIMEOUT", "5"))
+# Как часто воркер публикует прогресс своих джобов и проверяет запросы отмены
+JOB_SYNC_INTERVAL = float(os.getenv("JOB_SYNC_INTERVAL", "0.5"))
+# Как часто воркер публикует снимок своих метрик для /metrics (сумма по воркерам);
+# gauge воркера, не обновлявшего снимок 3 интервала, в сумму не входят
+METRICS_SYNC_INTERVAL = float(os.getenv("METRICS_SYNC_INTERVAL", "5"))
+# Сколько секунд при остановке ждать завершения идущих запросов и стримов
+GRACEFUL_SHUTDOWN_SECONDS = float(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", "30"))
+
+# Общий дедлайн запроса к апстриму: заголовок DEADLINE_HEADER (секунды) или
+# deadline_seconds модели из реестра. Повтор делается, только если после паузы
+# на него остается хотя бы DEADLINE_MIN_ATTEMPT_SECONDS
+DEADLINE_HEADER = os.getenv("DEADLINE_HEADER", "X-Request-Timeout")
+DEADLINE_MAX_SECONDS = float(os.getenv("DEADLINE_MAX_SECONDS", "600"))
+DEADLINE_MIN_ATTEMPT_SECONDS = float(os.getenv("DEADLINE_MIN_ATTEMPT_SECONDS", "1"))
+# Таймаут попытки по окну латентностей модели: квантиль × множитель, не меньше
+# ADAPTIVE_TIMEOUT_MIN и не больше read_timeout модели (пока окно не набрано —
+# read_timeout). 0 в ADAPTIVE_TIMEOUT_MULTIPLIER отключает подстройку
+ADAPTIVE_TIMEOUT_QUANTILE = float(os.getenv("ADAPTIVE_TIMEOUT_QUANTILE", "99"))
+ADAPTIVE_TIMEOUT_MULTIPLIER = float(os.getenv("ADAPTIVE_TIMEOUT_MULTIPLIER", "2"))
+ADAPTIVE_TIMEOUT_MIN = float(os.getenv("ADAPTIVE_TIMEOUT_MIN", "2"))
+ADAPTIVE_TIMEOUT_MIN_SAMPLES = int(os.getenv("ADAPTIVE_TIMEOUT_MIN_SAMPLES", "20"))
+
+
+# Модели, доступные всегда; параметры запросов к ним и каталог апстрима —
+# в реестре моделей (app/registry.py, переменные MODEL_REGISTRY_*)
 AVAILABLE_MODELS = [
     "deepseek/deepseek-chat-v3.1:free",
     "z-ai/glm-4.5-air:free",
@@ -21,7 +149,28 @@ AVAILABLE_MODELS = [
 ]
 
 
-def setup_logging(logfile: str = "server_logs.txt") -> logging.Logger:
+# Логирование: записи кладутся в очередь, в файл и консоль их пишет фоновый
+# поток. LOG_FORMAT — формат файла (json — по записи JSON на строку, text —
+# прежний "дата - уровень - сообщение"), консоль всегда text.
+LOG_FILE = os.getenv("LOG_FILE", "server_logs.txt")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Ротация файла: size (LOG_MAX_BYTES), time (LOG_ROTATE_WHEN) или none.
+# Несколько воркеров пишут в один файл, а ротировать его из разных процессов
+# нельзя, поэтому при WORKERS > 1 по умолчанию none (ротация — внешняя, logrotate)
+LOG_ROTATION = os.getenv("LOG_ROTATION", "none" if WORKERS > 1 else "size").lower()
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "midnight")
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+# Прореживание: на шаблон сообщения LOG_SAMPLE_BURST записей за
+# LOG_SAMPLE_WINDOW_SECONDS, дальше каждая LOG_SAMPLE_EVERY-я (0 — отключено)
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", "20"))
+LOG_SAMPLE_WINDOW_SECONDS = float(os.getenv("LOG_SAMPLE_WINDOW_SECONDS", "10"))
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "100"))
+
+
+def setup_logging(logfile: str = LOG_FILE) -> logging.Logger:
     root = logging.getLogger()
 
     if not getattr(root, "_configured_by_setup_logging", False):
@@ -32,19 +181,24 @@ def setup_logging(logfile: str = "server_logs.txt") -> logging.Logger:
             "%(asctime)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
         )
 
-        # Файловый хендлер (все WARNING+ и выше будут писаться в файл)
-        fh = logging.FileHandler(logfile, encoding="utf-8")
-        fh.setLevel(logging.WARNING)
-        fh.setFormatter(formatter)
-        root.addHandler(fh)
+        fh = file_handler(
+            logfile, LOG_ROTATION, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_ROTATE_WHEN
+        )
+        fh.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else formatter)
 
-        # Консольный хендлер — по умолчанию показываем WARNING и ERROR
         sh = logging.StreamHandler()
-        sh.setLevel(logging.WARNING)
         sh.setFormatter(formatter)
-        root.addHandler(sh)
 
-        root.setLevel(logging.WARNING)
+        # На root только QueueHandler: поток event loop не ждет диска
+        start_queue_logging(
+            root,
+            [fh, sh],
+            LOG_QUEUE_SIZE,
+            SamplingFilter(LOG_SAMPLE_BURST, LOG_SAMPLE_WINDOW_SECONDS, LOG_SAMPLE_EVERY),
+        )
+        atexit.register(stop_queue_logging)
+
+        root.setLevel(LOG_LEVEL)
         root._configured_by_setup_logging = True
 
     return logging.getLogger(__name__)
@@ -0,0 +1,82 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Dict, Optional
+
+from fastapi import HTTPException, Request
+
+from .config import DEADLINE_HEADER, DEADLINE_MAX_SECONDS
+from .metrics import DEADLINE_EXCEEDED
+
+
+class Deadline:
+    """Общий бюджет времени запроса к апстриму (монотонные часы).
+
+    Бюджет задает клиент заголовком DEADLINE_HEADER (секунды) или берется
+    deadline_seconds модели из реестра. Повторы, ожидание квоты и таймауты
+    попыток в make_openrouter_request_with_retry укладываются в остаток.
+    """
+
+    def __init__(self, seconds: float, source: str):
+        self.budget = seconds
+        self.source = source  # header | model
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def exceeded(self, model: str, stage: str) -> HTTPException:
+        """504 для исчерпанного бюджета; stage — где он кончился (для метрик)."""
+        DEADLINE_EXCEEDED.inc(model, stage)
+        return HTTPException(
+            status_code=504,
+            detail=f"Deadline of {self.budget:g}s exceeded ({stage})",
+        )
+
+    async def run(self, awaitable: Awaitable[Any], model: str, stage: str) -> Any:
+        """Ждет awaitable не дольше остатка бюджета, иначе отменяет его и 504."""
+        try:
+            return await asyncio.wait_for(awaitable, self.remaining())
+        except asyncio.TimeoutError:
+            raise self.exceeded(model, stage) from None
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "budget_seconds": round(self.budget, 3),
+            "used_seconds": round(min(self.elapsed(), self.budget), 3),
+            "source": self.source,
+        }
+
+    def header(self) -> Dict[str, str]:
+        return {"X-Deadline-Budget": f"{self.budget:g}", "X-Deadline-Source": self.source}
+
+
+def parse_deadline(value: Optional[str]) -> Optional[float]:
+    """Значение заголовка дедлайна в секундах (не больше DEADLINE_MAX_SECONDS)."""
+    if value is None or not value.strip():
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        seconds = 0.0
+    if not seconds > 0:
+        raise HTTPException(
+            status_code=400, detail=f"{DEADLINE_HEADER} must be a positive number of seconds"
+        )
+    return min(seconds, DEADLINE_MAX_SECONDS)
+
+
+def request_deadline(http_request: Optional[Request], default_seconds: float) -> Deadline:
+    """Дедлайн из заголовка запроса, иначе бюджет модели по умолчанию."""
+    seconds = None
+    if http_request is not None:
+        seconds = parse_deadline(http_request.headers.get(DEADLINE_HEADER))
+    if seconds is None:
+        return Deadline(default_seconds, "model")
+    return Deadline(seconds, "header")
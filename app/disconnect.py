@@ -0,0 +1,88 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+from .config import setup_logging
+from .hedging import model_health
+from .metrics import CANCELLED_WORK, CANCEL_SAVED_SECONDS
+
+logger = setup_logging()
+
+# Статус для клиента, который ушел, не дождавшись ответа (как у nginx)
+CLIENT_CLOSED_STATUS = 499
+
+
+def record_cancelled(endpoint: str, model: str, units: float = 1, saved: float = 0.0) -> None:
+    """Учитывает отмененную из-за ушедшего клиента работу и оценку сэкономленного времени."""
+    CANCELLED_WORK.inc(endpoint, model, amount=units)
+    CANCEL_SAVED_SECONDS.inc(endpoint, model, amount=max(saved, 0.0))
+    logger.warning(
+        "Client disconnected, cancelled %s upstream request(s), ~%.1fs saved",
+        f"{units:g}",
+        saved,
+        extra={"endpoint": endpoint},
+    )
+
+
+def expected_remaining(model: str, elapsed: float, stream: bool = False) -> float:
+    """Сколько запрос к модели шел бы еще: медиана окна минус уже прошедшее."""
+    expected = model_health.get(model).expected_duration(stream)
+    return max(expected - elapsed, 0.0) if expected is not None else 0.0
+
+
+def remaining_time(elapsed: float, done: int, remaining: float) -> float:
+    """Время на оставшиеся единицы работы в темпе уже выполненных."""
+    return elapsed / done * remaining if done else 0.0
+
+
+async def wait_for_disconnect(request: Request) -> None:
+    """Возвращается, когда ASGI-сервер сообщил об отключении клиента.
+
+    Тело запроса к этому моменту уже прочитано FastAPI, поэтому receive()
+    просто ждет следующего сообщения — http.disconnect.
+    """
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def cancel_on_disconnect(
+    request: Optional[Request],
+    work: Awaitable[Any],
+    endpoint: str,
+    model: str,
+    estimate: Callable[[float], Tuple[float, float]],
+) -> Any:
+    """Выполняет work, пока клиент на связи; если он ушел — отменяет work.
+
+    Отмена доходит до make_openrouter_request_with_retry: закрывается
+    текущий запрос к апстриму, прерываются ожидание квоты и паузы перед
+    повторами. estimate(elapsed) -> (отменено запросов, секунд сэкономлено)
+    идет в метрики; model — метка для них. Клиенту уже нечего отвечать,
+    поэтому бросается HTTPException 499 (в метриках эндпоинта — статус 499).
+    """
+    if request is None:
+        return await work
+    start = time.monotonic()
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.ensure_future(wait_for_disconnect(request))
+    try:
+        await asyncio.wait((task, watcher), return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+    if task.done():
+        return task.result()
+
+    elapsed = time.monotonic() - start
+    units, saved = estimate(elapsed)
+    task.cancel()
+    # дожидаемся отмены, чтобы слот модели и соединение освободились до ответа
+    await asyncio.gather(task, return_exceptions=True)
+    record_cancelled(endpoint, model, units, saved)
+    raise HTTPException(status_code=CLIENT_CLOSED_STATUS, detail="Client closed request")
@@ -0,0 +1,221 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from fastapi import HTTPException
+
+from .config import (
+    setup_logging,
+    LATENCY_WINDOW,
+    HEDGE_QUANTILE,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_DEFAULT_DELAY,
+    HEDGE_MIN_DELAY,
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_COOLDOWN_SECONDS,
+    ADAPTIVE_TIMEOUT_QUANTILE,
+    ADAPTIVE_TIMEOUT_MULTIPLIER,
+    ADAPTIVE_TIMEOUT_MIN,
+    ADAPTIVE_TIMEOUT_MIN_SAMPLES,
+)
+from .utils import percentile
+
+logger = setup_logging()
+
+# Ошибки основного запроса, после которых страхующий имеет смысл: таймаут,
+# 429 и сбои апстрима. Ошибки запроса (4xx), разомкнутый breaker или сеть
+# после всех повторов (503) и исчерпанный дедлайн (504) он не исправит.
+HEDGE_RETRYABLE_STATUSES = (408, 429, 500, 502)
+
+
+class ModelHealth:
+    """Скользящее окно латентностей модели и ее circuit breaker.
+
+    closed — запросы идут; после CIRCUIT_FAILURE_THRESHOLD ошибок подряд
+    breaker размыкается (open) и запросы к модели сразу отклоняются. Раз в
+    CIRCUIT_COOLDOWN_SECONDS пропускается пробный запрос (half_open): успех
+    замыкает breaker, ошибка снова размыкает.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.latencies: deque = deque(maxlen=LATENCY_WINDOW)
+        # время до заголовков потоковых ответов — отдельное окно
+        self.header_latencies: deque = deque(maxlen=LATENCY_WINDOW)
+        # полная длительность дочитанных потоков — для оценки того, что сэкономила отмена
+        self.stream_durations: deque = deque(maxlen=LATENCY_WINDOW)
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос; в half_open пропускает один пробный раз за cooldown."""
+        if self.state == "closed":
+            return True
+        now = time.monotonic()
+        if now - self.opened_at >= CIRCUIT_COOLDOWN_SECONDS:
+            self.state = "half_open"
+            self.opened_at = now
+            return True
+        self.rejected += 1
+        return False
+
+    def is_open(self) -> bool:
+        return self.state != "closed" and (
+            time.monotonic() - self.opened_at < CIRCUIT_COOLDOWN_SECONDS
+        )
+
+    def record_success(
+        self, latency: Optional[float] = None, header_latency: Optional[float] = None
+    ) -> None:
+        if latency is not None:
+            self.latencies.append(latency)
+        if header_latency is not None:
+            self.header_latencies.append(header_latency)
+        if self.state != "closed":
+            logger.warning(f"Circuit closed for {self.model}")
+        self.state = "closed"
+        self.failures = 0
+
+    def record_stream(self, duration: float) -> None:
+        self.stream_durations.append(duration)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == "half_open" or (
+            self.state == "closed" and self.failures >= CIRCUIT_FAILURE_THRESHOLD
+        ):
+            logger.warning(f"Circuit opened for {self.model} after {self.failures} failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        return percentile(list(self.latencies), q)
+
+    def expected_duration(self, stream: bool = False) -> Optional[float]:
+        """Медиана полной длительности запроса (потока) или None, пока окно пустое."""
+        window = self.stream_durations if stream else self.latencies
+        return percentile(list(window), 50) if window else None
+
+    def attempt_timeout(self, ceiling: float, stream: bool = False) -> float:
+        """Таймаут попытки по окну латентностей: квантиль × множитель в [min, ceiling]."""
+        window = self.header_latencies if stream else self.latencies
+        if ADAPTIVE_TIMEOUT_MULTIPLIER <= 0 or len(window) < ADAPTIVE_TIMEOUT_MIN_SAMPLES:
+            return ceiling
+        adaptive = percentile(list(window), ADAPTIVE_TIMEOUT_QUANTILE)
+        return min(ceiling, max(adaptive * ADAPTIVE_TIMEOUT_MULTIPLIER, ADAPTIVE_TIMEOUT_MIN))
+
+    def hedge_delay(self) -> float:
+        """Сколько ждать основной запрос перед запуском страхующего (p90 окна)."""
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return max(self.quantile(HEDGE_QUANTILE), HEDGE_MIN_DELAY)
+
+    def stats(self) -> Dict[str, Any]:
+        p50 = self.quantile(50)
+        p90 = self.quantile(90)
+        circuit = self.state
+        if circuit != "closed":
+            circuit = "open" if self.is_open() else "half_open"
+        return {
+            "circuit": circuit,
+            "consecutive_failures": self.failures,
+            "rejected": self.rejected,
+            "samples": len(self.latencies),
+            "stream_samples": len(self.header_latencies),
+            "p50_seconds": round(p50, 3) if p50 is not None else None,
+            "p90_seconds": round(p90, 3) if p90 is not None else None,
+            "hedge_delay_seconds": round(self.hedge_delay(), 3),
+        }
+
+
+class ModelHealthRegistry:
+    def __init__(self):
+        self._models: Dict[str, ModelHealth] = {}
+
+    def get(self, model: str) -> ModelHealth:
+        health = self._models.get(model)
+        if health is None:
+            health = self._models[model] = ModelHealth(model)
+        return health
+
+    def pick_fallback(self, exclude: str, candidates: Iterable[str]) -> Optional[str]:
+        """Самая быстрая по p50 модель с замкнутым breaker (без статистики — в конце)."""
+        best = None
+        best_key = None
+        for model in candidates:
+            if model == exclude:
+                continue
+            health = self.get(model)
+            if health.is_open():
+                continue
+            p50 = health.quantile(50)
+            key = (p50 is None, p50 or 0.0)
+            if best_key is None or key < best_key:
+                best, best_key = model, key
+        return best
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {model: health.stats() for model, health in self._models.items()}
+
+
+model_health = ModelHealthRegistry()
+
+
+def _retryable(error: BaseException) -> bool:
+    return isinstance(error, HTTPException) and error.status_code in HEDGE_RETRYABLE_STATUSES
+
+
+async def hedged_call(
+    primary_model: str,
+    call: Callable[[str], Awaitable[Any]],
+    fallback_model: Optional[str],
+    candidates: Iterable[str],
+) -> Tuple[Any, str, bool]:
+    """Запускает call(primary_model), а если он не ответил за hedge_delay — еще и
+    страхующий запрос; возвращает первый успешный результат, проигравший отменяется.
+
+    Страхующая модель: fallback_model, иначе самая быстрая доступная из
+    candidates, иначе та же модель. Возвращает (результат, модель, hedged).
+    Ошибка основного запроса не из HEDGE_RETRYABLE_STATUSES пробрасывается
+    сразу; если не удались оба, пробрасывается ошибка основного.
+    """
+    delay = model_health.get(primary_model).hedge_delay()
+    primary = asyncio.ensure_future(call(primary_model))
+    pending = {primary}
+    models = {primary: primary_model}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if primary in done:
+            if primary.exception() is None:
+                return primary.result(), primary_model, False
+            if not _retryable(primary.exception()):
+                raise primary.exception()
+
+        secondary_model = (
+            fallback_model
+            or model_health.pick_fallback(primary_model, candidates)
+            or primary_model
+        )
+        logger.warning(
+            f"Hedging {primary_model} after {delay:.2f}s with {secondary_model}"
+        )
+        secondary = asyncio.ensure_future(call(secondary_model))
+        models[secondary] = secondary_model
+        pending = {secondary} if primary in done else {primary, secondary}
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result(), models[task], True
+                if task is primary and not _retryable(task.exception()):
+                    raise task.exception()
+        raise primary.exception()
+    finally:
+        for task in pending:
+            task.cancel()
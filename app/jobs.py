@@ -0,0 +1,403 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Optional, Union
+
+from .config import (
+    setup_logging,
+    MAX_CONCURRENT_BENCHMARK_JOBS,
+    MAX_QUEUED_BENCHMARK_JOBS,
+    BENCHMARK_JOB_HISTORY,
+    JOB_SYNC_INTERVAL,
+)
+from .benchmark import execute_benchmark
+from .results import new_benchmark_id
+from .prompts import PromptSource
+from .shared import SharedState, shared_state
+from .sketch import BenchmarkStats
+
+logger = setup_logging()
+
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+# Пространства имен общей базы: снимки джобов и занятые слоты выполнения
+JOBS_NAMESPACE = "benchmark_jobs"
+SLOTS_NAMESPACE = "benchmark_slots"
+# Джоб без heartbeat дольше этого считается потерянным (воркер остановился)
+JOB_STALE_SECONDS = max(10 * JOB_SYNC_INTERVAL, 5.0)
+
+
+class BenchmarkJob:
+    """Фоновый бенчмарк: состояние, прогресс и итоговый результат."""
+
+    def __init__(
+        self,
+        job_id: str,
+        prompts: PromptSource,
+        models: List[str],
+        runs: int,
+        concurrency: int,
+        stream: bool,
+        resume: bool,
+    ):
+        self.id = job_id
+        self.prompts = prompts
+        self.models = models
+        self.runs = runs
+        self.concurrency = concurrency
+        self.stream = stream
+        self.resume = resume
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.completed = 0
+        self.errors = 0
+        self.errors_by_model: Dict[str, int] = {}
+        self.stats = BenchmarkStats()
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def total_requests(self) -> Optional[int]:
+        """Известно после первого прохода по файлу промптов."""
+        if self.prompts.count is None:
+            return None
+        return self.runs * self.prompts.count * len(self.models)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_changed(self, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def on_result(self, row: Dict[str, Any]) -> None:
+        self.completed += 1
+        self._notify()
+
+    def on_error(self, model: str) -> None:
+        self.errors += 1
+        self.errors_by_model[model] = self.errors_by_model.get(model, 0) + 1
+        self._notify()
+
+    def progress(self) -> Dict[str, Any]:
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = round((self.finished_at or time.time()) - self.started_at, 3)
+        p50 = self.stats.latency.quantile(50)
+        p95 = self.stats.latency.quantile(95)
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "model": ", ".join(self.models),
+            "total_requests": self.total_requests,
+            "completed": self.completed,
+            "errors": self.errors,
+            "errors_by_model": self.errors_by_model,
+            "elapsed_seconds": elapsed,
+            "latency_p50": round(p50, 3) if p50 is not None else None,
+            "latency_p95": round(p95, 3) if p95 is not None else None,
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        data = self.progress()
+        data["error"] = self.error
+        data["result"] = self.result
+        return data
+
+
+class RemoteJob:
+    """Джоб, который выполняет другой воркер: снимок его состояния из общей базы."""
+
+    def __init__(self, shared: SharedState, record: Dict[str, Any]):
+        self.shared = shared
+        self._load(record)
+
+    def _load(self, record: Dict[str, Any]) -> None:
+        self.record = record
+        self.id = record["snapshot"]["job_id"]
+        self.status = record["snapshot"]["status"]
+        self.error = record["snapshot"]["error"]
+        if not self.finished and time.time() - record["heartbeat"] > JOB_STALE_SECONDS:
+            # воркер остановился, не успев записать итог
+            self.status = "failed"
+            self.error = "Benchmark worker stopped"
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    async def wait_changed(self, timeout: float) -> None:
+        await asyncio.sleep(min(timeout, JOB_SYNC_INTERVAL))
+        record = await asyncio.to_thread(self.shared.get, JOBS_NAMESPACE, self.id)
+        if record is not None:
+            self._load(record)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.record["snapshot"], "status": self.status, "error": self.error}
+
+    def progress(self) -> Dict[str, Any]:
+        data = self.snapshot()
+        del data["error"], data["result"]
+        return data
+
+
+def _is_active(record: Dict[str, Any], now: float) -> bool:
+    return (
+        record["snapshot"]["status"] not in FINISHED_STATUSES
+        and now - record["heartbeat"] <= JOB_STALE_SECONDS
+    )
+
+
+def _claim_slot(
+    job_id: str, refresh_only: bool, slots: Optional[Dict[str, float]]
+) -> tuple:
+    """Занимает (или продлевает) слот выполнения, если свободных хватает."""
+    now = time.time()
+    slots = {key: seen for key, seen in (slots or {}).items() if now - seen <= JOB_STALE_SECONDS}
+    if job_id not in slots and (refresh_only or len(slots) >= MAX_CONCURRENT_BENCHMARK_JOBS):
+        return slots, False
+    slots[job_id] = now
+    return slots, True
+
+
+def _release_slot(job_id: str, slots: Optional[Dict[str, float]]) -> tuple:
+    slots = dict(slots or {})
+    slots.pop(job_id, None)
+    return slots, None
+
+
+def _request_cancel(record: Optional[Dict[str, Any]]) -> tuple:
+    if record is None:
+        return None, None
+    return {**record, "cancel_requested": True}, None
+
+
+class JobManager:
+    """Очередь фоновых бенчмарков с ограничением числа одновременно идущих.
+
+    Не больше MAX_CONCURRENT_BENCHMARK_JOBS джобов выполняются сразу (чтобы
+    не вытеснять /generate), еще до MAX_QUEUED_BENCHMARK_JOBS ждут своей
+    очереди; из завершенных хранятся последние BENCHMARK_JOB_HISTORY.
+
+    С shared (несколько воркеров) лимиты общие для всех процессов: слоты
+    выполнения занимаются в общей базе, а каждый воркер раз в
+    JOB_SYNC_INTERVAL публикует там снимки своих джобов (с heartbeat) и
+    забирает запросы отмены. Поэтому статус, SSE-прогресс и отмену можно
+    запрашивать у любого воркера.
+    """
+
+    def __init__(self, shared: Optional[SharedState] = None):
+        self.shared = shared
+        self._jobs: "OrderedDict[str, BenchmarkJob]" = OrderedDict()
+        self._slots = asyncio.Semaphore(MAX_CONCURRENT_BENCHMARK_JOBS)
+
+    async def submit(
+        self,
+        prompts: PromptSource,
+        models: List[str],
+        runs: int,
+        concurrency: int = 1,
+        stream: bool = False,
+        resume_id: Optional[str] = None,
+    ) -> BenchmarkJob:
+        if self.shared is None:
+            active = sum(1 for job in self._jobs.values() if not job.finished)
+        else:
+            records = await asyncio.to_thread(self.shared.items, JOBS_NAMESPACE)
+            now = time.time()
+            active = sum(1 for record in records.values() if _is_active(record, now))
+        if active >= MAX_CONCURRENT_BENCHMARK_JOBS + MAX_QUEUED_BENCHMARK_JOBS:
+            raise OverflowError("Too many benchmark jobs queued")
+
+        job = BenchmarkJob(
+            resume_id or new_benchmark_id(),
+            prompts,
+            models,
+            runs,
+            concurrency,
+            stream,
+            resume=resume_id is not None,
+        )
+        existing = await self.find(job.id)
+        if existing is not None and not existing.finished:
+            raise ValueError(f"Benchmark {job.id} is already running")
+        self._jobs[job.id] = job
+        self._jobs.move_to_end(job.id)
+        if self.shared is not None:
+            await self._publish(job)
+        job.task = asyncio.create_task(self._run(job))
+        await self._trim()
+        return job
+
+    @asynccontextmanager
+    async def _slot(self, job: BenchmarkJob) -> AsyncIterator[None]:
+        async with self._slots:
+            if self.shared is None:
+                yield
+                return
+            claim = partial(_claim_slot, job.id, False)
+            while not await asyncio.to_thread(
+                self.shared.update, SLOTS_NAMESPACE, "running", claim
+            ):
+                await asyncio.sleep(JOB_SYNC_INTERVAL)
+            try:
+                yield
+            finally:
+                await asyncio.to_thread(
+                    self.shared.update, SLOTS_NAMESPACE, "running", partial(_release_slot, job.id)
+                )
+
+    async def _publish(self, job: BenchmarkJob) -> None:
+        """Пишет снимок джоба в общую базу и выполняет запрошенную другим воркером отмену."""
+        snapshot = job.snapshot()
+
+        def apply(record: Optional[Dict[str, Any]]) -> tuple:
+            cancel = bool(record and record.get("cancel_requested"))
+            return {
+                "snapshot": snapshot,
+                "worker": os.getpid(),
+                "heartbeat": time.time(),
+                "cancel_requested": cancel,
+            }, cancel
+
+        try:
+            cancel = await asyncio.to_thread(self.shared.update, JOBS_NAMESPACE, job.id, apply)
+            if job.status == "running":
+                await asyncio.to_thread(
+                    self.shared.update,
+                    SLOTS_NAMESPACE,
+                    "running",
+                    partial(_claim_slot, job.id, True),
+                )
+        except sqlite3.Error as e:
+            logger.warning("Benchmark job %s sync failed: %s", job.id, e)
+            return
+        if cancel and not job.finished and job.task is not None:
+            job.task.cancel()
+
+    async def _sync(self, job: BenchmarkJob) -> None:
+        while True:
+            await asyncio.sleep(JOB_SYNC_INTERVAL)
+            await self._publish(job)
+
+    async def _run(self, job: BenchmarkJob) -> None:
+        sync = asyncio.create_task(self._sync(job)) if self.shared is not None else None
+        try:
+            async with self._slot(job):
+                job.status = "running"
+                job.started_at = time.time()
+                job._notify()
+                outcome = await execute_benchmark(
+                    job.prompts,
+                    job.models,
+                    job.runs,
+                    job.concurrency,
+                    job.stream,
+                    benchmark_id=job.id,
+                    resume=job.resume,
+                    on_result=job.on_result,
+                    on_error=job.on_error,
+                    stats=job.stats,
+                    keep_results=False,
+                )
+            if outcome["summary"] is None:
+                job.status = "failed"
+                job.error = "No successful requests"
+            else:
+                job.status = "completed"
+                job.result = outcome["summary"]
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+        except Exception as e:
+            logger.error(f"Benchmark job {job.id} failed: {e}", exc_info=True)
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            # временная копия файла промптов больше не нужна
+            job.prompts.close()
+            job._notify()
+            if sync is not None:
+                sync.cancel()
+                await self._publish(job)
+
+    async def _trim(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[: max(len(finished) - BENCHMARK_JOB_HISTORY, 0)]:
+            del self._jobs[job_id]
+            if self.shared is not None:
+                await asyncio.to_thread(self.shared.delete, JOBS_NAMESPACE, job_id)
+
+    def get(self, job_id: str) -> Optional[BenchmarkJob]:
+        return self._jobs.get(job_id)
+
+    async def find(self, job_id: str) -> Optional[Union[BenchmarkJob, RemoteJob]]:
+        """Джоб этого воркера или (с shared) снимок джоба другого воркера."""
+        job = self._jobs.get(job_id)
+        if job is not None or self.shared is None:
+            return job
+        record = await asyncio.to_thread(self.shared.get, JOBS_NAMESPACE, job_id)
+        return RemoteJob(self.shared, record) if record is not None else None
+
+    async def cancel(self, job_id: str) -> Optional[Union[BenchmarkJob, RemoteJob]]:
+        job = await self.find(job_id)
+        if isinstance(job, BenchmarkJob):
+            if job.task is not None and not job.finished:
+                job.task.cancel()
+        elif job is not None and not job.finished:
+            # отменит воркер-владелец при следующей синхронизации
+            await asyncio.to_thread(
+                self.shared.update, JOBS_NAMESPACE, job_id, _request_cancel
+            )
+        return job
+
+    async def shutdown(self) -> None:
+        tasks = [job.task for job in self._jobs.values() if job.task and not job.finished]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def events(
+        self, job: Union[BenchmarkJob, RemoteJob], interval: float = 0.5, keepalive: float = 15.0
+    ) -> AsyncGenerator[str, None]:
+        """SSE-поток прогресса джоба: не чаще раза в interval секунд, в конце — итог.
+
+        Пока прогресс не меняется (джоб в очереди), раз в keepalive секунд
+        уходит SSE-комментарий, чтобы прокси и клиенты не рвали тихое соединение.
+        """
+        last_sent = None
+        last_event = time.monotonic()
+        while True:
+            progress = job.progress()
+            if progress != last_sent:
+                yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+                last_sent = progress
+                last_event = time.monotonic()
+            elif time.monotonic() - last_event >= keepalive:
+                yield ": keepalive\n\n"
+                last_event = time.monotonic()
+            if job.finished:
+                yield f"event: done\ndata: {json.dumps(job.snapshot())}\n\n"
+                return
+            await job.wait_changed(keepalive)
+            if not job.finished:
+                await asyncio.sleep(interval)
+
+
+job_manager = JobManager(shared_state)
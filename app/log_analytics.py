@@ -0,0 +1,374 @@
+"""Аналитика логов сервера: латентность, повторы и 429 по моделям и по времени.
+
+Запуск:  python -m app.log_analytics [файлы...] [--bucket 3600] [--incremental] [--json]
+
+Без файлов разбираются LOG_FILE и его ротированные копии (от старых к
+новым). Понимает оба формата: прежние текстовые строки
+("2025-09-08 22:44:26 - INFO - Успешный запрос за 13.18s") и JSON-записи
+нового логирования. Файлы читаются построчно, статистика копится в
+скетчах, поэтому память не зависит от размера логов. С --incremental
+разбираются только байты, дописанные после прошлого запуска; смещения
+файлов и накопленная статистика хранятся в файле состояния.
+
+Успешные запросы пишутся на уровне INFO: чтобы они попали в лог, сервер
+нужно запускать с LOG_LEVEL=INFO (по умолчанию WARNING — тогда в отчете
+только повторы, 429 и ошибки).
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .config import LOG_FILE
+from .sketch import QuantileSketch
+
+DEFAULT_BUCKET_SECONDS = 3600
+LOG_ANALYTICS_STATE = os.path.join(
+    os.path.dirname(LOG_FILE) or ".", "log_analytics_state.json"
+)
+# Файл узнается после ротации (переименования) по inode и первым байтам:
+# пока он короче FINGERPRINT_BYTES, сравнивается столько байт, сколько было
+FINGERPRINT_BYTES = 256
+
+_TEXT_LINE = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) - (\w+) - (.*)$")
+_MODEL = re.compile(r"(?:модели |модель=|model=|model )([\w.\-]+/[\w.\-:]+)")
+_SUCCESS = re.compile(
+    r"^(?:Успешный запрос за|Upstream request succeeded in) ([\d.]+)s"
+    r"|^OpenRouter request succeeded: .*latency=([\d.]+)s"
+)
+_RATE_LIMITED = re.compile(r"^Rate limit \(429\)")
+_RETRY = re.compile(r"(?:, retry\b|Retry after)")
+_FAILED = re.compile(
+    r"^(?:Network error after retries|Timeout after retries)|Rate limit exceeded after"
+)
+
+Event = Tuple[float, str, str, Optional[float]]
+
+
+def _counters() -> Dict[str, int]:
+    return {"successes": 0, "failures": 0, "retries": 0, "rate_limited": 0}
+
+
+class LogStats:
+    """Накопленная статистика: счетчики и скетч латентности по моделям и по окнам времени."""
+
+    def __init__(self, bucket_seconds: int = DEFAULT_BUCKET_SECONDS):
+        self.bucket_seconds = bucket_seconds
+        self.lines = 0
+        self.events = 0
+        self.first_ts: Optional[float] = None
+        self.last_ts: Optional[float] = None
+        self.models: Dict[str, Dict[str, Any]] = {}
+        self.buckets: Dict[int, Dict[str, Any]] = {}
+        # модель из последней строки, где она упоминалась: в старом формате
+        # "Успешный запрос за Ns" идет после "Попытка N/M для модели X"
+        self.current_model = ""
+
+    @staticmethod
+    def _group(groups: Dict[Any, Dict[str, Any]], key: Any) -> Dict[str, Any]:
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {**_counters(), "latency": QuantileSketch()}
+        return group
+
+    def add(self, ts: float, kind: str, model: str, latency: Optional[float]) -> None:
+        self.events += 1
+        self.first_ts = ts if self.first_ts is None else min(self.first_ts, ts)
+        self.last_ts = ts if self.last_ts is None else max(self.last_ts, ts)
+        bucket = int(ts // self.bucket_seconds) * self.bucket_seconds
+        for group in (
+            self._group(self.models, model or "unknown"),
+            self._group(self.buckets, bucket),
+        ):
+            group[kind] += 1
+            if latency is not None:
+                group["latency"].add(latency)
+
+    @staticmethod
+    def _summary(group: Dict[str, Any]) -> Dict[str, Any]:
+        """Сводка группы; доли повторов и 429 — от попыток (запросы + повторы)."""
+        requests = group["successes"] + group["failures"]
+        attempts = requests + group["retries"]
+        return {
+            "requests": requests,
+            "attempts": attempts,
+            **{key: group[key] for key in _counters()},
+            "retry_rate": round(group["retries"] / attempts, 4) if attempts else None,
+            "rate_limited_rate": round(group["rate_limited"] / attempts, 4) if attempts else None,
+            "latency_stats": group["latency"].summary(3),
+        }
+
+    def report(self) -> Dict[str, Any]:
+        def iso(ts: Optional[float]) -> Optional[str]:
+            return datetime.fromtimestamp(ts).isoformat() if ts is not None else None
+
+        trends = []
+        for start in sorted(self.buckets):
+            summary = self._summary(self.buckets[start])
+            latency = summary.pop("latency_stats")
+            summary["latency_p50"] = latency.get("p50")
+            summary["latency_p95"] = latency.get("p95")
+            trends.append({"start": iso(start), **summary})
+        return {
+            "lines": self.lines,
+            "events": self.events,
+            "from": iso(self.first_ts),
+            "to": iso(self.last_ts),
+            "bucket_seconds": self.bucket_seconds,
+            "models": {model: self._summary(g) for model, g in sorted(self.models.items())},
+            "trends": trends,
+        }
+
+    @staticmethod
+    def _dump_groups(groups: Dict[Any, Dict[str, Any]]) -> Dict[str, Any]:
+        return {
+            str(key): {**{k: g[k] for k in _counters()}, "latency": g["latency"].to_dict()}
+            for key, g in groups.items()
+        }
+
+    @staticmethod
+    def _load_groups(data: Dict[str, Any], key_type=str) -> Dict[Any, Dict[str, Any]]:
+        return {
+            key_type(key): {
+                **{k: g[k] for k in _counters()},
+                "latency": QuantileSketch.from_dict(g["latency"]),
+            }
+            for key, g in data.items()
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "bucket_seconds": self.bucket_seconds,
+            "lines": self.lines,
+            "events": self.events,
+            "first_ts": self.first_ts,
+            "last_ts": self.last_ts,
+            "current_model": self.current_model,
+            "models": self._dump_groups(self.models),
+            "buckets": self._dump_groups(self.buckets),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LogStats":
+        stats = cls(data["bucket_seconds"])
+        stats.lines = data["lines"]
+        stats.events = data["events"]
+        stats.first_ts = data["first_ts"]
+        stats.last_ts = data["last_ts"]
+        stats.current_model = data.get("current_model", "")
+        stats.models = cls._load_groups(data["models"])
+        stats.buckets = cls._load_groups(data["buckets"], int)
+        return stats
+
+
+def _classify(message: str) -> Tuple[Optional[str], Optional[float]]:
+    """Тип события по тексту сообщения: successes/failures/retries/rate_limited."""
+    match = _SUCCESS.search(message)
+    if match:
+        return "successes", float(match.group(1) or match.group(2))
+    if _RATE_LIMITED.search(message):
+        return "rate_limited", None
+    if message.startswith("Error during benchmark request"):
+        # сетевые ошибки бенчмарка уже посчитаны по "Network error after retries",
+        # а исчерпанные попытки после 429 логируются только здесь
+        if "Rate limit exceeded" not in message:
+            return None, None
+    if _FAILED.search(message):
+        return "failures", None
+    if _RETRY.search(message):
+        return "retries", None
+    return None, None
+
+
+def parse_line(line: str, stats: LogStats) -> List[Event]:
+    """События строки лога (обычно 0 или 1; 429 со словом retry — два)."""
+    if line.startswith("{"):
+        try:
+            record = json.loads(line)
+            ts = datetime.fromisoformat(record["ts"]).timestamp()
+        except (ValueError, KeyError, TypeError):
+            return []
+        message = str(record.get("message", ""))
+        model = record.get("model") or ""
+        if "latency_seconds" in record and message.startswith("Upstream request succeeded"):
+            return [(ts, "successes", model, float(record["latency_seconds"]))]
+    else:
+        match = _TEXT_LINE.match(line)
+        if match is None:
+            # строки трассировок и прочий многострочный вывод
+            return []
+        ts = datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S").timestamp()
+        message = match.group(3)
+        found = _MODEL.search(message)
+        if found:
+            stats.current_model = found.group(1)
+        model = stats.current_model
+
+    kind, latency = _classify(message)
+    if kind is None:
+        return []
+    events = [(ts, kind, model, latency)]
+    if kind == "rate_limited" and _RETRY.search(message):
+        events.append((ts, "retries", model, None))
+    return events
+
+
+def _fingerprint(path: str, length: int = FINGERPRINT_BYTES) -> Tuple[int, str]:
+    """Сколько первых байт (не больше length) попало в отпечаток и их sha1."""
+    with open(path, "rb") as f:
+        head = f.read(length)
+    return len(head), hashlib.sha1(head).hexdigest()
+
+
+def _read_lines(path: str, offset: int) -> Iterator[Tuple[str, int]]:
+    """Полные строки файла начиная с offset и смещение после каждой.
+
+    Недописанная последняя строка (без перевода строки) пропускается — ее
+    разберет следующий инкрементальный запуск.
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                return
+            offset += len(raw)
+            yield raw.decode("utf-8", errors="replace").rstrip("\r\n"), offset
+
+
+def log_files(path: str = LOG_FILE) -> List[str]:
+    """Лог и его ротированные копии (path.1, path.2025-09-08 ...), от старых к новым."""
+    files = [p for p in glob.glob(glob.escape(path) + ".*") if os.path.isfile(p)]
+    if os.path.isfile(path):
+        files.append(path)
+    return sorted(files, key=os.path.getmtime)
+
+
+def analyze(
+    paths: List[str],
+    bucket_seconds: int = DEFAULT_BUCKET_SECONDS,
+    state_path: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Разбирает файлы и возвращает отчет; со state_path — только новые байты.
+
+    Файлы узнаются по inode и отпечатку первых байт, так что ротация
+    (переименование) не приводит к повторному разбору, а рост короткого
+    файла не меняет его ключ. Если начало файла изменилось или он стал
+    короче сохраненного смещения (перезаписан), он читается заново.
+    """
+    state: Dict[str, Any] = {}
+    if state_path and os.path.exists(state_path):
+        with open(state_path, encoding="utf-8") as f:
+            state = json.load(f)
+    if state.get("stats", {}).get("bucket_seconds") == bucket_seconds:
+        stats = LogStats.from_dict(state["stats"])
+        offsets: Dict[str, Dict[str, Any]] = state.get("offsets", {})
+    else:
+        stats = LogStats(bucket_seconds)
+        offsets = {}
+
+    processed = []
+    new_offsets: Dict[str, Dict[str, Any]] = {}
+    for path in paths:
+        if not os.path.isfile(path) or os.path.getsize(path) == 0:
+            continue
+        key = str(os.stat(path).st_ino)
+        saved = offsets.get(key)
+        start = 0
+        if saved is not None and _fingerprint(path, saved["head_bytes"])[1] == saved["head"]:
+            start = saved["offset"]
+        if start > os.path.getsize(path):
+            start = 0
+        end = start
+        for line, end in _read_lines(path, start):
+            stats.lines += 1
+            for event in parse_line(line, stats):
+                stats.add(*event)
+        head_bytes, head = _fingerprint(path)
+        new_offsets[key] = {"offset": end, "head_bytes": head_bytes, "head": head}
+        processed.append({"path": path, "start": start, "end": end})
+
+    if state_path:
+        tmp = state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"offsets": new_offsets, "stats": stats.to_dict()}, f)
+        os.replace(tmp, state_path)
+
+    report = stats.report()
+    report["files"] = processed
+    return report
+
+
+_state_lock = threading.Lock()
+
+
+def analyze_logs(
+    bucket_seconds: int = DEFAULT_BUCKET_SECONDS, incremental: bool = False
+) -> Dict[str, Any]:
+    """Отчет по логам сервера (для эндпоинта; инкрементальные вызовы не пересекаются)."""
+    if not incremental:
+        return analyze(log_files(), bucket_seconds)
+    with _state_lock:
+        return analyze(log_files(), bucket_seconds, LOG_ANALYTICS_STATE)
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    print(
+        f"Lines: {report['lines']}, events: {report['events']}, "
+        f"{report['from']} .. {report['to']}"
+    )
+    print(
+        f"{'model':40} {'req':>6} {'fail':>5} {'retry%':>7} {'429%':>7} "
+        f"{'p50':>8} {'p95':>8} {'p99':>8}"
+    )
+    for model, m in report["models"].items():
+        latency = m["latency_stats"]
+        retry = f"{m['retry_rate']:.1%}" if m["retry_rate"] is not None else "-"
+        limited = (
+            f"{m['rate_limited_rate']:.1%}" if m["rate_limited_rate"] is not None else "-"
+        )
+        p50, p95, p99 = (latency.get(p, "-") for p in ("p50", "p95", "p99"))
+        print(
+            f"{model[:40]:40} {m['requests']:>6} {m['failures']:>5} {retry:>7} "
+            f"{limited:>7} {p50:>8} {p95:>8} {p99:>8}"
+        )
+    print(f"\nTrend ({report['bucket_seconds']}s buckets):")
+    for t in report["trends"]:
+        print(
+            f"{t['start']}  req={t['requests']} fail={t['failures']} retries={t['retries']} "
+            f"429={t['rate_limited']} p50={t['latency_p50'] or '-'} p95={t['latency_p95'] or '-'}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Server log analytics")
+    parser.add_argument(
+        "files", nargs="*", help=f"log files (default: {LOG_FILE} and rotated copies)"
+    )
+    parser.add_argument(
+        "--bucket", type=int, default=DEFAULT_BUCKET_SECONDS, help="trend bucket, seconds"
+    )
+    parser.add_argument(
+        "--incremental", action="store_true", help="process only bytes added since last run"
+    )
+    parser.add_argument(
+        "--state", default=LOG_ANALYTICS_STATE, help="state file for --incremental"
+    )
+    parser.add_argument("--json", action="store_true", help="print the raw JSON report")
+    args = parser.parse_args()
+
+    paths = args.files or log_files()
+    report = analyze(paths, args.bucket, args.state if args.incremental else None)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        _print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import json
+import logging
+import logging.handlers
+import queue
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# Поля, которые добавляются к каждой записи из контекста запроса
+# (request_id проставляет RequestContextMiddleware, модель — обработчики)
+_log_context: ContextVar[Dict[str, Any]] = ContextVar("log_context", default={})
+
+# Стандартные атрибуты LogRecord; все остальные — поля из extra
+_RECORD_ATTRS = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {
+    "message",
+    "asctime",
+    "taskName",
+}
+
+# Предел числа отслеживаемых шаблонов сообщений в SamplingFilter
+_SAMPLING_MAX_KEYS = 1000
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def bind_log_context(**fields: Any) -> None:
+    """Добавляет поля (model и т.п.) ко всем записям текущего запроса/задачи."""
+    bound = {key: value for key, value in fields.items() if value is not None}
+    _log_context.set({**_log_context.get(), **bound})
+
+
+class ContextFilter(logging.Filter):
+    """Копирует поля контекста запроса в запись (явный extra имеет приоритет)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in _log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Прореживание частых сообщений: burst штук на шаблон за окно, дальше каждое every-е.
+
+    Ключ — логгер и шаблон сообщения (record.msg), поэтому частые сообщения
+    пишутся в %-стиле: logger.warning("Retry after %ss", delay). ERROR и
+    выше не прореживаются. Число пропущенных записей попадает в поле
+    suppressed следующей записи того же шаблона.
+    """
+
+    def __init__(self, burst: int, window_seconds: float, every: int):
+        super().__init__()
+        self.burst = burst
+        self.window_seconds = window_seconds
+        self.every = every
+        self.suppressed = 0
+        # ключ -> [начало окна, записей в окне, пропущено с последней записи]
+        self._windows: Dict[Tuple[str, Any], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0 or record.levelno >= logging.ERROR:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        state = self._windows.get(key)
+        if state is None or now - state[0] >= self.window_seconds:
+            if len(self._windows) >= _SAMPLING_MAX_KEYS:
+                self._windows.clear()
+            skipped = state[2] if state is not None else 0
+            state = self._windows[key] = [now, 0, skipped]
+        state[1] += 1
+        extra = state[1] - self.burst
+        if extra <= 0 or (self.every > 0 and extra % self.every == 0):
+            if state[2]:
+                record.suppressed = state[2]
+                state[2] = 0
+            return True
+        state[2] += 1
+        self.suppressed += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON: время, уровень, сообщение и поля из extra/контекста."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_") and value is not None:
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который не блокирует поток при переполнении очереди, а считает потери."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # В отличие от базового prepare, трассировка остается в exc_text,
+        # а не склеивается с сообщением: JSON-формат пишет ее отдельным полем.
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        prepared = logging.makeLogRecord(record.__dict__)
+        prepared.msg = record.message
+        prepared.args = None
+        prepared.exc_info = None
+        prepared.stack_info = None
+        return prepared
+
+
+def file_handler(
+    path: str, rotation: str, max_bytes: int, backup_count: int, when: str
+) -> logging.Handler:
+    """Файловый хендлер: rotation = size | time | none."""
+    if rotation == "size":
+        return logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+    if rotation == "time":
+        return logging.handlers.TimedRotatingFileHandler(
+            path, when=when, backupCount=backup_count, encoding="utf-8"
+        )
+    return logging.FileHandler(path, encoding="utf-8")
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # при остановке ждем места в очереди, а не теряем сигнал завершения
+        self.queue.put(self._sentinel)
+
+
+_queue_handler: Optional[_QueueHandler] = None
+_sampler: Optional[SamplingFilter] = None
+_listener: Optional[_QueueListener] = None
+
+
+def start_queue_logging(
+    root: logging.Logger,
+    handlers: List[logging.Handler],
+    queue_size: int,
+    sampler: SamplingFilter,
+) -> logging.handlers.QueueListener:
+    """Вешает на root только QueueHandler; запись в файл и консоль — в потоке слушателя.
+
+    Поток event loop лишь кладет запись в очередь (контекст и прореживание
+    применяются до этого), дисковый ввод-вывод уходит в фоновый поток
+    QueueListener. При переполнении очереди записи отбрасываются.
+    """
+    global _queue_handler, _sampler, _listener
+    handler = _QueueHandler(queue.Queue(maxsize=queue_size))
+    handler.addFilter(ContextFilter())
+    handler.addFilter(sampler)
+    root.addHandler(handler)
+    listener = _QueueListener(
+        handler.queue, *handlers, respect_handler_level=True
+    )
+    listener.start()
+    _queue_handler, _sampler, _listener = handler, sampler, listener
+    return listener
+
+
+def stop_queue_logging() -> None:
+    """Дописывает накопленные в очереди записи и останавливает слушателя."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def log_stats() -> Dict[str, int]:
+    return {
+        "queued": _queue_handler.queue.qsize() if _queue_handler else 0,
+        "dropped": _queue_handler.dropped if _queue_handler else 0,
+        "suppressed": _sampler.suppressed if _sampler else 0,
+    }
+
+
+class RequestContextMiddleware:
+    """ASGI-middleware: request_id для логов запроса и заголовок X-Request-ID в ответе.
+
+    Входящий X-Request-ID используется как есть (если он разумной длины),
+    иначе генерируется новый. Сделано на чистом ASGI, без буферизации
+    ответа, чтобы не мешать стримингу.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1").strip()[:64] or None
+                break
+        request_id = request_id or new_request_id()
+        header = (b"x-request-id", request_id.encode("latin-1"))
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", ()), header]}
+            await send(message)
+
+        token = _log_context.set({"request_id": request_id})
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _log_context.reset(token)
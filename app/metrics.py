@@ -0,0 +1,291 @@
+import asyncio
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+
+from .shared import SharedState
+
+# Границы бакетов гистограмм латентности (секунды)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+LabelValues = Tuple[str, ...]
+
+# Пространство имен общей базы со снимками метрик воркеров (ключ — pid)
+METRICS_NAMESPACE = "metrics"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def snapshot(self) -> List[list]:
+        """Значения в виде JSON-списков [[метки, ...значения], ...] для общей базы."""
+        raise NotImplementedError
+
+    def merge(self, values: Dict[LabelValues, Any], entries: Iterable[list]) -> None:
+        """Прибавляет значения из снимка другого воркера к values."""
+        raise NotImplementedError
+
+    def render(self, values: Optional[Dict[LabelValues, Any]] = None) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Монотонный счетчик; значения по наборам меток хранятся в обычном dict."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self) -> List[list]:
+        return [[list(labels), value] for labels, value in self._values.items()]
+
+    def merge(self, values: Dict[LabelValues, Any], entries: Iterable[list]) -> None:
+        for labels, value in entries:
+            key = tuple(labels)
+            values[key] = values.get(key, 0) + value
+
+    def render(self, values: Optional[Dict[LabelValues, Any]] = None) -> List[str]:
+        values = self._values if values is None else values
+        lines = self._header()
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """Текущее значение (в полете, открытые потоки), может уменьшаться."""
+
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, *labels: str, value: float) -> None:
+        self._values[labels] = value
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными бакетами: на наблюдение — bisect и два сложения."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # на набор меток: [счетчики по бакетам (+Inf последним), сумма]
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def snapshot(self) -> List[list]:
+        return [[list(labels), counts, total] for labels, (counts, total) in self._series.items()]
+
+    def merge(self, values: Dict[LabelValues, Any], entries: Iterable[list]) -> None:
+        for labels, counts, total in entries:
+            series = values.setdefault(tuple(labels), [[0] * len(counts), 0.0])
+            series[0] = [a + b for a, b in zip(series[0], counts)]
+            series[1] += total
+
+    def render(self, values: Optional[Dict[LabelValues, Any]] = None) -> List[str]:
+        values = self._series if values is None else values
+        lines = self._header()
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                bucket_labels = _labels(self.labelnames, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Реестр метрик процесса в текстовом формате Prometheus.
+
+    Метрики обновляются только из потока event loop, поэтому обходятся без
+    блокировок: обновление — это поиск в dict и сложение. При нескольких
+    воркерах каждый публикует снимок своих метрик в общую базу (publish), а
+    render_shared() суммирует снимки всех воркеров: счетчики и гистограммы —
+    включая остановленные воркеры, чтобы сумма не убывала, gauge — только
+    живых (снимок свежее stale_seconds).
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, List[list]]:
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def publish(self, shared: SharedState, alive: bool = True) -> None:
+        """Записывает снимок метрик воркера; alive=False — воркер останавливается."""
+        record = {"heartbeat": time.time() if alive else 0.0, "metrics": self.snapshot()}
+        shared.set(METRICS_NAMESPACE, str(os.getpid()), record)
+
+    def render_shared(self, shared: SharedState, stale_seconds: float) -> str:
+        """Сумма метрик всех воркеров (блокирующий вызов — через asyncio.to_thread)."""
+        self.publish(shared)
+        now = time.time()
+        records = list(shared.items(METRICS_NAMESPACE).values())
+        lines: List[str] = []
+        for metric in self._metrics:
+            values: Dict[LabelValues, Any] = {}
+            for record in records:
+                if metric.kind == "gauge" and now - record["heartbeat"] > stale_seconds:
+                    continue
+                metric.merge(values, record["metrics"].get(metric.name, []))
+            lines.extend(metric.render(values))
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+REQUESTS = registry.counter(
+    "proxy_requests_total",
+    "Requests handled by the proxy",
+    ("endpoint", "model", "status"),
+)
+REQUEST_DURATION = registry.histogram(
+    "proxy_request_duration_seconds",
+    "Time to response headers for proxy requests",
+    ("endpoint", "model", "status"),
+)
+IN_FLIGHT = registry.gauge(
+    "proxy_requests_in_flight", "Requests currently being handled", ("endpoint",)
+)
+ACTIVE_STREAMS = registry.gauge(
+    "proxy_active_streams", "Streaming responses currently open", ("model",)
+)
+STREAMED_BYTES = registry.counter(
+    "proxy_streamed_bytes_total", "Bytes of stream frames relayed from OpenRouter", ("model",)
+)
+UPSTREAM_REQUESTS = registry.counter(
+    "upstream_requests_total",
+    "Attempts sent to OpenRouter by response status (timeout/error without response)",
+    ("model", "status"),
+)
+UPSTREAM_LATENCY = registry.histogram(
+    "upstream_request_duration_seconds",
+    "OpenRouter attempt latency (headers for streams, full body otherwise)",
+    ("model",),
+)
+UPSTREAM_RETRIES = registry.counter(
+    "upstream_retries_total", "Repeated attempts to OpenRouter", ("model",)
+)
+UPSTREAM_RATE_LIMITED = registry.counter(
+    "upstream_rate_limited_total", "429 responses from OpenRouter", ("model",)
+)
+DEADLINE_EXCEEDED = registry.counter(
+    "proxy_deadline_exceeded_total",
+    "Requests that ran out of their deadline budget, by stage",
+    ("model", "stage"),
+)
+CANCELLED_WORK = registry.counter(
+    "proxy_cancelled_total",
+    "Upstream requests cancelled or not sent because the client disconnected",
+    ("endpoint", "model"),
+)
+CANCEL_SAVED_SECONDS = registry.counter(
+    "proxy_cancel_saved_seconds_total",
+    "Estimated seconds of upstream work saved by cancelling on client disconnect",
+    ("endpoint", "model"),
+)
+RETRIES_SKIPPED = registry.counter(
+    "upstream_retries_skipped_total",
+    "Retries not attempted because they did not fit the remaining deadline",
+    ("model",),
+)
+
+
+@contextmanager
+def track_request(endpoint: str, model: str) -> Iterator[None]:
+    """Считает запрос к эндпоинту: в полете, итоговый статус и время до ответа."""
+    IN_FLIGHT.inc(endpoint)
+    start = time.perf_counter()
+    status = "200"
+    try:
+        yield
+    except HTTPException as e:
+        status = str(e.status_code)
+        raise
+    except asyncio.CancelledError:
+        status = "499"
+        raise
+    except Exception:
+        status = "500"
+        raise
+    finally:
+        IN_FLIGHT.dec(endpoint)
+        REQUESTS.inc(endpoint, model, status)
+        REQUEST_DURATION.observe(time.perf_counter() - start, endpoint, model, status)
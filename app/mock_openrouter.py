@@ -0,0 +1,279 @@
+"""Локальная замена OpenRouter для офлайн-нагрузочных тестов прокси.
+
+Запуск:  python -m app.mock_openrouter --port 8001 [--config mock.json] [--seed 42]
+Прокси:  OPENROUTER_BASE_URL=http://127.0.0.1:8001/api/v1
+
+Профиль модели задает распределение задержки до первого токена
+(логнормальное: медиана и sigma), скорость генерации, длину ответа и доли
+429 / 5xx / таймаутов. Файл конфигурации — JSON вида
+{"default": {...}, "models": {"moonshotai/kimi-k2:free": {...}}}; профиль
+можно поменять и на лету через PUT /mock/config.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import time
+import uuid
+from collections import deque
+from typing import Any, AsyncGenerator, Deque, Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+WORDS = (
+    "the quick brown fox jumps over a lazy dog while modern language models "
+    "stream tokens through proxies benchmarks measure latency throughput and "
+    "tail percentiles under load"
+).split()
+
+
+class ModelProfile(BaseModel):
+    ttft_median: float = 0.4  # секунды до первого токена (медиана)
+    ttft_sigma: float = 0.3  # разброс логнормального распределения
+    tokens_per_second: float = 60.0
+    output_tokens: int = 120  # средняя длина ответа в токенах
+    tokens_per_chunk: int = 3  # максимум токенов в одном SSE-чанке
+    rate_429: float = 0.0  # доля ответов 429
+    rate_5xx: float = 0.0  # доля ответов 502/503
+    rate_timeout: float = 0.0  # доля "зависших" запросов
+    timeout_seconds: float = 120.0  # сколько висит "зависший" запрос
+    requests_per_minute: int = 0  # настоящий лимит на модель (0 — без лимита)
+    retry_after: float = 1.0
+
+
+class MockConfig(BaseModel):
+    default: ModelProfile = ModelProfile()
+    models: Dict[str, ModelProfile] = {}
+
+    def profile(self, model: str) -> ModelProfile:
+        return self.models.get(model, self.default)
+
+
+class MockState:
+    def __init__(self, config: MockConfig, seed: Optional[int] = None):
+        self.config = config
+        self.random = random.Random(seed)
+        self.windows: Dict[str, Deque[float]] = {}
+        self.counters: Dict[str, int] = {
+            "requests": 0,
+            "stream_requests": 0,
+            "ok": 0,
+            "rate_limited": 0,
+            "server_errors": 0,
+            "timeouts": 0,
+        }
+
+    def ttft(self, profile: ModelProfile) -> float:
+        return profile.ttft_median * math.exp(self.random.gauss(0, profile.ttft_sigma))
+
+    def output_tokens(self, profile: ModelProfile, max_tokens: Optional[int]) -> int:
+        tokens = max(1, int(self.random.expovariate(1 / profile.output_tokens)))
+        return min(tokens, max_tokens) if max_tokens else tokens
+
+    def over_limit(self, model: str, profile: ModelProfile) -> Optional[float]:
+        """Скользящее минутное окно; при превышении — через сколько освободится слот."""
+        if not profile.requests_per_minute:
+            return None
+        now = time.monotonic()
+        window = self.windows.setdefault(model, deque())
+        while window and now - window[0] >= 60:
+            window.popleft()
+        if len(window) >= profile.requests_per_minute:
+            return 60 - (now - window[0])
+        window.append(now)
+        return None
+
+
+def _config_from_env() -> MockConfig:
+    path = os.getenv("MOCK_OPENROUTER_CONFIG")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return MockConfig(**json.load(f))
+    return MockConfig()
+
+
+def _seed_from_env() -> Optional[int]:
+    seed = os.getenv("MOCK_OPENROUTER_SEED")
+    return int(seed) if seed else None
+
+
+state = MockState(_config_from_env(), _seed_from_env())
+mock_app = FastAPI(title="Mock OpenRouter", version="1.0.0")
+
+
+def _rate_limit_headers(profile: ModelProfile, retry_after: float) -> Dict[str, str]:
+    headers = {"Retry-After": str(max(1, math.ceil(retry_after)))}
+    if profile.requests_per_minute:
+        reset_ms = int((time.time() + retry_after) * 1000)
+        headers.update(
+            {
+                "X-RateLimit-Limit": str(profile.requests_per_minute),
+                "X-RateLimit-Remaining": "0",
+                "X-RateLimit-Reset": str(reset_ms),
+            }
+        )
+    return headers
+
+
+def _text(n_tokens: int) -> list:
+    return [state.random.choice(WORDS) + " " for _ in range(n_tokens)]
+
+
+def _usage(prompt_tokens: int, completion_tokens: int) -> Dict[str, int]:
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+async def _sse(
+    completion_id: str,
+    model: str,
+    profile: ModelProfile,
+    tokens: list,
+    prompt_tokens: int,
+    ttft: float,
+) -> AsyncGenerator[str, None]:
+    # OpenRouter шлет комментарии keep-alive, пока модель не начала отвечать
+    yield ": OPENROUTER PROCESSING\n\n"
+    await asyncio.sleep(ttft)
+    i = 0
+    while i < len(tokens):
+        size = state.random.randint(1, max(1, profile.tokens_per_chunk))
+        piece = "".join(tokens[i : i + size])
+        i += size
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "model": model,
+            "choices": [{"index": 0, "delta": {"role": "assistant", "content": piece}}],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+        if i < len(tokens):
+            await asyncio.sleep(size / profile.tokens_per_second)
+    final = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "model": model,
+        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        "usage": _usage(prompt_tokens, len(tokens)),
+    }
+    yield f"data: {json.dumps(final)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@mock_app.post("/api/v1/chat/completions")
+async def chat_completions(request: Request):
+    body: Dict[str, Any] = await request.json()
+    model = body.get("model", "")
+    profile = state.config.profile(model)
+    stream = bool(body.get("stream"))
+    counters = state.counters
+    counters["requests"] += 1
+    if stream:
+        counters["stream_requests"] += 1
+
+    wait = state.over_limit(model, profile)
+    if wait is not None or state.random.random() < profile.rate_429:
+        counters["rate_limited"] += 1
+        retry_after = wait if wait is not None else profile.retry_after
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"code": 429, "message": "Rate limit exceeded"}},
+            headers=_rate_limit_headers(profile, retry_after),
+        )
+    roll = state.random.random()
+    if roll < profile.rate_5xx:
+        counters["server_errors"] += 1
+        status = state.random.choice((502, 503))
+        return JSONResponse(
+            status_code=status,
+            content={"error": {"code": status, "message": "Upstream provider error"}},
+        )
+    if roll < profile.rate_5xx + profile.rate_timeout:
+        counters["timeouts"] += 1
+        await asyncio.sleep(profile.timeout_seconds)
+        return JSONResponse(
+            status_code=504, content={"error": {"code": 504, "message": "Timeout"}}
+        )
+
+    counters["ok"] += 1
+    messages = body.get("messages") or []
+    prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+    tokens = _text(state.output_tokens(profile, body.get("max_tokens")))
+    ttft = state.ttft(profile)
+    completion_id = f"gen-{uuid.uuid4().hex[:16]}"
+
+    if stream:
+        return StreamingResponse(
+            _sse(completion_id, model, profile, tokens, prompt_tokens, ttft),
+            media_type="text/event-stream",
+        )
+
+    await asyncio.sleep(ttft + len(tokens) / profile.tokens_per_second)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": _usage(prompt_tokens, len(tokens)),
+    }
+
+
+@mock_app.get("/api/v1/models")
+async def list_models():
+    return {"data": [{"id": model} for model in state.config.models]}
+
+
+@mock_app.get("/mock/config")
+async def get_config():
+    return state.config
+
+
+@mock_app.put("/mock/config")
+async def set_config(config: MockConfig):
+    """Заменяет профили моделей без перезапуска (например, включить 429 посреди теста)."""
+    state.config = config
+    state.windows.clear()
+    return state.config
+
+
+@mock_app.get("/mock/stats")
+async def get_stats():
+    return state.counters
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mock OpenRouter server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--config", help="JSON file with model profiles")
+    parser.add_argument("--seed", type=int, help="random seed for reproducible runs")
+    args = parser.parse_args()
+
+    global state
+    config = state.config
+    if args.config:
+        with open(args.config, encoding="utf-8") as f:
+            config = MockConfig(**json.load(f))
+    state = MockState(config, args.seed if args.seed is not None else _seed_from_env())
+
+    import uvicorn
+
+    uvicorn.run(mock_app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,17 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Any, List, Optional
 
 
 class GenerateRequest(BaseModel):
     prompt: str
     model: str
     max_tokens: Optional[int] = 512
+    temperature: Optional[float] = None  # None — temperature модели из реестра
     stream: Optional[bool] = False
+    raw_stream: Optional[bool] = False
+    no_cache: Optional[bool] = False
+    hedge: Optional[bool] = False
+    fallback_model: Optional[str] = None
 
     class Config:
         json_schema_extra = {
@@ -14,15 +19,28 @@ class GenerateRequest(BaseModel):
                 "prompt": "Расскажи краткую историю про кота",
                 "model": "deepseek/deepseek-chat-v3.1:free",
                 "max_tokens": 512,
+                "temperature": 0.7,
                 "stream": False,
             }
         }
 
 
+class BatchGenerateRequest(BaseModel):
+    # элементы проверяются по одному (как GenerateRequest), чтобы ошибка в
+    # одном не отклоняла всю пачку
+    items: List[Any]
+    concurrency: Optional[int] = None
+
+
 class GenerateResponse(BaseModel):
     response: str
     tokens_used: int = 0
     latency_seconds: float
+    cached: bool = False
+    coalesced: bool = False
+    model: Optional[str] = None
+    hedged: bool = False
+    deadline: Optional[dict] = None  # {budget_seconds, used_seconds, source}
 
 
 class BenchmarkResponse(BaseModel):
@@ -31,5 +49,15 @@ class BenchmarkResponse(BaseModel):
     total_prompts: int
     latency_stats: dict
     tokens_stats: dict
+    concurrency: int = 1
+    wall_time_seconds: Optional[float] = None
+    requests_per_second: Optional[float] = None
+    stream: bool = False
+    ttft_stats: Optional[dict] = None
+    itl_stats: Optional[dict] = None
+    tokens_per_second_stats: Optional[dict] = None
+    benchmark_id: Optional[str] = None
     results_file: str
+    models: Optional[List[str]] = None
+    comparison: Optional[dict] = None
     html_table: Optional[str] = None
@@ -1,116 +1,520 @@
 import time
 import json
 import asyncio
-from typing import AsyncGenerator, Tuple
-import requests
-from fastapi import HTTPException
+from typing import AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+import httpx
+from fastapi import HTTPException, Request
 
-from .config import setup_logging, get_openrouter_api_key
+from .config import (
+    setup_logging,
+    get_openrouter_api_key,
+    OPENROUTER_API_URL,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_POOL_TIMEOUT,
+    HTTP2_ENABLED,
+    RATE_LIMIT_ENABLED,
+    DEADLINE_MIN_ATTEMPT_SECONDS,
+)
+from .deadline import Deadline
+from .disconnect import record_cancelled, expected_remaining
+from .ratelimit import rate_limiters, parse_retry_after
+from .registry import model_registry
+from .hedging import model_health
+from .metrics import (
+    ACTIVE_STREAMS,
+    STREAMED_BYTES,
+    UPSTREAM_REQUESTS,
+    UPSTREAM_LATENCY,
+    UPSTREAM_RETRIES,
+    UPSTREAM_RATE_LIMITED,
+    RETRIES_SKIPPED,
+)
 
 logger = setup_logging()
 
+_http_client: Optional[httpx.AsyncClient] = None
+_headers: Optional[Dict[str, str]] = None
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Создает общий асинхронный клиент с пулом keep-alive соединений."""
+    http2 = HTTP2_ENABLED
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("HTTP/2 requested but 'h2' is not installed, using HTTP/1.1")
+            http2 = False
+
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(60, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT)
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2)
+
+
+async def start_http_client() -> httpx.AsyncClient:
+    """Открывает общий клиент (вызывается из lifespan приложения)."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = create_http_client()
+    return _http_client
+
+
+async def close_http_client() -> None:
+    """Закрывает общий клиент и все соединения пула."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Возвращает общий клиент; создает его лениво, если lifespan не запускался."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = create_http_client()
+    return _http_client
+
+
+def upstream_headers() -> Dict[str, str]:
+    """Заголовки запросов к OpenRouter: собираются один раз, а не на каждый вызов."""
+    global _headers
+    if _headers is None:
+        _headers = {
+            "Authorization": f"Bearer {get_openrouter_api_key()}",
+            "HTTP-Referer": "http://localhost:8000",
+            "X-Title": "FastAPI OpenRouter Proxy",
+            "Content-Type": "application/json",
+        }
+    return _headers
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Тело потокового ответа, которое при закрытии освобождает слот модели."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, semaphore: asyncio.Semaphore):
+        self._stream = stream
+        self._semaphore: Optional[asyncio.Semaphore] = semaphore
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._semaphore is not None:
+                self._semaphore.release()
+                self._semaphore = None
+
+
+async def _send(
+    client: httpx.AsyncClient,
+    request: httpx.Request,
+    stream: bool,
+    slot: Optional[asyncio.Semaphore],
+) -> httpx.Response:
+    """Отправляет запрос, держа слот модели до ответа, а для stream — до закрытия потока."""
+    try:
+        response = await client.send(request, stream=stream)
+    except BaseException:
+        if slot is not None:
+            slot.release()
+        raise
+    if slot is not None:
+        if stream and not response.is_closed:
+            response.stream = _ReleasingStream(response.stream, slot)
+        else:
+            slot.release()
+    return response
+
+
+def _retry_fits(deadline: Deadline, delay: float, model: str, attempt: int) -> bool:
+    """Успеет ли повтор после паузы delay уложиться в остаток дедлайна."""
+    if deadline.remaining() - delay >= DEADLINE_MIN_ATTEMPT_SECONDS:
+        return True
+    RETRIES_SKIPPED.inc(model)
+    logger.warning(
+        "Retry skipped: %.2fs left of %gs deadline",
+        deadline.remaining(),
+        deadline.budget,
+        extra={"model": model, "attempt": attempt + 1},
+    )
+    return False
+
 
 async def make_openrouter_request_with_retry(
-    prompt: str, model: str, max_tokens: int = 256, stream: bool = False
-) -> Tuple[requests.Response, float]:
-    """Отправка запроса в OpenRouter с повторными попытками при ошибках."""
-    key = get_openrouter_api_key()
-    headers = {
-        "Authorization": f"Bearer {key}",
-        "HTTP-Referer": "http://localhost:8000",
-        "X-Title": "FastAPI OpenRouter Proxy",
-        "Content-Type": "application/json",
-    }
+    prompt: str,
+    model: str,
+    max_tokens: int = 256,
+    stream: bool = False,
+    temperature: Optional[float] = None,
+    deadline: Optional[Deadline] = None,
+) -> Tuple[httpx.Response, float]:
+    """Отправка запроса в OpenRouter с повторными попытками при ошибках.
+
+    При stream=True возвращается открытый потоковый ответ — вызывающий код
+    обязан закрыть его (``await response.aclose()``). Латентность меряется
+    монотонными часами: для stream=True это время до заголовков ответа, для
+    stream=False — время полного ответа.
+
+    Таймауты, число повторов, потолок max_tokens, temperature по умолчанию
+    и лимит одновременных запросов берутся из реестра моделей. Слот лимита
+    занят, пока идет попытка, а для stream=True — пока ответ не закрыт.
+
+    Все попытки, паузы и ожидание квоты укладываются в deadline (по умолчанию
+    deadline_seconds модели): повтор делается, только если помещается в
+    остаток, а таймаут попытки — по окну латентностей модели, но не больше
+    остатка. Для stream=True дедлайн ограничивает время до заголовков ответа.
+    """
+    headers = upstream_headers()
+    spec = model_registry.get(model)
+    if deadline is None:
+        deadline = Deadline(spec.settings.deadline_seconds, "model")
 
     payload = {
         "model": model,
         "messages": [{"role": "user", "content": prompt}],
-        "max_tokens": max_tokens,
-        "temperature": 0.7,
+        "max_tokens": spec.clamp_max_tokens(max_tokens),
+        "temperature": spec.temperature if temperature is None else temperature,
         "stream": stream,
     }
 
-    max_retries = 3
-    base_delay = 1
+    health = model_health.get(model)
+    if not health.allow():
+        raise HTTPException(
+            status_code=503, detail=f"Model {model} is temporarily unavailable"
+        )
+
+    client = get_http_client()
+    request = client.build_request(
+        "POST", OPENROUTER_API_URL, headers=headers, json=payload, timeout=spec.timeout
+    )
+    limiter = rate_limiters.get(model) if RATE_LIMIT_ENABLED else None
+    max_retries = spec.max_retries
+    base_delay = spec.retry_base_delay
 
     for attempt in range(max_retries + 1):
-        start_time = time.time()
+        if attempt:
+            UPSTREAM_RETRIES.inc(model)
+        if attempt and health.is_open():
+            # breaker разомкнулся, пока мы ждали — не тратим оставшиеся попытки
+            raise HTTPException(
+                status_code=503, detail=f"Model {model} is temporarily unavailable"
+            )
+        slot = spec.semaphore
+        if slot is not None:
+            # лимит одновременных запросов к модели (на воркер)
+            await deadline.run(slot.acquire(), model, "concurrency")
+        try:
+            if limiter is not None:
+                # ждем квоту модели в общей очереди (после 429 — до конца паузы)
+                await deadline.run(limiter.acquire(), model, "rate_limit")
+            remaining = deadline.remaining()
+            adaptive = health.attempt_timeout(spec.settings.read_timeout, stream)
+            attempt_timeout = min(adaptive, remaining)
+            if attempt_timeout <= 0:
+                raise deadline.exceeded(model, "upstream")
+        except BaseException:
+            if slot is not None:
+                slot.release()
+            raise
+        # таймаут чтения потока — пауза между чанками, поэтому для stream=True
+        # попытку ограничивает только ожидание заголовков
+        read_timeout = spec.settings.read_timeout if stream else attempt_timeout
+        request.extensions["timeout"] = httpx.Timeout(
+            read_timeout,
+            connect=min(spec.settings.connect_timeout, attempt_timeout),
+            pool=min(HTTP_POOL_TIMEOUT, attempt_timeout),
+        ).as_dict()
+        start_time = time.perf_counter()
 
         try:
-            response = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=60,
-                stream=stream,
+            response = await asyncio.wait_for(
+                _send(client, request, stream, slot), attempt_timeout
             )
 
-            end_time = time.time()
+            end_time = time.perf_counter()
             latency = end_time - start_time
+            UPSTREAM_REQUESTS.inc(model, str(response.status_code))
+            UPSTREAM_LATENCY.observe(latency, model)
+            if limiter is not None:
+                await limiter.observe(response.status_code, response.headers)
 
             if response.status_code == 200:
+                if stream:
+                    # для stream=True это время до заголовков — у него свое окно
+                    health.record_success(header_latency=latency)
+                else:
+                    health.record_success(latency)
+                logger.info(
+                    "Upstream request succeeded in %.3fs",
+                    latency,
+                    extra={
+                        "model": model,
+                        "attempt": attempt + 1,
+                        "latency_seconds": round(latency, 3),
+                    },
+                )
                 return response, latency
 
+            if stream:
+                await response.aread()
+                await response.aclose()
+
             if response.status_code == 429:
+                UPSTREAM_RATE_LIMITED.inc(model)
                 if attempt < max_retries:
-                    delay = base_delay * (2**attempt)
-                    logger.warning(f"Rate limit (429). Retry after {delay}s")
-                    await asyncio.sleep(delay)
-                    continue
+                    # с лимитером пауза — внутри limiter.acquire() (тоже в пределах дедлайна)
+                    delay = 0.0
+                    if limiter is None:
+                        delay = parse_retry_after(
+                            response.headers.get("retry-after")
+                        ) or base_delay * (2**attempt)
+                    if _retry_fits(deadline, delay, model, attempt):
+                        if delay:
+                            logger.warning(
+                                "Rate limit (429). Retry after %ss",
+                                delay,
+                                extra={"model": model, "attempt": attempt + 1, "status": 429},
+                            )
+                            await asyncio.sleep(delay)
+                        continue
                 raise HTTPException(
                     status_code=429,
-                    detail=f"Rate limit exceeded after {max_retries+1} attempts.",
+                    detail=f"Rate limit exceeded after {attempt + 1} attempts.",
                 )
 
-            if 500 <= response.status_code <= 599 and attempt < max_retries:
-                delay = base_delay * (2**attempt)
-                logger.warning(f"Server error {response.status_code}, retry")
+            if 500 <= response.status_code <= 599:
+                health.record_failure()
+            delay = base_delay * (2**attempt)
+            if (
+                500 <= response.status_code <= 599
+                and attempt < max_retries
+                and _retry_fits(deadline, delay, model, attempt)
+            ):
+                logger.warning(
+                    "Server error %s, retry",
+                    response.status_code,
+                    extra={
+                        "model": model,
+                        "attempt": attempt + 1,
+                        "status": response.status_code,
+                        "latency_seconds": round(latency, 3),
+                    },
+                )
                 await asyncio.sleep(delay)
                 continue
 
             raise HTTPException(status_code=response.status_code, detail=response.text)
 
-        except requests.exceptions.Timeout:
-            if attempt < max_retries:
-                delay = base_delay * (2**attempt)
-                logger.warning("Timeout, retry")
+        except (httpx.TimeoutException, asyncio.TimeoutError):
+            UPSTREAM_REQUESTS.inc(model, "timeout")
+            health.record_failure()
+            delay = base_delay * (2**attempt)
+            if attempt < max_retries and _retry_fits(deadline, delay, model, attempt):
+                logger.warning(
+                    "Timeout, retry", extra={"model": model, "attempt": attempt + 1}
+                )
                 await asyncio.sleep(delay)
                 continue
-            logger.error("Timeout after retries", exc_info=True)
+            logger.error(
+                "Timeout after retries",
+                exc_info=True,
+                extra={"model": model, "attempt": attempt + 1},
+            )
+            if deadline.remaining() < DEADLINE_MIN_ATTEMPT_SECONDS:
+                raise deadline.exceeded(model, "upstream")
             raise HTTPException(status_code=408, detail="Request timeout after retries")
 
-        except requests.exceptions.RequestException as e:
-            if attempt < max_retries:
-                delay = base_delay * (2**attempt)
-                logger.warning(f"Network error, retry: {str(e)}")
+        except httpx.HTTPError as e:
+            UPSTREAM_REQUESTS.inc(model, "error")
+            health.record_failure()
+            delay = base_delay * (2**attempt)
+            if attempt < max_retries and _retry_fits(deadline, delay, model, attempt):
+                logger.warning(
+                    "Network error, retry: %s",
+                    e,
+                    extra={"model": model, "attempt": attempt + 1},
+                )
                 await asyncio.sleep(delay)
                 continue
-            logger.error("Network error after retries", exc_info=True)
+            logger.error(
+                "Network error after retries",
+                exc_info=True,
+                extra={"model": model, "attempt": attempt + 1},
+            )
             raise HTTPException(status_code=503, detail="Network error after retries")
 
     raise HTTPException(status_code=500, detail="Unexpected error in retry logic")
 
 
-async def stream_generator(response) -> AsyncGenerator[str, None]:
+async def collect_stream(response: httpx.Response) -> dict:
+    """Дочитывает SSE-ответ OpenRouter, запоминая момент прихода каждой дельты.
+
+    Возвращает текст, usage из последнего чанка (если апстрим его прислал),
+    моменты time.perf_counter() для каждой непустой дельты и момент конца.
+    """
+    parts = []
+    chunk_times = []
+    usage = {}
     try:
-        for line in response.iter_lines():
-            if line:
-                line_str = line.decode("utf-8")
-                if line_str.startswith("data: "):
-                    data_str = line_str[6:]
-                    if data_str.strip() == "[DONE]":
-                        break
-                    try:
-                        data = json.loads(data_str)
-                        if "choices" in data and data["choices"]:
-                            delta = data["choices"][0].get("delta", {})
-                            content = delta.get("content", "")
-                            if content:
-                                yield f"data: {json.dumps({'content': content})}\n\n"
-                    except json.JSONDecodeError:
-                        continue
+        async for line_str in response.aiter_lines():
+            if not line_str.startswith("data: "):
+                continue
+            data_str = line_str[6:]
+            if data_str.startswith("[DONE]"):
+                break
+            try:
+                data = json.loads(data_str)
+            except json.JSONDecodeError:
+                continue
+            if data.get("usage"):
+                usage = data["usage"]
+            choices = data.get("choices")
+            if choices:
+                content = choices[0].get("delta", {}).get("content")
+                if content:
+                    chunk_times.append(time.perf_counter())
+                    parts.append(content)
+    finally:
+        await response.aclose()
+
+    return {
+        "text": "".join(parts),
+        "usage": usage,
+        "chunk_times": chunk_times,
+        "ended_at": time.perf_counter(),
+    }
+
+
+DISCONNECT_CHECK_INTERVAL = 0.5
 
-        yield f"data: {json.dumps({'done': True})}\n\n"
+
+async def _client_gone(request: Optional[Request], state: dict) -> bool:
+    """Проверяет отключение клиента не чаще раза в DISCONNECT_CHECK_INTERVAL секунд."""
+    if request is None:
+        return False
+    now = time.monotonic()
+    if now - state.get("checked_at", 0.0) < DISCONNECT_CHECK_INTERVAL:
+        return False
+    state["checked_at"] = now
+    return await request.is_disconnected()
+
+
+def _stream_finished(model: str, started: float, completed: bool) -> None:
+    """Длительность дочитанного потока — в окно модели, оборванного — в метрики отмен."""
+    if not model:
+        return
+    elapsed = time.perf_counter() - started
+    if completed:
+        model_health.get(model).record_stream(elapsed)
+    else:
+        record_cancelled(
+            "generate_stream", model, 1, expected_remaining(model, elapsed, stream=True)
+        )
+
+
+async def stream_generator(
+    response: httpx.Response,
+    request: Optional[Request] = None,
+    on_complete: Optional[Callable[[str, int], Awaitable[None]]] = None,
+    model: str = "",
+) -> AsyncGenerator[str, None]:
+    """Преобразует SSE OpenRouter в поток {'content': ...} событий.
+
+    Следующий чанк читается из апстрима только после того, как предыдущий
+    отдан клиенту, поэтому медленный клиент притормаживает и апстрим. При
+    отключении клиента апстрим-запрос закрывается, а оборванный поток
+    учитывается в метриках отмен. Если поток дочитан до конца, вызывается
+    on_complete(полный текст, total_tokens).
+    """
+    state: dict = {}
+    parts = [] if on_complete is not None else None
+    tokens_used = 0
+    # метрики обновляются один раз за поток, а не на каждый кадр
+    sent = 0
+    started = time.perf_counter()
+    completed = False
+    ACTIVE_STREAMS.inc(model)
+    try:
+        async for line_str in response.aiter_lines():
+            if not line_str.startswith("data: "):
+                # пустые строки-разделители и комментарии keep-alive (": ...")
+                continue
+            data_str = line_str[6:]
+            if data_str.startswith("[DONE]"):
+                break
+            if await _client_gone(request, state):
+                return
+            if '"content"' not in data_str and '"usage"' not in data_str:
+                continue
+            try:
+                data = json.loads(data_str)
+            except json.JSONDecodeError:
+                continue
+            if data.get("usage"):
+                tokens_used = data["usage"].get("total_tokens", 0)
+            choices = data.get("choices")
+            if choices:
+                content = choices[0].get("delta", {}).get("content")
+                if content:
+                    if parts is not None:
+                        parts.append(content)
+                    frame = f'data: {{"content": {json.dumps(content)}}}\n\n'
+                    sent += len(frame)
+                    yield frame
+
+        completed = True
+        if on_complete is not None:
+            await on_complete("".join(parts), tokens_used)
+        yield 'data: {"done": true}\n\n'
+    except asyncio.CancelledError:
+        logger.warning("Stream cancelled, closing upstream connection")
+        raise
     except Exception as e:
+        completed = True  # оборвал апстрим, а не клиент
         logger.error(f"stream_generator error: {e}", exc_info=True)
         yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    finally:
+        _stream_finished(model, started, completed)
+        ACTIVE_STREAMS.dec(model)
+        STREAMED_BYTES.inc(model, amount=sent)
+        await response.aclose()
+
+
+async def raw_stream_generator(
+    response: httpx.Response, request: Optional[Request] = None, model: str = ""
+) -> AsyncGenerator[bytes, None]:
+    """Пробрасывает SSE-кадры OpenRouter клиенту как есть, без перекодирования."""
+    state: dict = {}
+    sent = 0
+    started = time.perf_counter()
+    completed = False
+    ACTIVE_STREAMS.inc(model)
+    try:
+        async for chunk in response.aiter_bytes():
+            if await _client_gone(request, state):
+                return
+            sent += len(chunk)
+            yield chunk
+        completed = True
+    except asyncio.CancelledError:
+        logger.warning("Stream cancelled, closing upstream connection")
+        raise
+    except Exception as e:
+        completed = True
+        logger.error(f"raw_stream_generator error: {e}", exc_info=True)
+        yield f"data: {json.dumps({'error': str(e)})}\n\n".encode("utf-8")
+    finally:
+        _stream_finished(model, started, completed)
+        ACTIVE_STREAMS.dec(model)
+        STREAMED_BYTES.inc(model, amount=sent)
+        await response.aclose()
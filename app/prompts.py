@@ -0,0 +1,184 @@
+import asyncio
+import codecs
+import csv
+import json
+import os
+import shutil
+import tempfile
+from typing import IO, Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from .config import setup_logging
+
+logger = setup_logging()
+
+PROMPT_FORMATS = ("txt", "csv", "jsonl")
+# Размер куска, которым читается файл промптов
+PROMPT_READ_CHUNK = 64 * 1024
+# Поля промпта, которые можно задать в CSV/JSONL помимо самого текста
+PROMPT_FIELDS = {"max_tokens": int, "temperature": float}
+
+
+def detect_format(filename: Optional[str], prompt_format: str = "auto") -> str:
+    """Формат файла промптов: явно заданный или по расширению (по умолчанию txt)."""
+    if prompt_format != "auto":
+        if prompt_format not in PROMPT_FORMATS:
+            raise ValueError(
+                f"prompt_format must be one of: auto, {', '.join(PROMPT_FORMATS)}"
+            )
+        return prompt_format
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext == ".csv":
+        return "csv"
+    if ext in (".jsonl", ".ndjson"):
+        return "jsonl"
+    return "txt"
+
+
+def _prompt_item(prompt: Any, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Промпт с необязательными max_tokens/temperature; None, если строку нужно пропустить."""
+    if not isinstance(prompt, str) or not prompt.strip():
+        return None
+    item: Dict[str, Any] = {"prompt": prompt.strip()}
+    for name, cast in PROMPT_FIELDS.items():
+        value = fields.get(name)
+        if value not in (None, ""):
+            item[name] = cast(value)
+    return item
+
+
+class PromptSource:
+    """Промпты из файла (txt, csv или jsonl), которые читаются по мере отправки.
+
+    Загрузку к этому моменту уже целиком принял Starlette (во временный
+    файл, большие — на диск). Файл читается кусками по PROMPT_READ_CHUNK в
+    отдельном потоке и разбирается построчно, так что в памяти одновременно
+    только текущий кусок и промпты, ждущие в очереди бенчмарка, а первые
+    запросы уходят до того, как файл разобран. Для нескольких прогонов
+    файл читается заново (он должен поддерживать seek). count — число
+    промптов, известно после первого полного прохода.
+
+    txt — по промпту на строку; csv — колонка prompt (или первая колонка,
+    если заголовка prompt нет), поддерживает многострочные промпты в
+    кавычках; jsonl — по объекту на строку: {"prompt": ..., "max_tokens": ...,
+    "temperature": ...} или просто строка. Строки, которые не удалось
+    разобрать, пропускаются с предупреждением в логе.
+    """
+
+    def __init__(self, file: IO[bytes], prompt_format: str = "txt", owned: bool = False):
+        self.file = file
+        self.format = prompt_format
+        self.owned = owned
+        self.count: Optional[int] = None
+        self.skipped = 0
+
+    @classmethod
+    async def spooled(cls, file: IO[bytes], prompt_format: str = "txt") -> "PromptSource":
+        """Копия загрузки во временный файл — для фоновых джобов, переживающих запрос."""
+
+        def copy() -> IO[bytes]:
+            file.seek(0)
+            spool = tempfile.TemporaryFile()
+            shutil.copyfileobj(file, spool, PROMPT_READ_CHUNK)
+            return spool
+
+        return cls(await asyncio.to_thread(copy), prompt_format, owned=True)
+
+    async def _lines(self) -> AsyncIterator[str]:
+        await asyncio.to_thread(self.file.seek, 0)
+        decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        tail = ""
+        while True:
+            chunk = await asyncio.to_thread(self.file.read, PROMPT_READ_CHUNK)
+            try:
+                text = tail + decoder.decode(chunk, final=not chunk)
+            except UnicodeDecodeError:
+                raise ValueError("File must be UTF-8")
+            lines = text.split("\n")
+            tail = lines.pop()
+            for line in lines:
+                yield line.rstrip("\r")
+            if not chunk:
+                break
+        if tail:
+            yield tail.rstrip("\r")
+
+    def _parse_csv(
+        self, records: List[str], header: Optional[List[str]]
+    ) -> Iterator[Dict[str, Any]]:
+        for row in csv.reader(records):
+            if not row:
+                continue
+            if header is not None:
+                fields = dict(zip(header, row))
+                item = _prompt_item(fields.get("prompt"), fields)
+            else:
+                item = _prompt_item(row[0], {})
+            if item is not None:
+                yield item
+
+    def _parse_json(self, line: str) -> Optional[Dict[str, Any]]:
+        if not line.strip():
+            return None
+        data = json.loads(line)
+        if isinstance(data, str):
+            return _prompt_item(data, {})
+        if not isinstance(data, dict):
+            raise ValueError("expected an object or a string")
+        return _prompt_item(data.get("prompt"), data)
+
+    async def items(self) -> AsyncIterator[Dict[str, Any]]:
+        """Один проход по файлу: словари {"prompt", [max_tokens], [temperature]}."""
+        count = 0
+        skipped = 0
+        header: Optional[List[str]] = None
+        first_row = True
+        record: List[str] = []
+        quotes = 0
+        async for line in self._lines():
+            try:
+                if self.format == "txt":
+                    item = _prompt_item(line, {})
+                    parsed = [item] if item is not None else []
+                elif self.format == "jsonl":
+                    item = self._parse_json(line)
+                    parsed = [item] if item is not None else []
+                else:
+                    # запись CSV закончена, когда кавычки в ней сбалансированы
+                    record.append(line + "\n")
+                    quotes += line.count('"')
+                    if quotes % 2:
+                        continue
+                    records, record, quotes = record, [], 0
+                    if first_row:
+                        first_row = False
+                        row = next(csv.reader(records), [])
+                        names = [name.strip().lower() for name in row]
+                        if "prompt" in names:
+                            header = names
+                            continue
+                    parsed = list(self._parse_csv(records, header))
+            except (ValueError, TypeError) as e:
+                skipped += 1
+                logger.warning("Skipping malformed prompt line: %s", e)
+                continue
+            for item in parsed:
+                count += 1
+                yield item
+        if record:
+            logger.warning("Skipping unterminated quoted CSV record at end of file")
+        self.count = count
+        self.skipped = skipped
+
+    async def first(self) -> Optional[Dict[str, Any]]:
+        """Первый промпт (проверка файла до запуска бенчмарка) или None, если их нет."""
+        items = self.items()
+        try:
+            async for item in items:
+                return item
+            return None
+        finally:
+            await items.aclose()
+
+    def close(self) -> None:
+        if self.owned:
+            self.file.close()
@@ -0,0 +1,255 @@
+import asyncio
+import sqlite3
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Mapping, Optional, TypeVar
+
+from fastapi import HTTPException
+
+from .config import (
+    setup_logging,
+    RATE_LIMIT_INITIAL_RPS,
+    RATE_LIMIT_MIN_RPS,
+    RATE_LIMIT_MAX_RPS,
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_INCREASE_RPS,
+    RATE_LIMIT_MAX_WAIT_SECONDS,
+)
+from .shared import SharedState, shared_state
+
+logger = setup_logging()
+
+T = TypeVar("T")
+
+# Поля состояния лимитера, которые хранятся в общей базе при нескольких воркерах
+_SHARED_FIELDS = (
+    "rate",
+    "tokens",
+    "updated",
+    "paused_until",
+    "upstream_limit",
+    "upstream_remaining",
+    "throttled",
+)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After в секундах: число секунд или HTTP-дата."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """X-RateLimit-Reset → через сколько секунд окно сбросится.
+
+    OpenRouter присылает epoch в миллисекундах; поддерживаются также epoch в
+    секундах и относительное число секунд.
+    """
+    if not value:
+        return None
+    try:
+        reset = float(value)
+    except ValueError:
+        return None
+    if reset > 1e12:
+        reset = reset / 1000 - time.time()
+    elif reset > 1e9:
+        reset = reset - time.time()
+    return max(reset, 0.0)
+
+
+class ModelRateLimiter:
+    """Token bucket одной модели с адаптивной скоростью.
+
+    Запросы ждут токен в FIFO-очереди вместо того, чтобы уходить в апстрим и
+    получать 429. Скорость растет аддитивно на успешных ответах, падает вдвое
+    на 429 и подстраивается под X-RateLimit-Remaining / X-RateLimit-Reset;
+    Retry-After ставит модель на паузу для всех ожидающих сразу.
+
+    С shared (несколько воркеров) ведро одно на все процессы: каждое взятие
+    токена и учет ответа — транзакция над состоянием в общей базе, а время
+    берется по часам системы (time.time), одинаковым для всех воркеров.
+    clock подменяет часы (в тестах).
+    """
+
+    def __init__(
+        self,
+        model: str,
+        rate: float = RATE_LIMIT_INITIAL_RPS,
+        burst: float = RATE_LIMIT_BURST,
+        shared: Optional[SharedState] = None,
+        clock: Optional[Callable[[], float]] = None,
+    ):
+        self.model = model
+        self.shared = shared
+        self._clock = clock or (time.time if shared is not None else time.monotonic)
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = self._clock()
+        self.paused_until = 0.0
+        self.queue_depth = 0
+        self.upstream_limit: Optional[int] = None
+        self.upstream_remaining: Optional[int] = None
+        self.throttled = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _apply_shared(self, fn: Callable[[float], T]) -> T:
+        """fn над состоянием из общей базы; измененное состояние записывается обратно."""
+
+        def apply(state: Optional[Dict[str, Any]]):
+            if state is not None:
+                for name in _SHARED_FIELDS:
+                    setattr(self, name, state[name])
+            result = fn(self._clock())
+            return {name: getattr(self, name) for name in _SHARED_FIELDS}, result
+
+        return self.shared.update("ratelimit", self.model, apply)
+
+    async def _apply(self, fn: Callable[[float], T]) -> T:
+        if self.shared is None:
+            return fn(self._clock())
+        return await asyncio.to_thread(self._apply_shared, fn)
+
+    def _take(self, now: float) -> float:
+        """Берет токен (0) или возвращает, сколько еще ждать."""
+        self._refill(now)
+        wait = self.paused_until - now
+        if wait <= 0:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            wait = (1 - self.tokens) / self.rate
+        return wait
+
+    async def acquire(self, max_wait: float = RATE_LIMIT_MAX_WAIT_SECONDS) -> float:
+        """Ждет свой токен; возвращает время ожидания в секундах.
+
+        Если до освобождения квоты дольше max_wait, сразу отвечает 429 вместо
+        того, чтобы держать запрос в очереди.
+        """
+        start = self._clock()
+        self.queue_depth += 1
+        try:
+            async with self._lock:
+                while True:
+                    try:
+                        wait = await self._apply(self._take)
+                    except sqlite3.Error as e:
+                        # общая база недоступна — не блокируем запросы
+                        logger.warning(
+                            "Shared rate limit read failed: %s", e, extra={"model": self.model}
+                        )
+                        return self._clock() - start
+                    now = self._clock()
+                    if wait <= 0:
+                        return now - start
+                    if now - start + wait > max_wait:
+                        raise HTTPException(
+                            status_code=429,
+                            detail=f"Rate limit for {self.model}: quota frees up in {wait:.1f}s",
+                            headers={"Retry-After": str(int(wait) + 1)},
+                        )
+                    await asyncio.sleep(wait)
+        finally:
+            self.queue_depth -= 1
+
+    async def observe(self, status_code: int, headers: Mapping[str, str]) -> Optional[float]:
+        """Учитывает ответ апстрима; для 429 возвращает паузу до следующей попытки."""
+        try:
+            return await self._apply(lambda now: self._observe(now, status_code, headers))
+        except sqlite3.Error as e:
+            logger.warning("Shared rate limit update failed: %s", e, extra={"model": self.model})
+            return None
+
+    def _observe(
+        self, now: float, status_code: int, headers: Mapping[str, str]
+    ) -> Optional[float]:
+        self._refill(now)
+
+        limit = headers.get("x-ratelimit-limit")
+        remaining = headers.get("x-ratelimit-remaining")
+        reset_in = parse_reset(headers.get("x-ratelimit-reset"))
+        if limit and limit.isdigit():
+            self.upstream_limit = int(limit)
+        if remaining and remaining.lstrip("-").isdigit():
+            self.upstream_remaining = max(int(remaining), 0)
+            self.tokens = min(self.tokens, self.upstream_remaining)
+            if reset_in:
+                if self.upstream_remaining == 0:
+                    self.paused_until = max(self.paused_until, now + reset_in)
+                else:
+                    self.rate = self._clamp(self.upstream_remaining / reset_in)
+
+        if status_code == 429:
+            self.throttled += 1
+            self.rate = self._clamp(self.rate / 2)
+            self.tokens = 0
+            pause = parse_retry_after(headers.get("retry-after"))
+            if pause is None:
+                pause = reset_in if reset_in else 1 / self.rate
+            self.paused_until = max(self.paused_until, now + pause)
+            logger.warning(
+                "Rate limit (429) for %s: pausing %.1fs, rate lowered to %.2f rps",
+                self.model,
+                pause,
+                self.rate,
+                extra={"model": self.model, "status": 429},
+            )
+            return pause
+
+        if 200 <= status_code < 300 and self.upstream_remaining != 0:
+            self.rate = self._clamp(self.rate + RATE_LIMIT_INCREASE_RPS)
+        return None
+
+    @staticmethod
+    def _clamp(rate: float) -> float:
+        return min(max(rate, RATE_LIMIT_MIN_RPS), RATE_LIMIT_MAX_RPS)
+
+    def stats(self) -> Dict[str, Any]:
+        now = self._clock()
+        return {
+            "rate_rps": round(self.rate, 3),
+            "burst": self.capacity,
+            "tokens": round(min(self.capacity, self.tokens + (now - self.updated) * self.rate), 2),
+            "queue_depth": self.queue_depth,
+            "paused_for_seconds": round(max(self.paused_until - now, 0.0), 2),
+            "upstream_limit": self.upstream_limit,
+            "upstream_remaining": self.upstream_remaining,
+            "throttled_429": self.throttled,
+        }
+
+
+class RateLimiterRegistry:
+    """Лимитеры по моделям (/generate и /benchmark делят квоту).
+
+    Без shared — общие для процесса, с shared — для всех воркеров.
+    """
+
+    def __init__(self, shared: Optional[SharedState] = None):
+        self.shared = shared
+        self._limiters: Dict[str, ModelRateLimiter] = {}
+
+    def get(self, model: str) -> ModelRateLimiter:
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            limiter = self._limiters[model] = ModelRateLimiter(model, shared=self.shared)
+        return limiter
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {model: limiter.stats() for model, limiter in self._limiters.items()}
+
+
+rate_limiters = RateLimiterRegistry(shared_state)
@@ -0,0 +1,263 @@
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+import httpx
+from pydantic import BaseModel
+from pydantic_settings import (
+    BaseSettings,
+    JsonConfigSettingsSource,
+    PydanticBaseSettingsSource,
+    SettingsConfigDict,
+)
+
+from .config import (
+    setup_logging,
+    AVAILABLE_MODELS,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_POOL_TIMEOUT,
+    OPENROUTER_MODELS_URL,
+)
+from .shared import SharedState, shared_state
+
+logger = setup_logging()
+
+# Снимок каталога в общей базе (при нескольких воркерах его качает один)
+CATALOG_NAMESPACE = "model_catalog"
+# Пауза перед повтором, если каталог не удалось скачать
+CATALOG_RETRY_SECONDS = 60.0
+
+
+class ModelSettings(BaseModel):
+    """Параметры запросов к модели; у модели задаются только отличия от defaults."""
+
+    connect_timeout: float = HTTP_CONNECT_TIMEOUT
+    read_timeout: float = 60.0
+    max_retries: int = 3
+    retry_base_delay: float = 1.0  # пауза перед повтором: base * 2**attempt
+    max_concurrency: int = 0  # запросов к модели одновременно на воркер (0 — без лимита)
+    max_tokens_limit: Optional[int] = None  # потолок max_tokens (None — без потолка)
+    temperature: float = 0.7  # если temperature не передан в запросе
+    deadline_seconds: float = 90.0  # общий бюджет запроса, если клиент не задал свой
+
+
+class RegistrySettings(BaseSettings):
+    """Настройки реестра моделей: переменные MODEL_REGISTRY_* и JSON-файл.
+
+    Пример: MODEL_REGISTRY_DEFAULTS__READ_TIMEOUT=90,
+    MODEL_REGISTRY_MODELS='{"moonshotai/kimi-k2:free": {"max_concurrency": 4}}'
+    или тот же JSON ({"defaults": ..., "models": ...}) в файле
+    MODEL_REGISTRY_FILE. Переменные окружения важнее файла.
+    """
+
+    model_config = SettingsConfigDict(
+        env_prefix="MODEL_REGISTRY_", env_nested_delimiter="__", extra="ignore"
+    )
+
+    file: Optional[str] = None
+    defaults: ModelSettings = ModelSettings()
+    models: Dict[str, ModelSettings] = {}
+    # Каталог апстрима (GET /models): обновляется в фоне раз в catalog_ttl_seconds,
+    # модели с catalog_filter в id (пусто — все) добавляются к списку
+    catalog_enabled: bool = False
+    catalog_ttl_seconds: float = 3600.0
+    catalog_filter: str = ":free"
+
+    @classmethod
+    def settings_customise_sources(
+        cls,
+        settings_cls: Type[BaseSettings],
+        init_settings: PydanticBaseSettingsSource,
+        env_settings: PydanticBaseSettingsSource,
+        dotenv_settings: PydanticBaseSettingsSource,
+        file_secret_settings: PydanticBaseSettingsSource,
+    ) -> Tuple[PydanticBaseSettingsSource, ...]:
+        path = env_settings().get("file")
+        sources = [init_settings, env_settings, dotenv_settings]
+        if path:
+            sources.append(JsonConfigSettingsSource(settings_cls, json_file=path))
+        return (*sources, file_secret_settings)
+
+
+class ModelSpec:
+    """Итоговые параметры модели и заранее собранные части запроса к ней."""
+
+    def __init__(
+        self,
+        name: str,
+        settings: ModelSettings,
+        semaphore: Optional[asyncio.Semaphore],
+        info: Optional[Dict[str, Any]] = None,
+    ):
+        info = info or {}
+        self.name = name
+        self.settings = settings
+        self.max_retries = settings.max_retries
+        self.retry_base_delay = settings.retry_base_delay
+        self.temperature = settings.temperature
+        self.context_length: Optional[int] = info.get("context_length")
+        limits = [
+            limit
+            for limit in (settings.max_tokens_limit, info.get("max_completion_tokens"))
+            if limit
+        ]
+        self.max_tokens_limit: Optional[int] = min(limits) if limits else None
+        self.timeout = httpx.Timeout(
+            settings.read_timeout, connect=settings.connect_timeout, pool=HTTP_POOL_TIMEOUT
+        )
+        self.semaphore = semaphore
+
+    def clamp_max_tokens(self, max_tokens: Optional[int]) -> Optional[int]:
+        """max_tokens запроса не больше лимита модели; не заданный — сам лимит."""
+        if self.max_tokens_limit is None:
+            return max_tokens
+        if max_tokens is None:
+            return self.max_tokens_limit
+        return min(max_tokens, self.max_tokens_limit)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            **self.settings.model_dump(),
+            "max_tokens_limit": self.max_tokens_limit,
+            "context_length": self.context_length,
+        }
+
+
+def parse_catalog(data: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Ответ GET /models → {id: {context_length, max_completion_tokens}}."""
+    catalog = {}
+    for item in data.get("data") or []:
+        if not isinstance(item, dict) or not item.get("id"):
+            continue
+        provider = item.get("top_provider") or {}
+        catalog[item["id"]] = {
+            "context_length": item.get("context_length") or provider.get("context_length"),
+            "max_completion_tokens": provider.get("max_completion_tokens"),
+        }
+    return catalog
+
+
+class ModelRegistry:
+    """Реестр моделей: проверка модели и ее параметры — поиск в словаре.
+
+    Список — AVAILABLE_MODELS, модели из настроек и (если включено) модели
+    из снимка каталога апстрима. Каталог обновляется фоновой задачей
+    (keep_catalog_fresh), так что /models и проверка запросов читают только
+    готовый снимок и никогда не ходят в апстрим. При обновлении снимка
+    словарь спецификаций пересобирается целиком и подменяется одной ссылкой.
+    """
+
+    def __init__(
+        self,
+        settings: RegistrySettings,
+        static_models: List[str],
+        shared: Optional[SharedState] = None,
+    ):
+        self.settings = settings
+        self.shared = shared
+        self._static = list(dict.fromkeys([*static_models, *settings.models]))
+        self._catalog: Dict[str, Dict[str, Any]] = {}
+        self.catalog_updated_at: Optional[float] = None
+        self.catalog_errors = 0
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._specs: Dict[str, ModelSpec] = {}
+        self._names: List[str] = []
+        self._rebuild()
+
+    def _settings_for(self, name: str) -> ModelSettings:
+        override = self.settings.models.get(name)
+        if override is None:
+            return self.settings.defaults
+        return self.settings.defaults.model_copy(
+            update=override.model_dump(exclude_unset=True)
+        )
+
+    def _spec(self, name: str) -> ModelSpec:
+        settings = self._settings_for(name)
+        semaphore = None
+        if settings.max_concurrency > 0:
+            # семафор переживает пересборку реестра, чтобы не потерять занятые слоты
+            semaphore = self._semaphores.get(name)
+            if semaphore is None:
+                semaphore = self._semaphores[name] = asyncio.Semaphore(
+                    settings.max_concurrency
+                )
+        return ModelSpec(name, settings, semaphore, self._catalog.get(name))
+
+    def _rebuild(self) -> None:
+        names = list(self._static)
+        pattern = self.settings.catalog_filter
+        names += [
+            name for name in self._catalog if name not in self._static and pattern in name
+        ]
+        self._specs = {name: self._spec(name) for name in names}
+        self._names = names
+
+    def __contains__(self, model: str) -> bool:
+        return model in self._specs
+
+    def names(self) -> List[str]:
+        return self._names
+
+    def get(self, model: str) -> ModelSpec:
+        """Параметры модели; для модели не из реестра — параметры по умолчанию."""
+        spec = self._specs.get(model)
+        return spec if spec is not None else self._spec(model)
+
+    def set_catalog(self, catalog: Dict[str, Dict[str, Any]], updated_at: float) -> None:
+        missing = [name for name in self._static if name not in catalog]
+        if missing:
+            logger.warning("Models not found in upstream catalog: %s", ", ".join(missing))
+        self._catalog = catalog
+        self.catalog_updated_at = updated_at
+        self._rebuild()
+
+    async def _shared_snapshot(self) -> Optional[Dict[str, Any]]:
+        if self.shared is None:
+            return None
+        snapshot = await asyncio.to_thread(self.shared.get, CATALOG_NAMESPACE, "snapshot")
+        if snapshot and time.time() - snapshot["updated_at"] < self.settings.catalog_ttl_seconds:
+            return snapshot
+        return None
+
+    async def refresh_catalog(self, client: httpx.AsyncClient, headers: Dict[str, str]) -> None:
+        """Обновляет снимок каталога (свежий снимок другого воркера берется из общей базы)."""
+        snapshot = await self._shared_snapshot()
+        if snapshot is None:
+            response = await client.get(OPENROUTER_MODELS_URL, headers=headers)
+            response.raise_for_status()
+            snapshot = {"updated_at": time.time(), "models": parse_catalog(response.json())}
+            if self.shared is not None:
+                await asyncio.to_thread(self.shared.set, CATALOG_NAMESPACE, "snapshot", snapshot)
+        if snapshot["updated_at"] != self.catalog_updated_at:
+            self.set_catalog(snapshot["models"], snapshot["updated_at"])
+            logger.info("Model catalog updated: %d models", len(snapshot["models"]))
+
+    async def keep_catalog_fresh(
+        self,
+        get_client: Callable[[], httpx.AsyncClient],
+        get_headers: Callable[[], Dict[str, str]],
+    ) -> None:
+        """Фоновая задача: обновляет каталог раз в TTL, при ошибке — через минуту."""
+        ttl = self.settings.catalog_ttl_seconds
+        while True:
+            try:
+                await self.refresh_catalog(get_client(), get_headers())
+                delay = ttl
+            except (httpx.HTTPError, ValueError) as e:
+                self.catalog_errors += 1
+                logger.warning("Model catalog refresh failed: %s", e)
+                delay = min(ttl, CATALOG_RETRY_SECONDS)
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "models": len(self._names),
+            "catalog_enabled": self.settings.catalog_enabled,
+            "catalog_models": len(self._catalog),
+            "catalog_updated_at": self.catalog_updated_at,
+            "catalog_errors": self.catalog_errors,
+        }
+
+
+model_registry = ModelRegistry(RegistrySettings(), AVAILABLE_MODELS, shared_state)
@@ -0,0 +1,247 @@
+import html
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from .sketch import QuantileSketch
+
+# Строк в одной странице таблицы (отдельный <tbody>, который браузер
+# пропускает при отрисовке, пока тот вне экрана — content-visibility)
+REPORT_PAGE_SIZE = 500
+HISTOGRAM_BINS = 20
+# Примерная высота строки таблицы в px для contain-intrinsic-size
+ROW_HEIGHT_PX = 38
+
+_STYLE = """
+        body { font-family: Arial, sans-serif; margin: 20px; }
+        .header { background-color: #f0f0f0; padding: 20px; border-radius: 5px; margin-bottom: 20px; }
+        .stats { display: flex; flex-wrap: wrap; gap: 20px; margin-bottom: 20px; }
+        .stat-box { background-color: #e8f4fd; padding: 15px; border-radius: 5px; flex: 1; min-width: 260px; }
+        .hist { font-size: 12px; }
+        .hist-row { display: flex; align-items: center; gap: 6px; }
+        .hist-label { width: 120px; text-align: right; white-space: nowrap; }
+        .hist-bar { background-color: #4a90d9; height: 10px; }
+        .pages a { margin-right: 6px; }
+        table { border-collapse: collapse; width: 100%; }
+        th, td { border: 1px solid #ddd; padding: 8px; text-align: left; }
+        th { background-color: #f2f2f2; position: sticky; top: 0; }
+        tbody.page { content-visibility: auto; }
+        .number { text-align: right; }
+"""
+
+_COLUMNS = [
+    ("run_id", "Run", False),
+    ("prompt_id", "Prompt ID", False),
+    ("model", "Model", False),
+    ("prompt", "Prompt (truncated)", False),
+    ("response", "Response (truncated)", False),
+    ("latency_seconds", "Latency (s)", True),
+    ("tokens_used", "Tokens Used", True),
+    ("response_length", "Response Length", True),
+]
+
+_STREAM_COLUMNS = [
+    ("ttft_seconds", "TTFT (s)", True),
+    ("itl_mean_seconds", "ITL mean (s)", True),
+    ("tokens_per_second", "Tokens/s", True),
+]
+
+
+def _e(value: Any) -> str:
+    return html.escape("" if value is None else str(value))
+
+
+def model_latency_sketches(results: Iterable[Dict[str, Any]]) -> Dict[str, QuantileSketch]:
+    """Скетчи латентности по моделям за один проход по строкам."""
+    sketches: Dict[str, QuantileSketch] = {}
+    for row in results:
+        model = row.get("model") or ""
+        sketch = sketches.get(model)
+        if sketch is None:
+            sketch = sketches[model] = QuantileSketch()
+        sketch.add(row["latency_seconds"])
+    return sketches
+
+
+def _stats_box(title: str, stats: Dict[str, Any], unit: str = "") -> str:
+    return (
+        f'<div class="stat-box"><h3>{_e(title)}</h3>'
+        f"<p>Average: {_e(stats.get('avg', '-'))}{unit}</p>"
+        f"<p>Min / Max: {_e(stats.get('min', '-'))}{unit} / {_e(stats.get('max', '-'))}{unit}</p>"
+        f"<p>Std Dev: {_e(stats.get('std_dev', '-'))}{unit}</p>"
+        f"<p>p50 / p90 / p95 / p99: {_e(stats.get('p50', '-'))}{unit} / "
+        f"{_e(stats.get('p90', '-'))}{unit} / {_e(stats.get('p95', '-'))}{unit} / "
+        f"{_e(stats.get('p99', '-'))}{unit}</p></div>"
+    )
+
+
+def _histogram_box(model: str, sketch: QuantileSketch) -> str:
+    bins = sketch.histogram(HISTOGRAM_BINS)
+    peak = max((n for _, _, n in bins), default=0) or 1
+    parts = [
+        f'<div class="stat-box"><h3>Latency: {_e(model)}</h3>',
+        f"<p>n={sketch.count}, p50 {sketch.quantile(50):.3f}s, "
+        f"p95 {sketch.quantile(95):.3f}s, p99 {sketch.quantile(99):.3f}s</p>",
+        '<div class="hist">',
+    ]
+    for low, high, n in bins:
+        parts.append(
+            f'<div class="hist-row"><span class="hist-label">{low:.3f}–{high:.3f}s</span>'
+            f'<span class="hist-bar" style="width:{n / peak * 60:.1f}%"></span>'
+            f"<span>{n}</span></div>"
+        )
+    parts.append("</div></div>")
+    return "".join(parts)
+
+
+def _comparison_table(comparison: Dict[str, Dict[str, Any]]) -> str:
+    head = "".join(
+        f"<th>{title}</th>"
+        for title in (
+            "Model", "Requests", "Error rate", "Latency p50 (s)", "p95 (s)", "p99 (s)",
+            "TTFT p50 (s)", "TTFT p95 (s)", "Tokens/s p50", "Requests/s",
+        )
+    )
+    rows = []
+    for model, entry in comparison.items():
+        latency = entry.get("latency_stats") or {}
+        ttft = entry.get("ttft_stats") or {}
+        tps = entry.get("tokens_per_second_stats") or {}
+        values = (
+            entry.get("requests"),
+            f"{entry.get('error_rate', 0):.1%}",
+            latency.get("p50", "-"),
+            latency.get("p95", "-"),
+            latency.get("p99", "-"),
+            ttft.get("p50", "-"),
+            ttft.get("p95", "-"),
+            tps.get("p50", "-"),
+            entry.get("requests_per_second", "-"),
+        )
+        cells = "".join(f'<td class="number">{_e(v)}</td>' for v in values)
+        rows.append(f"<tr><td>{_e(model)}</td>{cells}</tr>")
+    return f"<table><thead><tr>{head}</tr></thead><tbody>{''.join(rows)}</tbody></table>"
+
+
+def _page_links(total_rows: int, page_size: int) -> str:
+    pages = (total_rows + page_size - 1) // page_size
+    if pages <= 1:
+        return ""
+    links = "".join(f'<a href="#page-{i + 1}">{i + 1}</a>' for i in range(pages))
+    return f'<p class="pages">Pages: {links}</p>'
+
+
+def page_navigation(page: int, pages: int, page_size: int) -> str:
+    """Ссылки на соседние страницы отчета, который строится по хранилищу."""
+    links = []
+    if page > 1:
+        links.append(f'<a href="?page={page - 1}&amp;page_size={page_size}">&larr; Prev</a>')
+    links.append(f"Page {page} of {pages}")
+    if page < pages:
+        links.append(f'<a href="?page={page + 1}&amp;page_size={page_size}">Next &rarr;</a>')
+    return f'<p class="pages">{" ".join(links)}</p>'
+
+
+def render_benchmark_report(
+    results: Iterable[Dict[str, Any]],
+    latency_stats: Dict[str, Any],
+    tokens_stats: Dict[str, Any],
+    model: str,
+    runs: Optional[int],
+    wall_time_seconds: Optional[float] = None,
+    requests_per_second: Optional[float] = None,
+    stream_stats: Optional[Dict[str, Dict[str, Any]]] = None,
+    model_sketches: Optional[Dict[str, QuantileSketch]] = None,
+    total_rows: Optional[int] = None,
+    page_size: int = REPORT_PAGE_SIZE,
+    navigation: str = "",
+    comparison: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> Iterator[str]:
+    """HTML-отчет бенчмарка, который отдается кусками (для StreamingResponse).
+
+    Строки выводятся страницами по page_size в отдельных <tbody> с
+    content-visibility: браузер не верстает страницы вне экрана. Все
+    значения экранируются. Стоимость линейна по числу строк: каждая строка
+    форматируется один раз, кусок страницы собирается через join.
+    Если model_sketches не переданы, они считаются по results (тогда
+    results должен быть списком). comparison — сравнение моделей из
+    многомодельного бенчмарка, выводится таблицей перед гистограммами.
+    """
+    if model_sketches is None:
+        results = list(results)
+        model_sketches = model_latency_sketches(results)
+    if total_rows is None:
+        total_rows = len(results) if isinstance(results, list) else latency_stats.get("count", 0)
+
+    columns = list(_COLUMNS)
+    if stream_stats:
+        columns += _STREAM_COLUMNS
+    columns.append(("timestamp", "Timestamp", False))
+
+    yield (
+        "<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n"
+        f"<title>Benchmark Results - {_e(model)}</title>\n"
+        f"<style>{_STYLE}        tbody.page {{ contain-intrinsic-size: auto {page_size * ROW_HEIGHT_PX}px; }}\n</style>\n"
+        "</head>\n<body>\n"
+        '<div class="header"><h1>Benchmark Results</h1>'
+        f"<p><strong>Model:</strong> {_e(model)}</p>"
+        f"<p><strong>Runs:</strong> {_e(runs if runs is not None else '-')}</p>"
+        f"<p><strong>Total Requests:</strong> {total_rows}</p>"
+        f"<p><strong>Wall Time:</strong> {_e(wall_time_seconds if wall_time_seconds is not None else '-')}s</p>"
+        f"<p><strong>Requests/s:</strong> {_e(requests_per_second if requests_per_second is not None else '-')}</p>"
+        f"<p><strong>Generated at:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>"
+        "</div>\n"
+    )
+
+    boxes = [
+        _stats_box("Latency Statistics", latency_stats, "s"),
+        _stats_box("Token Statistics", tokens_stats),
+    ]
+    if stream_stats:
+        ttft = stream_stats.get("ttft_stats") or {}
+        itl = stream_stats.get("itl_stats") or {}
+        tps = stream_stats.get("tokens_per_second_stats") or {}
+        boxes.append(
+            '<div class="stat-box"><h3>Streaming Statistics</h3>'
+            f"<p>TTFT avg / p50 / p95: {_e(ttft.get('avg', '-'))}s / {_e(ttft.get('p50', '-'))}s / {_e(ttft.get('p95', '-'))}s</p>"
+            f"<p>Inter-token p50 / p95 / p99: {_e(itl.get('p50', '-'))}s / {_e(itl.get('p95', '-'))}s / {_e(itl.get('p99', '-'))}s</p>"
+            f"<p>Tokens/s avg / p50: {_e(tps.get('avg', '-'))} / {_e(tps.get('p50', '-'))}</p></div>"
+        )
+    yield f'<div class="stats">{"".join(boxes)}</div>\n'
+
+    if comparison:
+        yield f"<h2>Model comparison</h2>{_comparison_table(comparison)}\n"
+
+    histograms = [
+        _histogram_box(name, sketch)
+        for name, sketch in sorted(model_sketches.items())
+        if sketch.count
+    ]
+    if histograms:
+        yield f'<h2>Latency by model</h2><div class="stats">{"".join(histograms)}</div>\n'
+
+    head = "".join(
+        f'<th class="number">{_e(title)}</th>' if numeric else f"<th>{_e(title)}</th>"
+        for _, title, numeric in columns
+    )
+    yield (
+        f"<h2>Detailed Results</h2>{navigation or _page_links(total_rows, page_size)}"
+        f"<table><thead><tr>{head}</tr></thead>\n"
+    )
+
+    page: List[str] = []
+    page_number = 0
+    for row in results:
+        cells = "".join(
+            f'<td class="number">{_e(row.get(key))}</td>' if numeric else f"<td>{_e(row.get(key))}</td>"
+            for key, _, numeric in columns
+        )
+        page.append(f"<tr>{cells}</tr>")
+        if len(page) >= page_size:
+            page_number += 1
+            yield f'<tbody class="page" id="page-{page_number}">{"".join(page)}</tbody>\n'
+            page = []
+    if page:
+        page_number += 1
+        yield f'<tbody class="page" id="page-{page_number}">{"".join(page)}</tbody>\n'
+
+    yield f"</table>{navigation}\n</body>\n</html>\n"
@@ -0,0 +1,175 @@
+import asyncio
+import csv
+import os
+import re
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import (
+    setup_logging,
+    BENCHMARK_RESULTS_DIR,
+    RESULTS_FLUSH_EVERY,
+    RESULTS_FSYNC_INTERVAL,
+)
+from .store import result_store
+from .utils import clean_result_row
+
+logger = setup_logging()
+
+BENCHMARK_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Типы колонок для чтения уже записанных строк при возобновлении бенчмарка
+_INT_FIELDS = {"run_id", "prompt_id", "tokens_used", "response_length"}
+_FLOAT_FIELDS = {
+    "latency_seconds",
+    "ttft_seconds",
+    "itl_mean_seconds",
+    "itl_p95_seconds",
+    "tokens_per_second",
+}
+
+
+def new_benchmark_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def results_path(benchmark_id: str) -> str:
+    """Путь к CSV бенчмарка; id проверяется, чтобы не выйти за пределы каталога."""
+    if not BENCHMARK_ID_RE.match(benchmark_id):
+        raise ValueError(f"Invalid benchmark id: {benchmark_id!r}")
+    return os.path.join(BENCHMARK_RESULTS_DIR, f"benchmark_{benchmark_id}.csv")
+
+
+def _parse_row(row: Dict[str, str]) -> Dict[str, Any]:
+    parsed: Dict[str, Any] = {}
+    for key, value in row.items():
+        if value in ("", None):
+            parsed[key] = None
+        elif key in _INT_FIELDS:
+            parsed[key] = int(value)
+        elif key in _FLOAT_FIELDS:
+            parsed[key] = float(value)
+        else:
+            parsed[key] = value
+    return parsed
+
+
+def load_results(benchmark_id: str) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """Читает уже записанные строки бенчмарка; возвращает (колонки, строки).
+
+    Оборванная при падении последняя строка пропускается.
+    """
+    path = results_path(benchmark_id)
+    rows: List[Dict[str, Any]] = []
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        fieldnames = list(reader.fieldnames or [])
+        for row in reader:
+            if None in row or any(row.get(k) is None for k in fieldnames):
+                continue
+            try:
+                rows.append(_parse_row(row))
+            except ValueError:
+                logger.warning(f"Skipping malformed row in {path}: {row}")
+    return fieldnames, rows
+
+
+def _truncate_partial_line(path: str) -> None:
+    """Обрезает недописанную при падении последнюю строку, чтобы дописывать с новой."""
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        block = min(size, 64 * 1024)
+        while True:
+            f.seek(size - block)
+            tail = f.read(block)
+            cut = tail.rfind(b"\n")
+            if cut != -1:
+                f.truncate(size - block + cut + 1)
+                return
+            if block == size:
+                f.truncate(0)
+                return
+            block = min(size, block * 2)
+
+
+class ResultWriter:
+    """Дописывает результаты бенчмарка в CSV построчно по мере готовности.
+
+    Запись буферизуется; flush + fsync выполняются каждые RESULTS_FLUSH_EVERY
+    строк или RESULTS_FSYNC_INTERVAL секунд, так что при падении теряется не
+    больше последней пачки строк. Та же пачка записывается в общее
+    хранилище результатов (app/store.py), если оно включено.
+    """
+
+    def __init__(self, benchmark_id: str, fieldnames: List[str]):
+        self.benchmark_id = benchmark_id
+        self.path = results_path(benchmark_id)
+        self.fieldnames = fieldnames
+        os.makedirs(BENCHMARK_RESULTS_DIR, exist_ok=True)
+        if os.path.exists(self.path):
+            _truncate_partial_line(self.path)
+        is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        # BOM только в начале нового файла, чтобы Excel правильно открыл UTF-8
+        self._file = open(
+            self.path, "a", newline="", encoding="utf-8-sig" if is_new else "utf-8"
+        )
+        self._writer = csv.DictWriter(self._file, fieldnames=fieldnames)
+        if is_new:
+            self._writer.writeheader()
+        self._pending = 0
+        self._store_rows: List[Dict[str, Any]] = []
+        self._synced_at = time.monotonic()
+
+    def _fsync(self) -> None:
+        os.fsync(self._file.fileno())
+
+    async def write(self, row: Dict[str, Any]) -> None:
+        self._writer.writerow(clean_result_row(row, self.fieldnames))
+        if result_store is not None:
+            self._store_rows.append(row)
+        self._pending += 1
+        if (
+            self._pending >= RESULTS_FLUSH_EVERY
+            or time.monotonic() - self._synced_at >= RESULTS_FSYNC_INTERVAL
+        ):
+            await self.flush()
+
+    async def flush(self) -> None:
+        if self._pending:
+            self._pending = 0
+            # flush в ОС быстрый и делается здесь; медленный fsync — в потоке
+            self._file.flush()
+            await asyncio.to_thread(self._fsync)
+        if self._store_rows:
+            rows, self._store_rows = self._store_rows, []
+            await result_store.insert(self.benchmark_id, rows)
+        self._synced_at = time.monotonic()
+
+    async def close(self) -> None:
+        try:
+            await self.flush()
+        finally:
+            self._file.close()
+
+
+def open_result_writer(
+    benchmark_id: Optional[str], fieldnames: List[str], resume: bool = False
+) -> Tuple[ResultWriter, List[Dict[str, Any]]]:
+    """Открывает файл бенчмарка; при возобновлении возвращает уже записанные строки."""
+    previous: List[Dict[str, Any]] = []
+    if benchmark_id is None:
+        benchmark_id = new_benchmark_id()
+    elif resume:
+        existing_fields, previous = load_results(benchmark_id)
+        if existing_fields != fieldnames:
+            raise ValueError(
+                "Results file columns do not match this benchmark mode (stream flag)"
+            )
+    return ResultWriter(benchmark_id, fieldnames), previous
@@ -1,16 +1,113 @@
-from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form
-from fastapi.responses import JSONResponse, StreamingResponse, HTMLResponse
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form, Query
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from pydantic import ValidationError
+from contextlib import asynccontextmanager
 from datetime import datetime
-import statistics
+import asyncio
+import json
+import os
+import time
+from typing import Any, List, Optional, Tuple
 
-from .config import setup_logging, AVAILABLE_MODELS
-from .models import GenerateRequest, GenerateResponse, BenchmarkResponse
-from .openrouter import make_openrouter_request_with_retry, stream_generator
-from .utils import create_benchmark_html_table, save_results_csv
+from .config import (
+    setup_logging,
+    MAX_BENCHMARK_CONCURRENCY,
+    BATCH_MAX_ITEMS,
+    BATCH_DEFAULT_CONCURRENCY,
+    MAX_BATCH_CONCURRENCY,
+    CACHE_ENABLED,
+    SINGLEFLIGHT_ENABLED,
+    WORKERS,
+    METRICS_SYNC_INTERVAL,
+)
+from .models import (
+    GenerateRequest,
+    GenerateResponse,
+    BatchGenerateRequest,
+    BenchmarkResponse,
+)
+from .openrouter import (
+    make_openrouter_request_with_retry,
+    stream_generator,
+    raw_stream_generator,
+    start_http_client,
+    close_http_client,
+    get_http_client,
+    upstream_headers,
+)
+from .cache import response_cache, make_cache_key, replay_stream
+from .singleflight import single_flight
+from .ratelimit import rate_limiters
+from .hedging import model_health, hedged_call
+from .benchmark import execute_benchmark, STREAM_STATS_KEYS
+from .jobs import job_manager
+from .store import result_store
+from .shared import shared_state
+from .registry import model_registry
+from .deadline import Deadline, request_deadline
+from .disconnect import (
+    cancel_on_disconnect,
+    expected_remaining,
+    record_cancelled,
+    remaining_time,
+)
+from .metrics import registry, track_request
+from .report import render_benchmark_report, page_navigation, REPORT_PAGE_SIZE
+from .sketch import QuantileSketch
+from .prompts import PromptSource, detect_format
+from .logs import RequestContextMiddleware, bind_log_context, log_stats
+from .log_analytics import analyze_logs, DEFAULT_BUCKET_SECONDS
 
 logger = setup_logging()
 
-app_openrouter = FastAPI(title="OpenRouter API Proxy", version="1.0.0")
+
+async def _publish_metrics() -> None:
+    """Раз в METRICS_SYNC_INTERVAL кладет снимок метрик воркера в общую базу."""
+    while True:
+        try:
+            await asyncio.to_thread(registry.publish, shared_state)
+        except Exception as e:
+            logger.warning(f"Failed to publish metrics: {e}")
+        await asyncio.sleep(METRICS_SYNC_INTERVAL)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Владеет общим HTTP-клиентом к OpenRouter на время жизни приложения."""
+    await start_http_client()
+    catalog = None
+    if model_registry.settings.catalog_enabled:
+        catalog = asyncio.create_task(
+            model_registry.keep_catalog_fresh(get_http_client, upstream_headers)
+        )
+    metrics_sync = None
+    if shared_state is not None:
+        metrics_sync = asyncio.create_task(_publish_metrics())
+    try:
+        yield
+    finally:
+        if catalog is not None:
+            catalog.cancel()
+        if metrics_sync is not None:
+            metrics_sync.cancel()
+            # gauge остановленного воркера больше не входят в сумму, счетчики — остаются
+            try:
+                await asyncio.to_thread(registry.publish, shared_state, False)
+            except Exception as e:
+                logger.warning(f"Failed to publish metrics: {e}")
+        await job_manager.shutdown()
+        await close_http_client()
+        response_cache.close()
+        if result_store is not None:
+            result_store.close()
+        if shared_state is not None:
+            shared_state.close()
+
+
+app_openrouter = FastAPI(
+    title="OpenRouter API Proxy", version="1.0.0", lifespan=lifespan
+)
+app_openrouter.add_middleware(RequestContextMiddleware)
 
 
 @app_openrouter.exception_handler(Exception)
@@ -22,132 +119,704 @@ async def general_exception_handler(request: Request, exc: Exception):
 
 @app_openrouter.get("/models")
 async def get_models():
-    """Возвращает список доступных моделей."""
-    return {"models": AVAILABLE_MODELS}
+    """Доступные модели и их параметры (из реестра, без запроса к апстриму)."""
+    return {
+        "models": model_registry.names(),
+        "details": {
+            name: model_registry.get(name).describe() for name in model_registry.names()
+        },
+        "catalog_updated_at": model_registry.catalog_updated_at,
+    }
+
+
+async def _complete(
+    request: GenerateRequest,
+    cache_key: Optional[str],
+    model: Optional[str] = None,
+    deadline: Optional[Deadline] = None,
+) -> dict:
+    """Нестриминговый запрос к OpenRouter; результат при необходимости кладется в кэш."""
+    response, latency = await make_openrouter_request_with_retry(
+        request.prompt,
+        model or request.model,
+        request.max_tokens,
+        False,
+        request.temperature,
+        deadline,
+    )
+
+    data = response.json()
+    if "choices" not in data or not data["choices"]:
+        raise HTTPException(status_code=500, detail="Invalid response from OpenRouter")
+
+    generated_text = data["choices"][0]["message"]["content"]
+    tokens_used = data.get("usage", {}).get("total_tokens", 0)
+
+    if cache_key is not None and generated_text:
+        await response_cache.set(
+            cache_key, {"response": generated_text, "tokens_used": tokens_used}
+        )
+    return {"response": generated_text, "tokens_used": tokens_used, "latency": latency}
+
+
+async def _hedged_complete(
+    request: GenerateRequest, cache_key: Optional[str], deadline: Optional[Deadline] = None
+) -> dict:
+    """_complete с hedging: при медленном ответе гонит страхующий запрос параллельно."""
+    start = time.perf_counter()
+
+    async def call(model: str) -> dict:
+        # ответ другой модели не кладем в кэш под ключом исходной;
+        # страхующий запрос живет в том же дедлайне
+        return await _complete(
+            request, cache_key if model == request.model else None, model, deadline
+        )
+
+    result, model, hedged = await hedged_call(
+        request.model, call, request.fallback_model, model_registry.names()
+    )
+    return {
+        **result,
+        "latency": time.perf_counter() - start,
+        "model": model,
+        "hedged": hedged,
+    }
+
+
+async def _open_stream(
+    request: GenerateRequest,
+    cache_key: Optional[str],
+    http_request: Optional[Request] = None,
+    deadline: Optional[Deadline] = None,
+):
+    """Открывает потоковый запрос к OpenRouter и возвращает генератор SSE-кадров."""
+    response, _ = await make_openrouter_request_with_retry(
+        request.prompt,
+        request.model,
+        request.max_tokens,
+        True,
+        request.temperature,
+        deadline,
+    )
+    if request.raw_stream:
+        return raw_stream_generator(response, http_request, request.model)
+
+    async def cache_stream(text: str, tokens_used: int) -> None:
+        if text:
+            await response_cache.set(cache_key, {"response": text, "tokens_used": tokens_used})
+
+    on_complete = cache_stream if cache_key is not None else None
+    return stream_generator(response, http_request, on_complete, request.model)
+
+
+def _typical_seconds(models: List[str], stream: bool = False) -> float:
+    """Средняя типичная длительность запроса к моделям (0, пока окна пусты)."""
+    known = [model for model in models if model in model_registry]
+    if not known:
+        return 0.0
+    return sum(expected_remaining(model, 0.0, stream) for model in known) / len(known)
+
+
+def _model_label(model: str) -> str:
+    """Метка модели для метрик: произвольные строки из запроса не плодят серии."""
+    return model if model in model_registry else "unsupported"
 
 
 @app_openrouter.post("/generate")
-async def generate_text(request: GenerateRequest):
-    """Генерация ответа: проксирует запрос в OpenRouter и возвращает результат."""
-    if request.model not in AVAILABLE_MODELS:
+async def generate_text(request: GenerateRequest, http_request: Request):
+    """Генерация ответа: проксирует запрос в OpenRouter и возвращает результат.
+
+    Одинаковые одновременные запросы схлопываются в один вызов апстрима;
+    при стриминге каждый подписчик получает те же дельты из общего потока.
+    """
+    endpoint = "generate_stream" if request.stream else "generate"
+    with track_request(endpoint, _model_label(request.model)):
+        return await _generate(request, http_request)
+
+
+async def _generate(
+    request: GenerateRequest, http_request: Request, watch_disconnect: bool = True
+):
+    bind_log_context(model=request.model)
+    if request.model not in model_registry:
         raise HTTPException(status_code=400, detail="Model not supported")
+    if request.fallback_model and request.fallback_model not in model_registry:
+        raise HTTPException(status_code=400, detail="Fallback model not supported")
+    # бюджет времени: заголовок клиента или deadline_seconds модели из реестра
+    deadline = request_deadline(
+        http_request, model_registry.get(request.model).settings.deadline_seconds
+    )
 
-    response, latency = await make_openrouter_request_with_retry(
-        request.prompt, request.model, request.max_tokens, request.stream
+    request_key = make_cache_key(
+        request.model, request.prompt, request.max_tokens, request.temperature
     )
+    cache_key = None
+    if CACHE_ENABLED and not request.no_cache and not request.raw_stream:
+        lookup_start = time.perf_counter()
+        cache_key = request_key
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            if request.stream:
+                return StreamingResponse(
+                    replay_stream(cached["response"]),
+                    media_type="text/event-stream",
+                    headers={"X-Cache": "HIT", **deadline.header()},
+                )
+            return GenerateResponse(
+                response=cached["response"],
+                tokens_used=cached["tokens_used"],
+                latency_seconds=round(time.perf_counter() - lookup_start, 3),
+                cached=True,
+                model=request.model,
+                deadline=deadline.describe(),
+            )
+
+    # ушедший клиент отменяет запрос к апстриму вместе с ожиданием квоты и
+    # повторами (пачка /generate/batch следит за отключением сама)
+    watched = http_request if watch_disconnect else None
+    label = _model_label(request.model)
 
     if request.stream:
+        cache_header = {"X-Cache": "MISS" if cache_key else "BYPASS", **deadline.header()}
+
+        def stream_estimate(_: float) -> Tuple[float, float]:
+            # поток еще не начался — сэкономлен он весь; дальше отмену учитывает
+            # stream_generator, когда StreamingResponse закрывает его при отключении
+            return 1, expected_remaining(request.model, 0.0, stream=True)
+
+        if not SINGLEFLIGHT_ENABLED:
+            source = await cancel_on_disconnect(
+                watched,
+                _open_stream(request, cache_key, http_request, deadline),
+                "generate_stream",
+                label,
+                stream_estimate,
+            )
+            return StreamingResponse(
+                source, media_type="text/event-stream", headers=cache_header
+            )
+
+        mode = "raw" if request.raw_stream else "sse"
+        frames, shared = await cancel_on_disconnect(
+            watched,
+            single_flight.stream(
+                f"{request_key}:{mode}",
+                lambda: _open_stream(request, cache_key, deadline=deadline),
+            ),
+            "generate_stream",
+            label,
+            stream_estimate,
+        )
         return StreamingResponse(
-            stream_generator(response), media_type="text/event-stream"
+            frames,
+            media_type="text/event-stream",
+            headers={**cache_header, "X-Coalesced": "1" if shared else "0"},
         )
 
-    data = response.json()
-    if "choices" not in data or not data["choices"]:
-        raise HTTPException(status_code=500, detail="Invalid response from OpenRouter")
+    if request.hedge:
+        flight_key = f"{request_key}:hedge:{request.fallback_model or ''}"
+        complete = lambda: _hedged_complete(request, cache_key, deadline)  # noqa: E731
+    else:
+        flight_key = request_key
+        complete = lambda: _complete(request, cache_key, deadline=deadline)  # noqa: E731
 
-    generated_text = data["choices"][0]["message"]["content"]
-    tokens_used = data.get("usage", {}).get("total_tokens", 0)
+    async def run() -> Tuple[dict, bool]:
+        if SINGLEFLIGHT_ENABLED:
+            return await single_flight.do(flight_key, complete)
+        return await complete(), False
+
+    # дольше своего дедлайна не ждем и схлопнутый запрос другого клиента
+    result, shared = await cancel_on_disconnect(
+        watched,
+        deadline.run(run(), request.model, "response"),
+        "generate",
+        label,
+        lambda elapsed: (1, expected_remaining(request.model, elapsed)),
+    )
 
     return GenerateResponse(
-        response=generated_text,
-        tokens_used=tokens_used,
-        latency_seconds=round(latency, 3),
+        response=result["response"],
+        tokens_used=result["tokens_used"],
+        latency_seconds=round(result["latency"], 3),
+        coalesced=shared,
+        model=result.get("model", request.model),
+        hedged=result.get("hedged", False),
+        deadline=deadline.describe(),
     )
 
 
+@app_openrouter.post("/generate/batch")
+async def generate_batch(batch: BatchGenerateRequest, http_request: Request):
+    """Пачка запросов /generate одним вызовом; ответ — NDJSON в порядке готовности.
+
+    Элементы выполняются параллельно (не больше concurrency одновременно)
+    тем же путем, что и /generate: кэш, схлопывание одинаковых запросов,
+    hedging. Каждая строка ответа — {"index", "status", "result"} или
+    {"index", "status", "error"}: ошибка одного элемента не прерывает пачку.
+    Если клиент отключился, невыполненные элементы отменяются.
+    """
+    with track_request("generate_batch", "multiple"):
+        if not batch.items:
+            raise HTTPException(status_code=400, detail="No items provided")
+        if len(batch.items) > BATCH_MAX_ITEMS:
+            raise HTTPException(
+                status_code=400, detail=f"Batch is limited to {BATCH_MAX_ITEMS} items"
+            )
+        concurrency = batch.concurrency or BATCH_DEFAULT_CONCURRENCY
+        if not 1 <= concurrency <= MAX_BATCH_CONCURRENCY:
+            raise HTTPException(
+                status_code=400,
+                detail=f"concurrency must be between 1 and {MAX_BATCH_CONCURRENCY}",
+            )
+        return StreamingResponse(
+            _batch_lines(batch.items, concurrency, http_request),
+            media_type="application/x-ndjson",
+        )
+
+
+async def _batch_item(index: int, raw: Any, http_request: Request) -> str:
+    try:
+        item = GenerateRequest.model_validate(raw)
+    except ValidationError as e:
+        line = {"index": index, "status": 422, "error": e.errors(include_url=False)}
+        return json.dumps(line, ensure_ascii=False, default=str) + "\n"
+    try:
+        with track_request("generate_batch_item", _model_label(item.model)):
+            if item.stream:
+                raise HTTPException(
+                    status_code=400, detail="Streaming is not supported in batch"
+                )
+            result = await _generate(item, http_request, watch_disconnect=False)
+        line = {"index": index, "status": 200, "result": result.model_dump()}
+    except HTTPException as e:
+        line = {"index": index, "status": e.status_code, "error": e.detail}
+    except Exception as e:
+        logger.error(f"Batch item {index} failed: {e}", exc_info=True)
+        line = {"index": index, "status": 500, "error": "Internal server error"}
+    return json.dumps(line, ensure_ascii=False) + "\n"
+
+
+async def _batch_lines(items: List[Any], concurrency: int, http_request: Request):
+    """Воркеры разбирают элементы из общего итератора; строки уходят по мере готовности."""
+    done: asyncio.Queue = asyncio.Queue()
+    pending = iter(enumerate(items))
+
+    async def worker() -> None:
+        for index, item in pending:
+            await done.put(await _batch_item(index, item, http_request))
+
+    workers = [
+        asyncio.create_task(worker()) for _ in range(min(concurrency, len(items)))
+    ]
+    start = time.monotonic()
+    sent = 0
+    try:
+        for _ in range(len(items)):
+            yield await done.get()
+            sent += 1
+    finally:
+        for task in workers:
+            task.cancel()
+        if sent < len(items):
+            # клиент ушел: недоделанные элементы отменены или так и не отправлены
+            remaining = len(items) - sent
+            if sent:
+                saved = remaining_time(time.monotonic() - start, sent, remaining)
+            else:
+                models = [item.get("model") for item in items if isinstance(item, dict)]
+                typical = _typical_seconds([m for m in models if isinstance(m, str)])
+                saved = remaining * typical / min(concurrency, len(items))
+            record_cancelled("generate_batch", "multiple", remaining, saved)
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+async def _prompt_source(
+    prompt_file: UploadFile, prompt_format: str, spool: bool
+) -> PromptSource:
+    """Источник промптов из загрузки; для фоновых джобов — копия во временном файле.
+
+    Тело запроса Starlette уже сохранил во временный файл; здесь он не
+    разбирается целиком: проверяется только, что в нем есть хотя бы один
+    промпт, остальное разбирается по мере отправки запросов.
+    """
+    try:
+        fmt = detect_format(prompt_file.filename, prompt_format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if spool:
+        source = await PromptSource.spooled(prompt_file.file, fmt)
+    else:
+        source = PromptSource(prompt_file.file, fmt)
+    try:
+        first = await source.first()
+    except ValueError as e:
+        source.close()
+        raise HTTPException(status_code=400, detail=str(e))
+    if first is None:
+        source.close()
+        raise HTTPException(status_code=400, detail="No prompts provided")
+    return source
+
+
 @app_openrouter.post("/benchmark")
 async def benchmark_model(
+    http_request: Request,
     prompt_file: UploadFile = File(...),
-    model: str = Form("deepseek/deepseek-chat-v3.1:free"),
+    model: List[str] = Form(["deepseek/deepseek-chat-v3.1:free"]),
     runs: int = Form(5),
     visualize: bool = Form(False),
+    concurrency: int = Form(1),
+    stream: bool = Form(False),
+    resume_id: Optional[str] = Form(None),
+    background: bool = Form(False),
+    prompt_format: str = Form("auto"),
 ):
-    """Проводит бенчмарк модели по файлу промптов; сохраняет CSV и опционально возвращает HTML."""
-    if model not in AVAILABLE_MODELS:
-        raise HTTPException(status_code=400, detail="Model not supported")
+    """Проводит бенчмарк модели по файлу промптов; сохраняет CSV и опционально возвращает HTML.
 
-    content = await prompt_file.read()
-    try:
-        prompts_text = content.decode("utf-8")
-    except Exception:
-        raise HTTPException(status_code=400, detail="File must be UTF-8")
+    Результаты дописываются в CSV бенчмарка построчно по мере готовности;
+    с resume_id прерванный бенчмарк продолжается с того места, где остановился.
+    С background=true бенчмарк запускается фоновым джобом и сразу
+    возвращается его id (см. GET /benchmark/{job_id}).
 
-    prompts = [l.strip() for l in prompts_text.split("\n") if l.strip()]
-    if not prompts:
-        raise HTTPException(status_code=400, detail="No prompts provided")
+    Несколько моделей (повторяющееся поле model или список через запятую)
+    прогоняются вперемешку в одном пуле по одним и тем же промптам; в ответе
+    comparison — статистика каждой модели за этот общий прогон.
 
-    all_results = []
-    latencies = []
-    token_counts = []
+    Файл промптов (txt, csv или jsonl — по prompt_format или расширению)
+    Starlette принимает во временный файл, а разбирается он по мере отправки
+    запросов, поэтому размер файла не ограничен памятью; в csv/jsonl у
+    промпта могут быть свои max_tokens и temperature.
 
-    for run_id in range(runs):
-        for prompt_id, prompt in enumerate(prompts):
-            try:
-                response, latency = await make_openrouter_request_with_retry(
-                    prompt, model
-                )
-                data = response.json()
-                generated_text = data["choices"][0]["message"]["content"]
-                tokens_used = data.get("usage", {}).get("total_tokens", 0)
-
-                r = {
-                    "run_id": run_id + 1,
-                    "prompt_id": prompt_id + 1,
-                    "prompt": prompt[:100] + ("..." if len(prompt) > 100 else ""),
-                    "response": generated_text[:100]
-                    + ("..." if len(generated_text) > 100 else ""),
-                    "model": model,
-                    "latency_seconds": round(latency, 3),
-                    "tokens_used": tokens_used,
-                    "response_length": len(generated_text),
-                    "timestamp": datetime.now().isoformat(),
-                }
-                all_results.append(r)
-                latencies.append(latency)
-                token_counts.append(tokens_used)
-            except Exception as e:
-                logger.error(f"Error during benchmark request: {e}", exc_info=True)
-                continue
+    Если клиент синхронного бенчмарка отключился, прогон отменяется вместе
+    с запросами в полете; уже готовые строки остаются в CSV (фоновые джобы
+    от соединения не зависят).
+    """
+    models = _parse_models(model)
+    label = _model_label(models[0]) if len(models) == 1 else "multiple"
+    with track_request("benchmark", label):
+        return await _benchmark(
+            http_request,
+            label,
+            prompt_file,
+            models,
+            runs,
+            visualize,
+            concurrency,
+            stream,
+            resume_id,
+            background,
+            prompt_format,
+        )
 
-    if not latencies:
-        raise HTTPException(status_code=500, detail="No successful requests")
 
-    latency_stats = {
-        "avg": round(statistics.mean(latencies), 3),
-        "min": round(min(latencies), 3),
-        "max": round(max(latencies), 3),
-        "std_dev": round(statistics.stdev(latencies) if len(latencies) > 1 else 0, 3),
-        "total": round(sum(latencies), 3),
-    }
-    tokens_stats = {
-        "avg": round(statistics.mean(token_counts), 1),
-        "min": min(token_counts),
-        "max": max(token_counts),
-        "std_dev": round(
-            statistics.stdev(token_counts) if len(token_counts) > 1 else 0, 1
-        ),
-    }
+def _parse_models(values: List[str]) -> List[str]:
+    """Модели бенчмарка без повторов, в порядке указания."""
+    models: List[str] = []
+    for value in values:
+        for name in value.split(","):
+            name = name.strip()
+            if name and name not in models:
+                models.append(name)
+    return models
 
-    csv_filename = "benchmark_results.csv"
-    save_results_csv(all_results, csv_filename)
 
-    html_table = None
+async def _benchmark(
+    http_request: Request,
+    label: str,
+    prompt_file: UploadFile,
+    models: List[str],
+    runs: int,
+    visualize: bool,
+    concurrency: int,
+    stream: bool,
+    resume_id: Optional[str],
+    background: bool,
+    prompt_format: str,
+):
+    bind_log_context(model=", ".join(models))
+    if not models:
+        raise HTTPException(status_code=400, detail="No models provided")
+    unsupported = [m for m in models if m not in model_registry]
+    if unsupported:
+        raise HTTPException(
+            status_code=400, detail=f"Model not supported: {', '.join(unsupported)}"
+        )
+    if not 1 <= concurrency <= MAX_BENCHMARK_CONCURRENCY:
+        raise HTTPException(
+            status_code=400,
+            detail=f"concurrency must be between 1 and {MAX_BENCHMARK_CONCURRENCY}",
+        )
+    if background and visualize:
+        raise HTTPException(
+            status_code=400, detail="visualize is not supported for background jobs"
+        )
+
+    prompts = await _prompt_source(prompt_file, prompt_format, spool=background)
+
+    if background:
+        try:
+            job = await job_manager.submit(
+                prompts, models, runs, concurrency, stream, resume_id
+            )
+        except OverflowError as e:
+            prompts.close()
+            raise HTTPException(status_code=429, detail=str(e))
+        except ValueError as e:
+            prompts.close()
+            raise HTTPException(status_code=409, detail=str(e))
+        return JSONResponse(
+            status_code=202,
+            content={
+                "job_id": job.id,
+                "status": job.status,
+                "status_url": f"/benchmark/{job.id}",
+                "events_url": f"/benchmark/{job.id}/events",
+            },
+        )
+
+    finished = 0
+
+    async def count_result(_: dict) -> None:
+        nonlocal finished
+        finished += 1
+
+    def count_error(_: str) -> None:
+        nonlocal finished
+        finished += 1
+
+    def estimate(elapsed: float) -> Tuple[float, float]:
+        # сколько запросов не выполнено: весь план известен после первого прохода
+        # по файлу и без resume, иначе — хотя бы те, что были в полете
+        remaining = concurrency
+        if prompts.count is not None and resume_id is None:
+            remaining = max(runs * prompts.count * len(models) - finished, 0)
+        if finished:
+            return remaining, remaining_time(elapsed, finished, remaining)
+        # ни один запрос еще не завершился — по типичной длительности моделей
+        return remaining, remaining * _typical_seconds(models, stream) / concurrency
+
+    try:
+        outcome = await cancel_on_disconnect(
+            http_request,
+            execute_benchmark(
+                prompts,
+                models,
+                runs,
+                concurrency,
+                stream,
+                benchmark_id=resume_id,
+                resume=resume_id is not None,
+                on_result=count_result,
+                on_error=count_error,
+                keep_results=visualize,
+            ),
+            "benchmark",
+            label,
+            estimate,
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Benchmark to resume not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    summary = outcome["summary"]
+    if summary is None:
+        raise HTTPException(status_code=500, detail="No successful requests")
+
     if visualize:
-        html_table = create_benchmark_html_table(
-            all_results, latency_stats, tokens_stats, model, runs
+        report = render_benchmark_report(
+            outcome["results"],
+            summary["latency_stats"],
+            summary["tokens_stats"],
+            summary["model"],
+            runs,
+            wall_time_seconds=summary["wall_time_seconds"],
+            requests_per_second=summary["requests_per_second"],
+            stream_stats={k: summary[k] for k in STREAM_STATS_KEYS if k in summary},
+            comparison=summary.get("comparison"),
         )
-        return HTMLResponse(content=html_table)
-
-    return BenchmarkResponse(
-        model=model,
-        runs=runs,
-        total_prompts=len(prompts),
-        latency_stats=latency_stats,
-        tokens_stats=tokens_stats,
-        results_file=csv_filename,
-        html_table=html_table,
+        return StreamingResponse(report, media_type="text/html; charset=utf-8")
+
+    return BenchmarkResponse(**summary)
+
+
+async def _get_job(job_id: str):
+    job = await job_manager.find(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Benchmark job not found")
+    return job
+
+
+@app_openrouter.get("/benchmark/{job_id}")
+async def get_benchmark_job(job_id: str):
+    """Статус фонового бенчмарка, частичная статистика и итог после завершения."""
+    return (await _get_job(job_id)).snapshot()
+
+
+@app_openrouter.get("/benchmark/{job_id}/events")
+async def benchmark_job_events(job_id: str):
+    """SSE-поток прогресса фонового бенчмарка (completed, p50/p95, ошибки)."""
+    job = await _get_job(job_id)
+    return StreamingResponse(job_manager.events(job), media_type="text/event-stream")
+
+
+@app_openrouter.delete("/benchmark/{job_id}")
+async def cancel_benchmark_job(job_id: str):
+    """Отменяет фоновый бенчмарк; уже записанные строки остаются в CSV."""
+    job = await job_manager.cancel((await _get_job(job_id)).id)
+    return {"job_id": job.id, "status": job.status if job.finished else "cancelling"}
+
+
+def _store_filters(
+    model: Optional[str],
+    benchmark_id: Optional[str],
+    prompt_hash: Optional[str],
+    since: Optional[datetime],
+    until: Optional[datetime],
+) -> dict:
+    if result_store is None:
+        raise HTTPException(status_code=503, detail="Results store is disabled")
+    return {
+        "model": model,
+        "benchmark_id": benchmark_id,
+        "prompt_hash": prompt_hash,
+        "since": since.timestamp() if since else None,
+        "until": until.timestamp() if until else None,
+    }
+
+
+@app_openrouter.get("/results")
+async def list_results(model: Optional[str] = None, limit: int = Query(100, ge=1, le=1000)):
+    """Бенчмарки в хранилище результатов, самые свежие первыми."""
+    _store_filters(model, None, None, None, None)
+    return await asyncio.to_thread(result_store.benchmarks, model, limit)
+
+
+@app_openrouter.get("/results/query")
+async def query_results(
+    model: Optional[str] = None,
+    benchmark_id: Optional[str] = None,
+    prompt_hash: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    window_seconds: Optional[float] = Query(None, gt=0),
+):
+    """Латентность/токены (avg, p50..p99) по моделям и окнам времени за выбранный период."""
+    filters = _store_filters(model, benchmark_id, prompt_hash, since, until)
+    return await asyncio.to_thread(result_store.aggregate, window_seconds, **filters)
+
+
+@app_openrouter.get("/results/export")
+async def export_results(
+    model: Optional[str] = None,
+    benchmark_id: Optional[str] = None,
+    prompt_hash: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    """CSV-выгрузка строк хранилища по тем же фильтрам (отдается потоком)."""
+    filters = _store_filters(model, benchmark_id, prompt_hash, since, until)
+    return StreamingResponse(
+        result_store.export_csv(**filters),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": 'attachment; filename="benchmark_results.csv"'},
+    )
+
+
+@app_openrouter.get("/results/{benchmark_id}/report")
+async def benchmark_report(
+    benchmark_id: str,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(REPORT_PAGE_SIZE, ge=1, le=5000),
+):
+    """HTML-отчет бенчмарка из хранилища: статистика по всем строкам, таблица — по страницам."""
+    _store_filters(None, benchmark_id, None, None, None)
+    sketches = await asyncio.to_thread(result_store.model_sketches, benchmark_id=benchmark_id)
+    if not sketches:
+        raise HTTPException(status_code=404, detail="Benchmark not found in results store")
+
+    merged = {key: QuantileSketch() for key in ("latency", "tokens", "ttft", "tokens_per_second")}
+    for model_sketch in sketches.values():
+        for key, sketch in model_sketch.items():
+            merged[key].merge(sketch)
+    total = merged["latency"].count
+    pages = (total + page_size - 1) // page_size
+    if page > pages:
+        raise HTTPException(status_code=404, detail="Page out of range")
+    rows = await asyncio.to_thread(
+        result_store.page, benchmark_id, (page - 1) * page_size, page_size
     )
 
+    stream_stats = None
+    if merged["ttft"].count:
+        stream_stats = {
+            "ttft_stats": merged["ttft"].summary(3),
+            "tokens_per_second_stats": merged["tokens_per_second"].summary(2),
+        }
+    report = render_benchmark_report(
+        rows,
+        merged["latency"].summary(3, total=True),
+        merged["tokens"].summary(1),
+        ", ".join(sorted(sketches)),
+        None,
+        stream_stats=stream_stats,
+        model_sketches={model: s["latency"] for model, s in sketches.items()},
+        total_rows=total,
+        page_size=page_size,
+        navigation=page_navigation(page, pages, page_size),
+    )
+    return StreamingResponse(report, media_type="text/html; charset=utf-8")
+
+
+@app_openrouter.get("/metrics")
+async def metrics():
+    """Метрики прокси в текстовом формате Prometheus.
+
+    При нескольких воркерах — сумма снимков всех воркеров из общей базы, так
+    что счетчики не скачут в зависимости от того, какой воркер ответил.
+    """
+    if shared_state is None:
+        text = registry.render()
+    else:
+        text = await asyncio.to_thread(
+            registry.render_shared, shared_state, 3 * METRICS_SYNC_INTERVAL
+        )
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app_openrouter.get("/logs/analytics")
+async def get_log_analytics(
+    bucket_seconds: int = Query(DEFAULT_BUCKET_SECONDS, ge=60),
+    incremental: bool = Query(False),
+):
+    """Латентность, повторы и 429 по моделям и по окнам времени из логов сервера.
+
+    Логи (включая ротированные) разбираются построчно в отдельном потоке;
+    с incremental=true — только строки, дописанные после прошлого такого вызова.
+    """
+    return await asyncio.to_thread(analyze_logs, bucket_seconds, incremental)
+
+
+@app_openrouter.get("/stats")
+async def get_stats():
+    """Внутренние счетчики прокси (кэш ответов и т.п.).
+
+    Состояние воркера, ответившего на запрос (worker.pid); сумма по воркерам — /metrics.
+    """
+    return {
+        "cache": response_cache.stats(),
+        "singleflight": single_flight.stats(),
+        "ratelimit": rate_limiters.stats(),
+        "models": model_health.stats(),
+        "registry": model_registry.stats(),
+        "logging": log_stats(),
+        "worker": {
+            "pid": os.getpid(),
+            "workers": WORKERS,
+            "shared_state": shared_state.path if shared_state is not None else None,
+        },
+    }
+
 
 @app_openrouter.get("/")
 async def root():
@@ -0,0 +1,131 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .config import (
+    SHARED_STATE_ENABLED,
+    SHARED_STATE_PATH,
+    SHARED_STATE_BUSY_TIMEOUT,
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shared_state (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+"""
+
+
+class SharedState:
+    """Общее для воркеров состояние: JSON-значения по (namespace, key) в SQLite (WAL).
+
+    У каждого процесса свое соединение. update() делает read-modify-write в
+    транзакции BEGIN IMMEDIATE, поэтому одновременные изменения из разных
+    воркеров не теряются. Методы блокирующие — из event loop их вызывают
+    через asyncio.to_thread.
+    """
+
+    def __init__(self, path: str = SHARED_STATE_PATH):
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(
+                self.path,
+                timeout=SHARED_STATE_BUSY_TIMEOUT,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(_SCHEMA)
+        return self._db
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        with self._lock:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT value FROM shared_state WHERE namespace = ? AND key = ?",
+                    (namespace, key),
+                )
+                .fetchone()
+            )
+        return json.loads(row[0]) if row is not None else None
+
+    def items(self, namespace: str) -> Dict[str, Any]:
+        with self._lock:
+            rows = (
+                self._connect()
+                .execute(
+                    "SELECT key, value FROM shared_state WHERE namespace = ?",
+                    (namespace,),
+                )
+                .fetchall()
+            )
+        return {key: json.loads(value) for key, value in rows}
+
+    def set(self, namespace: str, key: str, value: Any) -> None:
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO shared_state (namespace, key, value, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value, ensure_ascii=False), time.time()),
+            )
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock:
+            self._connect().execute(
+                "DELETE FROM shared_state WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            )
+
+    def update(
+        self, namespace: str, key: str, fn: Callable[[Optional[Any]], Tuple[Optional[Any], Any]]
+    ) -> Any:
+        """Атомарно заменяет значение на fn(old)[0] (None — удалить), возвращает fn(old)[1]."""
+        with self._lock:
+            db = self._connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT value FROM shared_state WHERE namespace = ? AND key = ?",
+                    (namespace, key),
+                ).fetchone()
+                value, result = fn(json.loads(row[0]) if row is not None else None)
+                if value is None:
+                    db.execute(
+                        "DELETE FROM shared_state WHERE namespace = ? AND key = ?",
+                        (namespace, key),
+                    )
+                else:
+                    db.execute(
+                        "INSERT OR REPLACE INTO shared_state "
+                        "(namespace, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                        (namespace, key, json.dumps(value, ensure_ascii=False), time.time()),
+                    )
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+            return result
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+shared_state = SharedState() if SHARED_STATE_ENABLED else None
@@ -0,0 +1,167 @@
+import asyncio
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Tuple
+
+from .config import setup_logging
+
+logger = setup_logging()
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class _Broadcast:
+    """Один апстрим-поток, раздаваемый нескольким подписчикам.
+
+    Кадры копятся в общем списке, каждый подписчик читает его со своей
+    позиции, поэтому опоздавший подписчик получает ту же последовательность
+    с начала. Апстрим читается в фоне и не ждет медленных подписчиков.
+    """
+
+    def __init__(self):
+        self.frames: List[Any] = []
+        self.done = False
+        self.subscribers = 0
+        self.waiting = 0
+        self.ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.changed = asyncio.Condition()
+        self.task: asyncio.Task = None
+
+    async def pump(self, start: Callable[[], Awaitable[AsyncGenerator]]) -> None:
+        try:
+            source = await start()
+        except asyncio.CancelledError:
+            self.done = True
+            self.ready.cancel()
+            raise
+        except Exception as e:
+            # ошибку открытия апстрима получат все ожидающие подписчики
+            self.done = True
+            self.ready.set_exception(e)
+            return
+        self.ready.set_result(None)
+        try:
+            async for frame in source:
+                self.frames.append(frame)
+                async with self.changed:
+                    self.changed.notify_all()
+        finally:
+            await source.aclose()
+            self.done = True
+            async with self.changed:
+                self.changed.notify_all()
+
+    def subscribe(self) -> AsyncGenerator[Any, None]:
+        self.subscribers += 1
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncGenerator[Any, None]:
+        position = 0
+        try:
+            while True:
+                async with self.changed:
+                    await self.changed.wait_for(
+                        lambda: position < len(self.frames) or self.done
+                    )
+                while position < len(self.frames):
+                    frame = self.frames[position]
+                    position += 1
+                    yield frame
+                if self.done and position >= len(self.frames):
+                    return
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                logger.warning("All stream subscribers left, cancelling upstream")
+                self.task.cancel()
+
+
+class SingleFlight:
+    """Схлопывает одинаковые одновременные запросы в один вызов апстрима.
+
+    Пока вызов по ключу выполняется, повторные запросы с тем же ключом
+    ждут его результат вместо нового запроса. Вызов отменяется, только если
+    ушли все ожидающие.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, _Broadcast] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.stream_leaders = 0
+        self.stream_coalesced = 0
+
+    async def do(
+        self, key: str, fn: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        """Выполняет fn() один раз на ключ; возвращает (результат, shared)."""
+        call = self._calls.get(key)
+        shared = call is not None
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            self.leaders += 1
+            call.task.add_done_callback(lambda _: self._forget(self._calls, key, call))
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task), shared
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    async def stream(
+        self, key: str, start: Callable[[], Awaitable[AsyncGenerator]]
+    ) -> Tuple[AsyncGenerator[Any, None], bool]:
+        """Подписывает на общий поток по ключу; start() открывает апстрим.
+
+        Ошибка открытия апстрима (например HTTPException) пробрасывается
+        всем подписчикам. Возвращает (генератор кадров, shared).
+        """
+        broadcast = self._streams.get(key)
+        shared = broadcast is not None
+        if broadcast is None:
+            broadcast = _Broadcast()
+            broadcast.task = asyncio.ensure_future(broadcast.pump(start))
+            self._streams[key] = broadcast
+            self.stream_leaders += 1
+            broadcast.task.add_done_callback(
+                lambda _: self._forget(self._streams, key, broadcast)
+            )
+        else:
+            self.stream_coalesced += 1
+
+        broadcast.waiting += 1
+        try:
+            await asyncio.shield(broadcast.ready)
+        except asyncio.CancelledError:
+            if broadcast.waiting == 1 and broadcast.subscribers == 0:
+                broadcast.task.cancel()
+            raise
+        finally:
+            broadcast.waiting -= 1
+        return broadcast.subscribe(), shared
+
+    @staticmethod
+    def _forget(registry: Dict[str, Any], key: str, item: Any) -> None:
+        if registry.get(key) is item:
+            del registry[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls),
+            "stream_leaders": self.stream_leaders,
+            "stream_coalesced": self.stream_coalesced,
+            "streams_in_flight": len(self._streams),
+        }
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,266 @@
+import math
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .config import STATS_MAX_PROMPTS
+
+# Относительная точность квантилей и предел числа бакетов одного скетча
+SKETCH_RELATIVE_ACCURACY = 0.01
+SKETCH_MAX_BUCKETS = 2048
+# Значения не больше этого порога считаются нулем (латентность 0, 0 токенов)
+SKETCH_MIN_VALUE = 1e-9
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class QuantileSketch:
+    """Логарифмическая гистограмма (в духе DDSketch) с относительной точностью 1%.
+
+    Память ограничена числом бакетов (не больше SKETCH_MAX_BUCKETS, при
+    переполнении склеиваются самые младшие), а не числом значений. Скетчи
+    с одинаковой точностью сливаются без потерь через merge(), поэтому
+    статистику параллельных воркеров и разных бенчмарков можно объединять
+    без сырых выборок.
+    """
+
+    def __init__(self, relative_accuracy: float = SKETCH_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.sum_sq = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float, weight: int = 1) -> None:
+        if value <= SKETCH_MIN_VALUE:
+            self.zero_count += weight
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + weight
+            if len(self.buckets) > SKETCH_MAX_BUCKETS:
+                self._collapse()
+        self.count += weight
+        self.sum += value * weight
+        self.sum_sq += value * value * weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def update(self, values: Iterable[float]) -> None:
+        for value in values:
+            self.add(value)
+
+    def _collapse(self) -> None:
+        ordered = sorted(self.buckets)
+        excess = len(ordered) - SKETCH_MAX_BUCKETS
+        target = ordered[excess]
+        for index in ordered[:excess]:
+            self.buckets[target] += self.buckets.pop(index)
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        for index, n in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + n
+        if len(self.buckets) > SKETCH_MAX_BUCKETS:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.sum_sq += other.sum_sq
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def _value(self, index: int) -> float:
+        """Представитель бакета: середина [gamma^(i-1), gamma^i] по относительной ошибке."""
+        value = 2 * self.gamma**index / (self.gamma + 1)
+        return min(max(value, self.min), self.max)
+
+    def _at_rank(self, rank: int) -> float:
+        """Приближение rank-го (с нуля) значения в порядке возрастания."""
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return self._value(index)
+        return self.max
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Квантиль q (0..100); точность — relative_accuracy от истинного значения.
+
+        Как utils.percentile: линейная интерполяция между соседними по рангу
+        значениями, так что на малых выборках квантиль не смещен вниз.
+        """
+        if not self.count:
+            return None
+        pos = q / 100 * (self.count - 1)
+        lo = math.floor(pos)
+        low = self._at_rank(lo)
+        if pos == lo:
+            return low
+        high = self._at_rank(min(lo + 1, self.count - 1))
+        return low + (high - low) * (pos - lo)
+
+    def histogram(self, bins: int = 20) -> List[Tuple[float, float, int]]:
+        """bins равных интервалов между min и max: [(от, до, число значений)]."""
+        if not self.count:
+            return []
+        low, high = self.min, self.max
+        if high <= low:
+            return [(low, high, self.count)]
+        width = (high - low) / bins
+        counts = [0] * bins
+        counts[0] += self.zero_count
+        for index, n in self.buckets.items():
+            counts[min(int((self._value(index) - low) / width), bins - 1)] += n
+        return [(low + i * width, low + (i + 1) * width, n) for i, n in enumerate(counts)]
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+    @property
+    def stdev(self) -> float:
+        if self.count < 2:
+            return 0.0
+        variance = (self.sum_sq - self.sum * self.sum / self.count) / (self.count - 1)
+        return math.sqrt(max(variance, 0.0))
+
+    def summary(self, digits: int = 3, total: bool = False) -> Dict[str, Any]:
+        """avg/min/max/std_dev и p50/p90/p95/p99 (пустой dict, если значений нет)."""
+        if not self.count:
+            return {}
+        data = {
+            "avg": round(self.mean, digits),
+            "min": round(self.min, digits),
+            "max": round(self.max, digits),
+            "std_dev": round(self.stdev, digits),
+        }
+        if total:
+            data["total"] = round(self.sum, digits)
+        for p in PERCENTILES:
+            data[f"p{p}"] = round(self.quantile(p), digits)
+        data["count"] = self.count
+        return data
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "buckets": {str(k): v for k, v in self.buckets.items()},
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "sum": self.sum,
+            "sum_sq": self.sum_sq,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "QuantileSketch":
+        sketch = cls(data.get("relative_accuracy", SKETCH_RELATIVE_ACCURACY))
+        sketch.buckets = {int(k): v for k, v in data.get("buckets", {}).items()}
+        sketch.zero_count = data.get("zero_count", 0)
+        sketch.count = data.get("count", 0)
+        sketch.sum = data.get("sum", 0.0)
+        sketch.sum_sq = data.get("sum_sq", 0.0)
+        if sketch.count:
+            sketch.min = data["min"]
+            sketch.max = data["max"]
+        return sketch
+
+
+class BenchmarkStats:
+    """Скетчи бенчмарка: общие и в разбивке по прогонам (run_id) и промптам.
+
+    Обновляется по одной строке результата; сливается с другими
+    BenchmarkStats через merge(), например для статистики нескольких джобов.
+    Разбивка по промптам ведется только для первых max_prompts промптов
+    (prompt_id нумеруется с 1, так что это prompt_id <= max_prompts), и
+    число скетчей не растет с размером файла; полная разбивка по промптам —
+    в хранилище результатов (GET /results/query?prompt_hash=...).
+    """
+
+    def __init__(self, max_prompts: int = STATS_MAX_PROMPTS):
+        self.max_prompts = max_prompts
+        self.prompts_truncated = False
+        self.latency = QuantileSketch()
+        self.tokens = QuantileSketch()
+        self.ttft = QuantileSketch()
+        self.itl = QuantileSketch()
+        self.tokens_per_second = QuantileSketch()
+        self.latency_by_run: Dict[int, QuantileSketch] = {}
+        self.latency_by_prompt: Dict[int, QuantileSketch] = {}
+        self.tokens_by_run: Dict[int, QuantileSketch] = {}
+        self.tokens_by_prompt: Dict[int, QuantileSketch] = {}
+
+    @staticmethod
+    def _sketch(group: Dict[int, QuantileSketch], key: int) -> QuantileSketch:
+        sketch = group.get(key)
+        if sketch is None:
+            sketch = group[key] = QuantileSketch()
+        return sketch
+
+    def add(self, row: Dict[str, Any], itl_gaps: Iterable[float] = ()) -> None:
+        latency = row["latency_seconds"]
+        tokens = row["tokens_used"] or 0
+        self.latency.add(latency)
+        self.tokens.add(tokens)
+        self._sketch(self.latency_by_run, row["run_id"]).add(latency)
+        self._sketch(self.tokens_by_run, row["run_id"]).add(tokens)
+        if row["prompt_id"] <= self.max_prompts:
+            self._sketch(self.latency_by_prompt, row["prompt_id"]).add(latency)
+            self._sketch(self.tokens_by_prompt, row["prompt_id"]).add(tokens)
+        else:
+            self.prompts_truncated = True
+        if row.get("ttft_seconds") is not None:
+            self.ttft.add(row["ttft_seconds"])
+        if row.get("tokens_per_second"):
+            self.tokens_per_second.add(row["tokens_per_second"])
+        self.itl.update(itl_gaps)
+
+    def merge(self, other: "BenchmarkStats") -> "BenchmarkStats":
+        for name in ("latency", "tokens", "ttft", "itl", "tokens_per_second"):
+            getattr(self, name).merge(getattr(other, name))
+        for name in ("latency_by_run", "tokens_by_run"):
+            mine = getattr(self, name)
+            for key, sketch in getattr(other, name).items():
+                self._sketch(mine, key).merge(sketch)
+        for name in ("latency_by_prompt", "tokens_by_prompt"):
+            mine = getattr(self, name)
+            for key, sketch in getattr(other, name).items():
+                if key <= self.max_prompts:
+                    self._sketch(mine, key).merge(sketch)
+                else:
+                    self.prompts_truncated = True
+        self.prompts_truncated = self.prompts_truncated or other.prompts_truncated
+        return self
+
+    @staticmethod
+    def _breakdown(group: Dict[int, QuantileSketch], digits: int) -> Dict[str, Any]:
+        return {str(key): group[key].summary(digits) for key in sorted(group)}
+
+    def latency_stats(self) -> Dict[str, Any]:
+        stats = self.latency.summary(3, total=True)
+        stats["per_run"] = self._breakdown(self.latency_by_run, 3)
+        stats["per_prompt"] = self._breakdown(self.latency_by_prompt, 3)
+        stats["per_prompt_truncated"] = self.prompts_truncated
+        return stats
+
+    def tokens_stats(self) -> Dict[str, Any]:
+        stats = self.tokens.summary(1)
+        stats["per_run"] = self._breakdown(self.tokens_by_run, 1)
+        stats["per_prompt"] = self._breakdown(self.tokens_by_prompt, 1)
+        stats["per_prompt_truncated"] = self.prompts_truncated
+        return stats
+
+    def stream_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            "ttft_stats": self.ttft.summary(3),
+            "itl_stats": self.itl.summary(4),
+            "tokens_per_second_stats": self.tokens_per_second.summary(2),
+        }
@@ -0,0 +1,375 @@
+import argparse
+import asyncio
+import csv
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .config import setup_logging, RESULTS_DB_PATH, RESULTS_STORE_ENABLED
+from .sketch import QuantileSketch
+
+logger = setup_logging()
+
+STORE_COLUMNS = [
+    "benchmark_id",
+    "run_id",
+    "prompt_id",
+    "prompt_hash",
+    "model",
+    "prompt",
+    "response",
+    "latency_seconds",
+    "tokens_used",
+    "response_length",
+    "ttft_seconds",
+    "itl_mean_seconds",
+    "itl_p95_seconds",
+    "tokens_per_second",
+    "timestamp",
+    "ts",
+]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS benchmark_results (
+    id INTEGER PRIMARY KEY,
+    benchmark_id TEXT NOT NULL,
+    run_id INTEGER NOT NULL,
+    prompt_id INTEGER NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt TEXT,
+    response TEXT,
+    latency_seconds REAL NOT NULL,
+    tokens_used INTEGER,
+    response_length INTEGER,
+    ttft_seconds REAL,
+    itl_mean_seconds REAL,
+    itl_p95_seconds REAL,
+    tokens_per_second REAL,
+    timestamp TEXT NOT NULL,
+    ts REAL NOT NULL,
+    UNIQUE (benchmark_id, run_id, prompt_id, model)
+);
+CREATE INDEX IF NOT EXISTS idx_results_model_ts ON benchmark_results (model, ts);
+CREATE INDEX IF NOT EXISTS idx_results_prompt_hash ON benchmark_results (prompt_hash, ts);
+CREATE INDEX IF NOT EXISTS idx_results_ts ON benchmark_results (ts);
+"""
+
+# Версия схемы (PRAGMA user_version). Модель входит в ключ строки:
+# многомодельный бенчмарк пишет одну и ту же пару (run_id, prompt_id) для
+# каждой модели.
+SCHEMA_VERSION = 1
+
+# Сколько строк читать из курсора за раз при агрегации и экспорте
+FETCH_BATCH = 1000
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def _epoch(timestamp: str) -> float:
+    return datetime.fromisoformat(timestamp).timestamp()
+
+
+class ResultStore:
+    """Индексированное хранилище результатов всех бенчмарков в одной базе SQLite.
+
+    Строки индексируются по (benchmark_id, run_id, prompt_id, model), модели,
+    хэшу промпта и времени. Запись идет пачками из потока через одно соединение;
+    запросы и экспорт открывают собственное соединение и читают курсор
+    порциями, не загружая выборку в память (WAL позволяет читать во время
+    записи).
+    """
+
+    def __init__(self, path: str = RESULTS_DB_PATH):
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(_SCHEMA)
+            self._db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            self._db.commit()
+        return self._db
+
+    def _reader(self) -> sqlite3.Connection:
+        with self._lock:
+            self._connect()
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    def insert_rows(self, benchmark_id: str, rows: List[Dict[str, Any]]) -> None:
+        """Записывает строки результатов (повторная запись того же ключа заменяет ее)."""
+        values = []
+        for row in rows:
+            record = {key: row.get(key) for key in STORE_COLUMNS}
+            record["benchmark_id"] = benchmark_id
+            if not record["prompt_hash"]:
+                record["prompt_hash"] = prompt_hash(row.get("prompt") or "")
+            record["ts"] = _epoch(row["timestamp"])
+            values.append(tuple(record[key] for key in STORE_COLUMNS))
+        placeholders = ", ".join("?" for _ in STORE_COLUMNS)
+        with self._lock:
+            db = self._connect()
+            db.executemany(
+                f"INSERT OR REPLACE INTO benchmark_results ({', '.join(STORE_COLUMNS)}) "
+                f"VALUES ({placeholders})",
+                values,
+            )
+            db.commit()
+
+    async def insert(self, benchmark_id: str, rows: List[Dict[str, Any]]) -> None:
+        """Асинхронная запись пачки; ошибки SQLite логируются и не роняют бенчмарк."""
+        if not rows:
+            return
+        try:
+            await asyncio.to_thread(self.insert_rows, benchmark_id, rows)
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f"Results store write failed: {e}")
+
+    @staticmethod
+    def _where(
+        model: Optional[str] = None,
+        benchmark_id: Optional[str] = None,
+        prompt_hash: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+    ) -> Tuple[str, List[Any]]:
+        clauses: List[str] = []
+        params: List[Any] = []
+        for column, value in (
+            ("model", model),
+            ("benchmark_id", benchmark_id),
+            ("prompt_hash", prompt_hash),
+        ):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("ts < ?")
+            params.append(until)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def _collect(
+        self, window_seconds: Optional[float] = None, **filters: Any
+    ) -> Dict[Tuple[str, float], Dict[str, Any]]:
+        where, params = self._where(**filters)
+        groups: Dict[Tuple[str, float], Dict[str, Any]] = {}
+        db = self._reader()
+        try:
+            cursor = db.execute(
+                "SELECT model, ts, latency_seconds, tokens_used, ttft_seconds, "
+                f"tokens_per_second, benchmark_id FROM benchmark_results{where}",
+                params,
+            )
+            while True:
+                batch = cursor.fetchmany(FETCH_BATCH)
+                if not batch:
+                    break
+                for model, ts, latency, tokens, ttft, tps, benchmark_id in batch:
+                    start = ts - ts % window_seconds if window_seconds else 0.0
+                    group = groups.get((model, start))
+                    if group is None:
+                        group = groups[(model, start)] = {
+                            "latency": QuantileSketch(),
+                            "tokens": QuantileSketch(),
+                            "ttft": QuantileSketch(),
+                            "tokens_per_second": QuantileSketch(),
+                            "benchmarks": set(),
+                            "first_ts": ts,
+                            "last_ts": ts,
+                        }
+                    group["latency"].add(latency)
+                    group["tokens"].add(tokens or 0)
+                    if ttft is not None:
+                        group["ttft"].add(ttft)
+                    if tps:
+                        group["tokens_per_second"].add(tps)
+                    group["benchmarks"].add(benchmark_id)
+                    group["first_ts"] = min(group["first_ts"], ts)
+                    group["last_ts"] = max(group["last_ts"], ts)
+        finally:
+            db.close()
+        return groups
+
+    def model_sketches(self, **filters: Any) -> Dict[str, Dict[str, QuantileSketch]]:
+        """Скетчи latency/tokens/ttft/tokens_per_second по моделям за весь период."""
+        return {
+            model: {
+                key: group[key]
+                for key in ("latency", "tokens", "ttft", "tokens_per_second")
+            }
+            for (model, _), group in self._collect(**filters).items()
+        }
+
+    def aggregate(
+        self, window_seconds: Optional[float] = None, **filters: Any
+    ) -> List[Dict[str, Any]]:
+        """Статистика по (модель, окно времени): строки потоком идут в скетчи.
+
+        Память зависит от числа групп, а не от числа строк. Без window_seconds
+        каждая модель — одна группа за весь выбранный интервал.
+        """
+        groups = self._collect(window_seconds, **filters)
+        report = []
+        for (model, start), group in sorted(groups.items()):
+            item: Dict[str, Any] = {
+                "model": model,
+                "window_start": (
+                    datetime.fromtimestamp(start).isoformat() if window_seconds else None
+                ),
+                "first_result": datetime.fromtimestamp(group["first_ts"]).isoformat(),
+                "last_result": datetime.fromtimestamp(group["last_ts"]).isoformat(),
+                "requests": group["latency"].count,
+                "benchmarks": len(group["benchmarks"]),
+                "latency_stats": group["latency"].summary(3),
+                "tokens_stats": group["tokens"].summary(1),
+            }
+            if group["ttft"].count:
+                item["ttft_stats"] = group["ttft"].summary(3)
+                item["tokens_per_second_stats"] = group["tokens_per_second"].summary(2)
+            report.append(item)
+        return report
+
+    def page(self, benchmark_id: str, offset: int, limit: int) -> List[Dict[str, Any]]:
+        """Строки одного бенчмарка в порядке (run_id, prompt_id), страница limit с offset."""
+        columns = [c for c in STORE_COLUMNS if c != "ts"]
+        db = self._reader()
+        try:
+            rows = db.execute(
+                f"SELECT {', '.join(columns)} FROM benchmark_results "
+                "WHERE benchmark_id = ? ORDER BY run_id, prompt_id, model LIMIT ? OFFSET ?",
+                (benchmark_id, limit, offset),
+            ).fetchall()
+        finally:
+            db.close()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def benchmarks(self, model: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Список бенчмарков в хранилище, самые свежие первыми."""
+        where, params = self._where(model=model)
+        db = self._reader()
+        try:
+            rows = db.execute(
+                "SELECT benchmark_id, model, COUNT(*), MIN(ts), MAX(ts) "
+                f"FROM benchmark_results{where} GROUP BY benchmark_id, model "
+                "ORDER BY MAX(ts) DESC LIMIT ?",
+                params + [limit],
+            ).fetchall()
+        finally:
+            db.close()
+        return [
+            {
+                "benchmark_id": benchmark_id,
+                "model": model_name,
+                "requests": count,
+                "started_at": datetime.fromtimestamp(first).isoformat(),
+                "finished_at": datetime.fromtimestamp(last).isoformat(),
+            }
+            for benchmark_id, model_name, count, first, last in rows
+        ]
+
+    def export_csv(self, **filters: Any) -> Iterator[str]:
+        """CSV-представление выборки; строки отдаются порциями по FETCH_BATCH."""
+        where, params = self._where(**filters)
+        columns = [c for c in STORE_COLUMNS if c != "ts"]
+        db = self._reader()
+        try:
+            cursor = db.execute(
+                f"SELECT {', '.join(columns)} FROM benchmark_results{where} "
+                "ORDER BY ts, benchmark_id, run_id, prompt_id, model",
+                params,
+            )
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            buffer.write("\ufeff")
+            writer.writerow(columns)
+            while True:
+                batch = cursor.fetchmany(FETCH_BATCH)
+                if batch:
+                    writer.writerows(batch)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                if not batch:
+                    break
+        finally:
+            db.close()
+
+    def import_csv(self, path: str, benchmark_id: Optional[str] = None) -> int:
+        """Импортирует CSV бенчмарка (в т.ч. старый benchmark_results.csv); возвращает число строк."""
+        stem = os.path.splitext(os.path.basename(path))[0]
+        benchmark_id = benchmark_id or stem.removeprefix("benchmark_")
+        imported = 0
+        batch: List[Dict[str, Any]] = []
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                if not row.get("latency_seconds") or not row.get("timestamp"):
+                    continue
+                parsed: Dict[str, Any] = {k: (v if v != "" else None) for k, v in row.items()}
+                for key in ("run_id", "prompt_id", "tokens_used", "response_length"):
+                    if parsed.get(key) is not None:
+                        parsed[key] = int(parsed[key])
+                for key in (
+                    "latency_seconds",
+                    "ttft_seconds",
+                    "itl_mean_seconds",
+                    "itl_p95_seconds",
+                    "tokens_per_second",
+                ):
+                    if parsed.get(key) is not None:
+                        parsed[key] = float(parsed[key])
+                batch.append(parsed)
+                if len(batch) >= FETCH_BATCH:
+                    self.insert_rows(benchmark_id, batch)
+                    imported += len(batch)
+                    batch = []
+        if batch:
+            self.insert_rows(benchmark_id, batch)
+            imported += len(batch)
+        return imported
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+result_store = ResultStore() if RESULTS_STORE_ENABLED else None
+
+
+def main() -> None:
+    """python -m app.store import file.csv [...] — перенос старых CSV в хранилище."""
+    parser = argparse.ArgumentParser(description="Benchmark results store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    importer = sub.add_parser("import", help="import benchmark CSV files")
+    importer.add_argument("files", nargs="+")
+    importer.add_argument("--benchmark-id", default=None)
+    args = parser.parse_args()
+
+    store = ResultStore()
+    try:
+        for path in args.files:
+            count = store.import_csv(path, args.benchmark_id)
+            print(f"{path}: {count} rows")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,58 @@
-from datetime import datetime
 import csv
 from typing import List, Dict, Any, Optional
 import logging
 
+from .report import render_benchmark_report
+
 logger = logging.getLogger(__name__)
 
+RESULT_FIELDNAMES = [
+    "run_id",
+    "prompt_id",
+    "prompt",
+    "model",
+    "latency_seconds",
+    "tokens_used",
+    "response_length",
+    "timestamp",
+]
+
+# Дополнительные колонки CSV для потокового бенчмарка
+STREAM_FIELDNAMES = [
+    "ttft_seconds",
+    "itl_mean_seconds",
+    "itl_p95_seconds",
+    "tokens_per_second",
+]
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль q (0..100) с линейной интерполяцией между соседними значениями."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    pos = (len(ordered) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def result_fieldnames(stream: bool) -> List[str]:
+    """Колонки CSV с результатами; для потокового бенчмарка — со stream-метриками."""
+    fieldnames = list(RESULT_FIELDNAMES)
+    if stream:
+        fieldnames[-1:-1] = STREAM_FIELDNAMES
+    return fieldnames
+
+
+def clean_result_row(row: Dict[str, Any], fieldnames: List[str]) -> Dict[str, Any]:
+    """Оставляет только колонки CSV и убирает из строк запятые и переводы строк."""
+    return {
+        k: (v if not isinstance(v, str) else v.replace(",", ";").replace("\n", " "))
+        for k, v in row.items()
+        if k in fieldnames
+    }
+
 
 def create_benchmark_html_table(
     results: List[Dict[str, Any]],
@@ -12,89 +60,27 @@ def create_benchmark_html_table(
     tokens_stats: Dict[str, Any],
     model: str,
     runs: int,
+    wall_time_seconds: Optional[float] = None,
+    requests_per_second: Optional[float] = None,
+    stream_stats: Optional[Dict[str, Dict[str, Any]]] = None,
 ) -> str:
-    """Создает HTML таблицу с результатами бенчмарка"""
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Benchmark Results - {model}</title>
-        <style>
-            body {{ font-family: Arial, sans-serif; margin: 20px; }}
-            .header {{ background-color: #f0f0f0; padding: 20px; border-radius: 5px; margin-bottom: 20px; }}
-            .stats {{ display: flex; gap: 20px; margin-bottom: 20px; }}
-            .stat-box {{ background-color: #e8f4fd; padding: 15px; border-radius: 5px; flex: 1; }}
-            table {{ border-collapse: collapse; width: 100%; }}
-            th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
-            th {{ background-color: #f2f2f2; }}
-            .number {{ text-align: right; }}
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <h1>Benchmark Results</h1>
-            <p><strong>Model:</strong> {model}</p>
-            <p><strong>Runs:</strong> {runs}</p>
-            <p><strong>Total Requests:</strong> {len(results)}</p>
-            <p><strong>Generated at:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-        </div>
-        
-        <div class="stats">
-            <div class="stat-box">
-                <h3>Latency Statistics</h3>
-                <p>Average: {latency_stats['avg']}s</p>
-                <p>Min: {latency_stats['min']}s</p>
-                <p>Max: {latency_stats['max']}s</p>
-                <p>Std Dev: {latency_stats['std_dev']}s</p>
-            </div>
-            <div class="stat-box">
-                <h3>Token Statistics</h3>
-                <p>Average: {tokens_stats['avg']}</p>
-                <p>Min: {tokens_stats['min']}</p>
-                <p>Max: {tokens_stats['max']}</p>
-                <p>Std Dev: {tokens_stats['std_dev']}</p>
-            </div>
-        </div>
-        
-        <h2>Detailed Results</h2>
-        <table>
-            <thead>
-                <tr>
-                    <th>Run</th>
-                    <th>Prompt ID</th>
-                    <th>Prompt (truncated)</th>
-                    <th>Responce (truncated)</th>
-                    <th class="number">Latency (s)</th>
-                    <th class="number">Tokens Used</th>
-                    <th class="number">Response Length</th>
-                    <th>Timestamp</th>
-                </tr>
-            </thead>
-            <tbody>
-    """
+    """Создает HTML таблицу с результатами бенчмарка одной строкой.
 
-    for result in results:
-        html += f"""
-                <tr>
-                    <td>{result['run_id']}</td>
-                    <td>{result['prompt_id']}</td>
-                    <td>{result['prompt']}</td>
-                    <td>{result['response']}</td>
-                    <td class="number">{result['latency_seconds']}</td>
-                    <td class="number">{result['tokens_used']}</td>
-                    <td class="number">{result['response_length']}</td>
-                    <td>{result['timestamp']}</td>
-                </tr>
-        """
-
-    html += """
-            </tbody>
-        </table>
-    </body>
-    </html>
+    Для больших бенчмарков лучше отдавать render_benchmark_report из
+    app/report.py через StreamingResponse, не собирая страницу целиком.
     """
-
-    return html
+    return "".join(
+        render_benchmark_report(
+            results,
+            latency_stats,
+            tokens_stats,
+            model,
+            runs,
+            wall_time_seconds=wall_time_seconds,
+            requests_per_second=requests_per_second,
+            stream_stats=stream_stats,
+        )
+    )
 
 
 def save_results_csv(results: List[Dict[str, Any]], filename: str) -> str:
@@ -102,29 +88,13 @@ def save_results_csv(results: List[Dict[str, Any]], filename: str) -> str:
     try:
         with open(filename, "w", newline="", encoding="utf-8-sig") as csvfile:
             if results:
-                fieldnames = [
-                    "run_id",
-                    "prompt_id",
-                    "prompt",
-                    "model",
-                    "latency_seconds",
-                    "tokens_used",
-                    "response_length",
-                    "timestamp",
-                ]
+                fieldnames = result_fieldnames(
+                    any("ttft_seconds" in r for r in results)
+                )
                 writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
                 writer.writeheader()
                 for r in results:
-                    clean = {
-                        k: (
-                            v
-                            if not isinstance(v, str)
-                            else v.replace(",", ";").replace("\n", " ")
-                        )
-                        for k, v in r.items()
-                        if k in fieldnames
-                    }
-                    writer.writerow(clean)
+                    writer.writerow(clean_result_row(r, fieldnames))
 
         return filename
     except Exception as e:
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+Асинхронный генератор нагрузки на прокси: /generate, стриминг и /benchmark.
+
+Режимы:
+  closed — N виртуальных пользователей, каждый шлет следующий запрос после ответа
+  open   — запросы приходят с фиксированной интенсивностью (пуассоновский поток)
+           независимо от того, успевает ли сервер
+
+Пример (из корня репозитория):
+  python -m llm_test.load_test --mode open --rate 50 --duration 60 \\
+      --mix generate=70,stream=25,benchmark=5 --output load_results/run1
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.sketch import QuantileSketch  # noqa: E402
+
+DEFAULT_MODELS = [
+    "deepseek/deepseek-chat-v3.1:free",
+    "z-ai/glm-4.5-air:free",
+    "moonshotai/kimi-k2:free",
+]
+DEFAULT_PROMPTS = os.path.join(os.path.dirname(__file__), "sample_prompts.txt")
+KINDS = ("generate", "stream", "benchmark")
+
+ROW_FIELDS = [
+    "started_at",
+    "kind",
+    "model",
+    "status",
+    "success",
+    "latency_seconds",
+    "ttft_seconds",
+    "bytes",
+    "error",
+]
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """'generate=70,stream=25,benchmark=5' → веса по типам запросов."""
+    mix: Dict[str, float] = {}
+    for part in value.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"unknown request kind: {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+class Recorder:
+    """Пишет каждый запрос в CSV сразу и копит скетчи: итог и окна по времени."""
+
+    def __init__(self, interval: float, csv_path: Optional[str]):
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.windows: Dict[int, Dict[str, Any]] = {}
+        self.total = self._bucket()
+        self.by_kind: Dict[str, Dict[str, Any]] = {}
+        self.by_model: Dict[str, Dict[str, Any]] = {}
+        self.dropped = 0
+        self._file = None
+        self._writer = None
+        if csv_path:
+            self._file = open(csv_path, "w", newline="", encoding="utf-8")
+            self._writer = csv.DictWriter(self._file, fieldnames=ROW_FIELDS)
+            self._writer.writeheader()
+
+    @staticmethod
+    def _bucket() -> Dict[str, Any]:
+        return {
+            "requests": 0,
+            "errors": 0,
+            "latency": QuantileSketch(),
+            "ttft": QuantileSketch(),
+        }
+
+    @staticmethod
+    def _add(bucket: Dict[str, Any], row: Dict[str, Any]) -> None:
+        bucket["requests"] += 1
+        if not row["success"]:
+            bucket["errors"] += 1
+            return
+        bucket["latency"].add(row["latency_seconds"])
+        if row["ttft_seconds"] is not None:
+            bucket["ttft"].add(row["ttft_seconds"])
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def record(self, row: Dict[str, Any]) -> None:
+        finished = row["started_at"] + (row["latency_seconds"] or 0)
+        index = int(finished // self.interval)
+        window = self.windows.get(index)
+        if window is None:
+            window = self.windows[index] = self._bucket()
+        self._add(window, row)
+        self._add(self.total, row)
+        self._add(self.by_kind.setdefault(row["kind"], self._bucket()), row)
+        self._add(self.by_model.setdefault(row["model"], self._bucket()), row)
+        if self._writer is not None:
+            self._writer.writerow(row)
+
+    @staticmethod
+    def summarize(bucket: Dict[str, Any], seconds: Optional[float] = None) -> Dict[str, Any]:
+        requests = bucket["requests"]
+        data: Dict[str, Any] = {
+            "requests": requests,
+            "errors": bucket["errors"],
+            "error_rate": round(bucket["errors"] / requests, 4) if requests else 0.0,
+            "latency": bucket["latency"].summary(3),
+        }
+        if bucket["ttft"].count:
+            data["ttft"] = bucket["ttft"].summary(3)
+        if seconds:
+            data["throughput_rps"] = round(
+                (requests - bucket["errors"]) / seconds, 3
+            )
+        return data
+
+    def timeseries(self) -> List[Dict[str, Any]]:
+        return [
+            {"t": round(index * self.interval, 3), **self.summarize(w, self.interval)}
+            for index, w in sorted(self.windows.items())
+        ]
+
+    def report(self, wall_time: float) -> Dict[str, Any]:
+        return {
+            "wall_time_seconds": round(wall_time, 3),
+            "dropped": self.dropped,
+            "total": self.summarize(self.total, wall_time),
+            "by_kind": {k: self.summarize(b, wall_time) for k, b in sorted(self.by_kind.items())},
+            "by_model": {m: self.summarize(b, wall_time) for m, b in sorted(self.by_model.items())},
+            "timeseries": self.timeseries(),
+        }
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+
+
+class LoadGenerator:
+    def __init__(self, args: argparse.Namespace, prompts: List[str], recorder: Recorder):
+        self.args = args
+        self.prompts = prompts
+        self.recorder = recorder
+        self.random = random.Random(args.seed)
+        kinds = list(args.mix)
+        self.kinds = kinds
+        self.weights = [args.mix[k] for k in kinds]
+        self.benchmark_file = "\n".join(prompts[: args.benchmark_prompts]).encode("utf-8")
+        limit = args.users if args.mode == "closed" else args.max_in_flight
+        self.client = httpx.AsyncClient(
+            base_url=args.base_url,
+            timeout=httpx.Timeout(args.timeout),
+            limits=httpx.Limits(max_connections=limit, max_keepalive_connections=limit),
+        )
+
+    def _payload(self, model: str, stream: bool) -> Dict[str, Any]:
+        payload = {
+            "prompt": self.random.choice(self.prompts),
+            "model": model,
+            "max_tokens": self.args.max_tokens,
+            "stream": stream,
+        }
+        if not self.args.allow_cache:
+            payload["no_cache"] = True
+        return payload
+
+    async def _generate(self, model: str) -> Dict[str, Any]:
+        response = await self.client.post("/generate", json=self._payload(model, False))
+        return {"status": response.status_code, "bytes": len(response.content), "body": response}
+
+    async def _stream(self, model: str, start: float) -> Dict[str, Any]:
+        ttft = None
+        size = 0
+        async with self.client.stream(
+            "POST", "/generate", json=self._payload(model, True)
+        ) as response:
+            async for line in response.aiter_lines():
+                size += len(line) + 1
+                if ttft is None and line.startswith('data: {"content"'):
+                    ttft = time.perf_counter() - start
+            if response.status_code != 200:
+                return {"status": response.status_code, "bytes": size, "error": "HTTP error"}
+        return {"status": response.status_code, "bytes": size, "ttft": ttft}
+
+    async def _benchmark(self, model: str) -> Dict[str, Any]:
+        response = await self.client.post(
+            "/benchmark",
+            data={"model": model, "runs": "1", "concurrency": str(self.args.benchmark_prompts)},
+            files={"prompt_file": ("prompts.txt", self.benchmark_file, "text/plain")},
+        )
+        return {"status": response.status_code, "bytes": len(response.content), "body": response}
+
+    async def one_request(self) -> None:
+        kind = self.random.choices(self.kinds, self.weights)[0]
+        model = self.random.choice(self.args.models)
+        started_at = self.recorder.elapsed()
+        start = time.perf_counter()
+        try:
+            if kind == "generate":
+                outcome = await self._generate(model)
+            elif kind == "stream":
+                outcome = await self._stream(model, start)
+            else:
+                outcome = await self._benchmark(model)
+            status = outcome["status"]
+            error = outcome.get("error")
+            if status != 200 and error is None:
+                error = outcome["body"].text[:200]
+        except httpx.HTTPError as e:
+            outcome, status, error = {}, 0, f"{type(e).__name__}: {e}"[:200]
+        self.recorder.record(
+            {
+                "started_at": round(started_at, 4),
+                "kind": kind,
+                "model": model,
+                "status": status,
+                "success": status == 200,
+                "latency_seconds": round(time.perf_counter() - start, 4),
+                "ttft_seconds": round(outcome["ttft"], 4) if outcome.get("ttft") else None,
+                "bytes": outcome.get("bytes", 0),
+                "error": error,
+            }
+        )
+
+    async def run_closed(self, deadline: float) -> None:
+        async def user() -> None:
+            while time.perf_counter() < deadline:
+                await self.one_request()
+                if self.args.think_time:
+                    await asyncio.sleep(self.random.expovariate(1 / self.args.think_time))
+
+        async with asyncio.TaskGroup() as tg:
+            for _ in range(self.args.users):
+                tg.create_task(user())
+
+    async def run_open(self, deadline: float) -> None:
+        in_flight: set = set()
+        next_at = time.perf_counter()
+        while True:
+            next_at += self.random.expovariate(self.args.rate)
+            if next_at >= deadline:
+                break
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            if len(in_flight) >= self.args.max_in_flight:
+                # клиент насыщен: не ждем, чтобы не превратиться в closed-loop
+                self.recorder.dropped += 1
+                continue
+            task = asyncio.create_task(self.one_request())
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
+    async def progress(self) -> None:
+        reported = -1
+        while True:
+            await asyncio.sleep(self.args.interval)
+            windows = self.recorder.windows
+            for index in sorted(windows):
+                if index <= reported or (index + 1) * self.args.interval > self.recorder.elapsed():
+                    continue
+                w = self.recorder.summarize(windows[index], self.args.interval)
+                lat = w["latency"]
+                print(
+                    f"  t={index * self.args.interval:>6.0f}s  ok/s={w['throughput_rps']:<8} "
+                    f"err={w['error_rate']:<6} p50={lat.get('p50', '-')} "
+                    f"p95={lat.get('p95', '-')} p99={lat.get('p99', '-')}"
+                )
+                reported = index
+
+    async def run(self) -> Dict[str, Any]:
+        start = time.perf_counter()
+        deadline = start + self.args.duration
+        reporter = asyncio.create_task(self.progress())
+        try:
+            if self.args.mode == "closed":
+                await self.run_closed(deadline)
+            else:
+                await self.run_open(deadline)
+        finally:
+            reporter.cancel()
+            await self.client.aclose()
+        return self.recorder.report(time.perf_counter() - start)
+
+
+def load_prompts(path: str) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        prompts = [line.strip() for line in f if line.strip()]
+    if not prompts:
+        raise SystemExit(f"No prompts in {path}")
+    return prompts
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Load generator for the OpenRouter proxy")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--mode", choices=("closed", "open"), default="closed")
+    parser.add_argument("--users", type=int, default=10, help="closed: virtual users")
+    parser.add_argument("--think-time", type=float, default=0.0, help="closed: mean pause, s")
+    parser.add_argument("--rate", type=float, default=10.0, help="open: requests per second")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="open: client cap")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("generate=70,stream=30"))
+    parser.add_argument("--models", nargs="+", default=DEFAULT_MODELS)
+    parser.add_argument("--prompts", default=DEFAULT_PROMPTS)
+    parser.add_argument("--max-tokens", type=int, default=128)
+    parser.add_argument("--benchmark-prompts", type=int, default=3)
+    parser.add_argument("--allow-cache", action="store_true", help="do not send no_cache")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--interval", type=float, default=5.0, help="time-series window, s")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="prefix for <prefix>.json (summary) and <prefix>.csv (every request)",
+    )
+    return parser
+
+
+def main() -> None:
+    args = build_parser().parse_args()
+    prompts = load_prompts(args.prompts)
+    output = args.output or os.path.join(
+        "load_results", f"load_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    )
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    recorder = Recorder(args.interval, f"{output}.csv")
+    print(
+        f"🚀 {args.mode}-loop load: "
+        + (f"{args.users} users" if args.mode == "closed" else f"{args.rate} req/s")
+        + f", {args.duration:.0f}s, mix={args.mix}"
+    )
+    try:
+        report = asyncio.run(LoadGenerator(args, prompts, recorder).run())
+    finally:
+        recorder.close()
+
+    report = {
+        "config": {
+            key: value for key, value in vars(args).items() if key not in ("output",)
+        },
+        "finished_at": datetime.now().isoformat(),
+        **report,
+    }
+    with open(f"{output}.json", "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    total = report["total"]
+    print("=" * 80)
+    print(f"Запросов:      {total['requests']} (отброшено клиентом: {report['dropped']})")
+    print(f"Ошибок:        {total['errors']} ({total['error_rate'] * 100:.1f}%)")
+    print(f"Пропускная:    {total.get('throughput_rps', 0)} успешных/с")
+    lat = total["latency"]
+    print(
+        f"Латентность:   p50={lat.get('p50', '-')} p95={lat.get('p95', '-')} "
+        f"p99={lat.get('p99', '-')} max={lat.get('max', '-')}"
+    )
+    for kind, data in report["by_kind"].items():
+        print(
+            f"  {kind:<10} {data['requests']:>6} req, err {data['error_rate'] * 100:5.1f}%, "
+            f"p95 {data['latency'].get('p95', '-')}"
+        )
+    print(f"\n📊 Результаты: {output}.json, {output}.csv")
+
+
+if __name__ == "__main__":
+    main()
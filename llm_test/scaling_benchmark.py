@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Масштабирование прокси по числу воркеров: одна и та же нагрузка на
+python main.py --workers N для каждого N, апстрим — локальный мок.
+
+Скрипт поднимает мок OpenRouter (uvicorn app.mock_openrouter:mock_app с
+несколькими воркерами, чтобы он не стал узким местом), затем по очереди
+прокси с 1, 2, 4... воркерами с общим состоянием в отдельной SQLite и
+гоняет closed-loop нагрузку из llm_test.load_test в нескольких процессах
+клиента. Итог — таблица пропускной способности и латентности по N и
+ускорение относительно первого N. Машина должна иметь ядер не меньше, чем
+воркеров прокси + мока + клиентов, иначе они делят одни и те же ядра.
+
+Пример (из корня репозитория):
+  python -m llm_test.scaling_benchmark --workers 1 2 4 --users 128 --duration 20
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from app.sketch import QuantileSketch  # noqa: E402
+from llm_test.load_test import (  # noqa: E402
+    LoadGenerator,
+    Recorder,
+    build_parser as load_test_parser,
+    load_prompts,
+)
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"{url}: process exited with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"{url}: not ready after {timeout:.0f}s")
+
+
+def stop(process: subprocess.Popen, timeout: float = 30.0) -> None:
+    """SIGTERM и ожидание мягкой остановки (воркеры дорабатывают запросы)."""
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def run_client(load_args: List[str]) -> Dict[str, Any]:
+    """Один процесс генератора нагрузки; возвращает счетчики и скетч латентности."""
+    import asyncio
+
+    args = load_test_parser().parse_args(load_args)
+    recorder = Recorder(args.interval, None)
+    report = asyncio.run(LoadGenerator(args, load_prompts(args.prompts), recorder).run())
+    return {
+        "requests": recorder.total["requests"],
+        "errors": recorder.total["errors"],
+        "wall_time": report["wall_time_seconds"],
+        "latency": recorder.total["latency"].to_dict(),
+    }
+
+
+def measure(args: argparse.Namespace, base_url: str) -> Dict[str, Any]:
+    users = max(1, args.users // args.clients)
+    load_args = [
+        "--base-url", base_url,
+        "--mode", "closed",
+        "--users", str(users),
+        "--duration", str(args.duration),
+        "--mix", args.mix,
+        "--max-tokens", str(args.max_tokens),
+        # окна временного ряда длиннее прогона — клиенты не печатают прогресс
+        "--interval", str(args.duration + 1),
+    ]
+    with ProcessPoolExecutor(args.clients) as pool:
+        parts = list(pool.map(run_client, [load_args] * args.clients))
+    latency = QuantileSketch()
+    for part in parts:
+        latency.merge(QuantileSketch.from_dict(part["latency"]))
+    requests = sum(part["requests"] for part in parts)
+    errors = sum(part["errors"] for part in parts)
+    wall_time = max(part["wall_time"] for part in parts)
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round((requests - errors) / wall_time, 2),
+        "latency": latency.summary(4),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Throughput scaling by proxy worker count")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--users", type=int, default=128, help="virtual users in total")
+    parser.add_argument("--clients", type=int, default=2, help="load generator processes")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per worker count")
+    parser.add_argument("--mix", default="generate=80,stream=20")
+    parser.add_argument("--max-tokens", type=int, default=32)
+    parser.add_argument("--port", type=int, default=8100, help="proxy port")
+    parser.add_argument("--mock-port", type=int, default=8101)
+    parser.add_argument("--mock-workers", type=int, default=2)
+    parser.add_argument("--ttft", type=float, default=0.05, help="mock median TTFT, s")
+    parser.add_argument("--output", default=None, help="JSON report path")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="scaling_")
+    mock_config = os.path.join(workdir, "mock.json")
+    with open(mock_config, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "default": {
+                    "ttft_median": args.ttft,
+                    "ttft_sigma": 0.1,
+                    "tokens_per_second": 2000,
+                    "output_tokens": args.max_tokens,
+                }
+            },
+            f,
+        )
+    mock_env = {**os.environ, "MOCK_OPENROUTER_CONFIG": mock_config}
+    mock = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "app.mock_openrouter:mock_app",
+            "--port", str(args.mock_port),
+            "--workers", str(args.mock_workers),
+            "--log-level", "warning",
+        ],
+        cwd=ROOT,
+        env=mock_env,
+    )
+    results: List[Dict[str, Any]] = []
+    try:
+        wait_ready(f"http://127.0.0.1:{args.mock_port}/mock/stats", mock)
+        for workers in args.workers:
+            env = {
+                **os.environ,
+                "OPENROUTER_API_KEY": os.getenv("OPENROUTER_API_KEY", "mock"),
+                "OPENROUTER_BASE_URL": f"http://127.0.0.1:{args.mock_port}/api/v1",
+                # общее состояние включаем и для одного воркера, чтобы сравнение
+                # было честным; лимит скорости не должен упираться в потолок
+                "SHARED_STATE_ENABLED": "true",
+                "SHARED_STATE_PATH": os.path.join(workdir, f"shared_{workers}.db"),
+                "RATE_LIMIT_INITIAL_RPS": "100000",
+                "RATE_LIMIT_MAX_RPS": "100000",
+                "RATE_LIMIT_BURST": "100000",
+                "LOG_LEVEL": "ERROR",
+                "LOG_FILE": os.path.join(workdir, "server_logs.txt"),
+            }
+            proxy = subprocess.Popen(
+                [
+                    sys.executable, "main.py",
+                    "--host", "127.0.0.1",
+                    "--port", str(args.port),
+                    "--workers", str(workers),
+                ],
+                cwd=ROOT,
+                env=env,
+            )
+            try:
+                base_url = f"http://127.0.0.1:{args.port}"
+                wait_ready(f"{base_url}/", proxy)
+                print(f"🚀 workers={workers}: {args.users} users, {args.duration:.0f}s")
+                result = {"workers": workers, **measure(args, base_url)}
+            finally:
+                stop(proxy)
+            results.append(result)
+            lat = result["latency"]
+            print(
+                f"   ok/s={result['throughput_rps']} errors={result['errors']} "
+                f"p50={lat.get('p50', '-')} p95={lat.get('p95', '-')}"
+            )
+    finally:
+        stop(mock)
+
+    base = results[0]["throughput_rps"] if results else 0
+    print("=" * 64)
+    print(f"{'workers':>8} {'ok/s':>10} {'speedup':>8} {'p50, s':>8} {'p95, s':>8} {'errors':>7}")
+    for result in results:
+        result["speedup"] = round(result["throughput_rps"] / base, 2) if base else None
+        lat = result["latency"]
+        print(
+            f"{result['workers']:>8} {result['throughput_rps']:>10} {result['speedup']:>8} "
+            f"{lat.get('p50', '-'):>8} {lat.get('p95', '-'):>8} {result['errors']:>7}"
+        )
+
+    output = args.output or os.path.join(
+        "load_results", f"scaling_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "config": vars(args),
+                "cpu_count": os.cpu_count(),
+                "finished_at": datetime.now().isoformat(),
+                "results": results,
+            },
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+    print(f"\n📊 Результаты: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -32,10 +32,10 @@ def measure_request_time(func):
     """Декоратор для измерения времени выполнения"""
 
     def wrapper(*args, **kwargs):
-        start = time.time()
+        start = time.perf_counter()
 
         result = func(*args, **kwargs)
-        end = time.time()
+        end = time.perf_counter()
         return result, end - start
 
     return wrapper
@@ -1,7 +1,44 @@
+import argparse
+import os
+
+from app.config import WORKERS, GRACEFUL_SHUTDOWN_SECONDS
 from app.routes import app_openrouter
 
 
-if __name__ == "__main__":
+def main() -> None:
+    parser = argparse.ArgumentParser(description="OpenRouter API proxy")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help="number of worker processes (>1 enables shared state in SQLite)",
+    )
+    parser.add_argument(
+        "--reload", action="store_true", help="development mode: one process, auto-reload"
+    )
+    args = parser.parse_args()
+
     import uvicorn
 
-    uvicorn.run("main:app_openrouter", host="0.0.0.0", port=8000, reload=True)
+    if args.reload:
+        uvicorn.run("main:app_openrouter", host=args.host, port=args.port, reload=True)
+        return
+
+    # Воркеры — отдельные процессы, которые заново читают конфигурацию из
+    # окружения: так они узнают, что состояние нужно держать в общей базе.
+    os.environ["WORKERS"] = str(args.workers)
+    uvicorn.run(
+        "main:app_openrouter",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        # при SIGTERM/SIGINT новые соединения не принимаются, идущие запросы
+        # и стримы дорабатывают до GRACEFUL_SHUTDOWN_SECONDS
+        timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_SECONDS,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import os
+import tempfile
+
+# Конфигурация читается при импорте app.config: до него направляем файлы
+# логов, результатов и общего состояния во временный каталог.
+_tmp = tempfile.mkdtemp(prefix="proxy-tests-")
+os.environ.setdefault("OPENROUTER_API_KEY", "test-key")
+os.environ.setdefault("BENCHMARK_RESULTS_DIR", _tmp)
+os.environ.setdefault("LOG_FILE", os.path.join(_tmp, "server_logs.txt"))
+
+import httpx  # noqa: E402
+import pytest  # noqa: E402
+
+from app import openrouter, routes  # noqa: E402
+from app.cache import ResponseCache  # noqa: E402
+from app.hedging import model_health  # noqa: E402
+from app.ratelimit import rate_limiters  # noqa: E402
+from app.singleflight import SingleFlight  # noqa: E402
+
+
+def completion(text: str = "ok", tokens: int = 3, status_code: int = 200) -> httpx.Response:
+    """Ответ OpenRouter /chat/completions без стриминга."""
+    body = {
+        "choices": [{"message": {"content": text}}],
+        "usage": {"total_tokens": tokens},
+    }
+    return httpx.Response(status_code, json=body)
+
+
+class Upstream:
+    """Мок OpenRouter на httpx.MockTransport: handler(request, payload) -> Response.
+
+    По умолчанию отвечает completion() через delay секунд; calls — тела
+    всех запросов в порядке прихода.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.delay = 0.0
+        self.handler = None
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        self.calls.append(payload)
+        if self.handler is not None:
+            return await self.handler(request, payload)
+        await asyncio.sleep(self.delay)
+        return completion(f"echo: {payload['messages'][0]['content']}")
+
+    def models(self):
+        return [payload["model"] for payload in self.calls]
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Подменяет клиент OpenRouter и сбрасывает состояние процесса между тестами."""
+    mock = Upstream()
+    monkeypatch.setattr(
+        openrouter, "_http_client", httpx.AsyncClient(transport=httpx.MockTransport(mock))
+    )
+    monkeypatch.setattr(routes, "single_flight", SingleFlight())
+    monkeypatch.setattr(routes, "response_cache", ResponseCache(disk_path=None))
+    monkeypatch.setattr(model_health, "_models", {})
+    monkeypatch.setattr(rate_limiters, "_limiters", {})
+    return mock
+
+
+@pytest.fixture
+def proxy():
+    """Асинхронный клиент к приложению в текущем event loop (без lifespan)."""
+
+    def client(**kwargs) -> httpx.AsyncClient:
+        transport = httpx.ASGITransport(app=routes.app_openrouter)
+        return httpx.AsyncClient(transport=transport, base_url="http://proxy", **kwargs)
+
+    return client
@@ -0,0 +1,96 @@
+import asyncio
+import json
+
+from app.config import AVAILABLE_MODELS, MAX_BATCH_CONCURRENCY
+from tests.conftest import completion
+
+MODEL = AVAILABLE_MODELS[0]
+
+
+def _item(prompt: str, **extra) -> dict:
+    return {"prompt": prompt, "model": MODEL, "max_tokens": 16, **extra}
+
+
+def _post_batch(proxy, body: dict):
+    async def scenario():
+        async with proxy() as client:
+            return await client.post("/generate/batch", json=body)
+
+    response = asyncio.run(scenario())
+    lines = [json.loads(line) for line in response.text.splitlines() if line]
+    return response, lines
+
+
+def test_lines_carry_indexes_and_arrive_in_completion_order(upstream, proxy):
+    delays = {"slow": 0.2, "medium": 0.1, "fast": 0.0}
+
+    async def by_prompt(request, payload):
+        prompt = payload["messages"][0]["content"]
+        await asyncio.sleep(delays[prompt])
+        return completion(f"echo: {prompt}")
+
+    upstream.handler = by_prompt
+    body = {"items": [_item("slow"), _item("medium"), _item("fast")], "concurrency": 3}
+
+    response, lines = _post_batch(proxy, body)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [line["index"] for line in lines] == [2, 1, 0]
+    by_index = {line["index"]: line for line in lines}
+    for index, prompt in enumerate(["slow", "medium", "fast"]):
+        assert by_index[index]["status"] == 200
+        assert by_index[index]["result"]["response"] == f"echo: {prompt}"
+
+
+def test_malformed_item_is_reported_on_its_own_line(upstream, proxy):
+    body = {
+        "items": [
+            _item("first"),
+            {"model": MODEL},
+            "not an object",
+            _item("unsupported", model="no/such-model"),
+            _item("stream", stream=True),
+            _item("last"),
+        ]
+    }
+
+    response, lines = _post_batch(proxy, body)
+
+    assert response.status_code == 200
+    status = {line["index"]: line["status"] for line in lines}
+    assert status == {0: 200, 1: 422, 2: 422, 3: 400, 4: 400, 5: 200}
+    missing_prompt = next(line for line in lines if line["index"] == 1)
+    assert missing_prompt["error"][0]["loc"] == ["prompt"]
+    assert len(upstream.calls) == 2
+
+
+def test_concurrency_caps_items_in_flight(upstream, proxy):
+    in_flight = 0
+    peak = 0
+
+    async def tracked(request, payload):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.05)
+        in_flight -= 1
+        return completion("ok")
+
+    upstream.handler = tracked
+    body = {"items": [_item(f"p{i}") for i in range(10)], "concurrency": 3}
+
+    response, lines = _post_batch(proxy, body)
+
+    assert sorted(line["index"] for line in lines) == list(range(10))
+    assert all(line["status"] == 200 for line in lines)
+    assert peak == 3
+
+
+def test_batch_limits_are_validated(upstream, proxy):
+    too_parallel = {"items": [_item("a")], "concurrency": MAX_BATCH_CONCURRENCY + 1}
+    response, _ = _post_batch(proxy, too_parallel)
+    assert response.status_code == 400
+
+    response, _ = _post_batch(proxy, {"items": []})
+    assert response.status_code == 400
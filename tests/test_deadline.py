@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app import openrouter
+from app.config import AVAILABLE_MODELS, DEADLINE_HEADER, DEADLINE_MAX_SECONDS
+from app.deadline import parse_deadline
+from app.metrics import DEADLINE_EXCEEDED, RETRIES_SKIPPED
+from app.registry import model_registry
+from tests.conftest import completion
+
+MODEL = AVAILABLE_MODELS[0]
+
+
+def _generate(proxy, budget=None):
+    headers = {DEADLINE_HEADER: budget} if budget is not None else {}
+
+    async def scenario():
+        async with proxy() as client:
+            body = {"prompt": "hi", "model": MODEL, "max_tokens": 16}
+            return await client.post("/generate", json=body, headers=headers)
+
+    return asyncio.run(scenario())
+
+
+def _total(metric) -> float:
+    return sum(metric._values.values())
+
+
+@pytest.mark.parametrize("value", ["abc", "0", "-1", "nan"])
+def test_invalid_header_is_rejected(value, upstream, proxy):
+    with pytest.raises(HTTPException) as raised:
+        parse_deadline(value)
+    assert raised.value.status_code == 400
+
+    response = _generate(proxy, value)
+
+    assert response.status_code == 400
+    assert upstream.calls == []
+
+
+def test_header_is_capped_and_blank_means_default():
+    assert parse_deadline(str(DEADLINE_MAX_SECONDS * 10)) == DEADLINE_MAX_SECONDS
+    assert parse_deadline(" ") is None
+    assert parse_deadline(None) is None
+
+
+def test_header_budget_is_reported(upstream, proxy):
+    response = _generate(proxy, "30")
+
+    assert response.status_code == 200
+    assert response.json()["deadline"]["source"] == "header"
+    assert response.json()["deadline"]["budget_seconds"] == 30
+
+
+def test_too_small_budget_gives_504(upstream, proxy):
+    upstream.delay = 1.0
+    exceeded = _total(DEADLINE_EXCEEDED)
+
+    response = _generate(proxy, "0.2")
+
+    assert response.status_code == 504
+    assert "Deadline of 0.2s exceeded" in response.json()["detail"]
+    assert _total(DEADLINE_EXCEEDED) == exceeded + 1
+
+
+def test_retry_that_does_not_fit_is_skipped(upstream, proxy):
+    async def failing(request, payload):
+        return completion(status_code=500)
+
+    upstream.handler = failing
+    skipped = _total(RETRIES_SKIPPED)
+
+    # пауза перед повтором (retry_base_delay = 1s) не оставляет попытке
+    # DEADLINE_MIN_ATTEMPT_SECONDS из бюджета в 1.5s
+    response = _generate(proxy, "1.5")
+
+    assert response.status_code == 500
+    assert len(upstream.calls) == 1
+    assert _total(RETRIES_SKIPPED) == skipped + 1
+
+
+def test_remaining_budget_shrinks_across_attempts(upstream, proxy, monkeypatch):
+    monkeypatch.setattr(model_registry.get(MODEL), "retry_base_delay", 0.1)
+    monkeypatch.setattr(openrouter, "DEADLINE_MIN_ATTEMPT_SECONDS", 0.05)
+    timeouts = []
+
+    async def flaky(request, payload):
+        timeouts.append(request.extensions["timeout"]["read"])
+        return completion(status_code=500 if len(timeouts) < 3 else 200)
+
+    upstream.handler = flaky
+
+    response = _generate(proxy, "2")
+
+    assert response.status_code == 200
+    assert len(timeouts) == 3
+    # таймаут попытки — остаток бюджета: 2s минус паузы 0.1 и 0.2
+    assert timeouts[0] <= 2
+    assert timeouts[0] - timeouts[1] >= 0.1
+    assert timeouts[1] - timeouts[2] >= 0.2
+    assert response.json()["deadline"]["used_seconds"] >= 0.3
@@ -0,0 +1,149 @@
+import asyncio
+import json
+
+import httpx
+
+from app import routes
+from app.config import AVAILABLE_MODELS
+from app.disconnect import CLIENT_CLOSED_STATUS
+from app.metrics import CANCELLED_WORK
+from tests.conftest import completion
+
+MODEL = AVAILABLE_MODELS[0]
+
+
+class Client:
+    """Запрос к ASGI-приложению напрямую, с управляемым отключением клиента.
+
+    receive отдает тело запроса, а после leave() — http.disconnect, как
+    ASGI-сервер при обрыве соединения.
+    """
+
+    def __init__(self, **body):
+        self.body = {"prompt": "hi", "model": MODEL, "max_tokens": 16, **body}
+        self.left = asyncio.Event()
+        self.messages = []
+
+    def leave(self) -> None:
+        self.left.set()
+
+    async def post(self, path: str = "/generate") -> int:
+        request = [{"type": "http.request", "body": json.dumps(self.body).encode()}]
+
+        async def receive():
+            if request:
+                return request.pop()
+            await self.left.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            self.messages.append(message)
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": b"",
+            "headers": [(b"host", b"proxy"), (b"content-type", b"application/json")],
+            "client": ("127.0.0.1", 50000),
+            "server": ("proxy", 80),
+        }
+        await routes.app_openrouter(scope, receive, send)
+        return next(m["status"] for m in self.messages if m["type"] == "http.response.start")
+
+    def text(self) -> str:
+        chunks = [m.get("body", b"") for m in self.messages if m["type"] == "http.response.body"]
+        return b"".join(chunks).decode()
+
+
+class Slow:
+    """Обработчик апстрима: отвечает через delay секунд, запоминает отмены."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.cancelled = 0
+
+    async def __call__(self, request, payload):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return completion("done")
+
+
+def _cancelled() -> float:
+    return sum(CANCELLED_WORK._values.values())
+
+
+def test_disconnect_cancels_upstream_and_gives_499(upstream):
+    slow = upstream.handler = Slow(5.0)
+    before = _cancelled()
+    client = Client()
+
+    async def scenario():
+        request = asyncio.ensure_future(client.post())
+        await asyncio.sleep(0.1)
+        client.leave()
+        return await asyncio.wait_for(request, 1.0)
+
+    assert asyncio.run(scenario()) == CLIENT_CLOSED_STATUS
+    assert slow.cancelled == 1
+    assert _cancelled() == before + 1
+    assert routes.single_flight.stats()["in_flight"] == 0
+
+
+def test_departing_coalesced_client_does_not_cancel_shared_call(upstream):
+    slow = upstream.handler = Slow(0.3)
+    leader, follower = Client(), Client()
+
+    async def scenario():
+        # уходит тот, чей запрос начал общий вызов апстрима
+        first = asyncio.ensure_future(leader.post())
+        await asyncio.sleep(0.05)
+        second = asyncio.ensure_future(follower.post())
+        await asyncio.sleep(0.05)
+        leader.leave()
+        return await asyncio.gather(first, second)
+
+    assert asyncio.run(scenario()) == [CLIENT_CLOSED_STATUS, 200]
+    assert len(upstream.calls) == 1
+    assert slow.cancelled == 0
+    result = json.loads(follower.text())
+    assert result["response"] == "done"
+    assert result["coalesced"] is True
+
+
+def test_departing_stream_subscriber_does_not_cancel_shared_stream(upstream):
+    sse = b"".join(
+        b"data: " + json.dumps({"choices": [{"delta": {"content": text}}]}).encode() + b"\n\n"
+        for text in ("a", "b")
+    )
+
+    async def stream(request, payload):
+        await asyncio.sleep(0.3)
+        return httpx.Response(
+            200, headers={"content-type": "text/event-stream"}, content=sse + b"data: [DONE]\n\n"
+        )
+
+    upstream.handler = stream
+    leaver, stayer = Client(stream=True), Client(stream=True)
+
+    async def scenario():
+        first = asyncio.ensure_future(leaver.post())
+        await asyncio.sleep(0.05)
+        second = asyncio.ensure_future(stayer.post())
+        await asyncio.sleep(0.05)
+        leaver.leave()
+        return await asyncio.gather(first, second)
+
+    assert asyncio.run(scenario()) == [CLIENT_CLOSED_STATUS, 200]
+    assert len(upstream.calls) == 1
+    # кадры прокси: дельты по порядку и признак завершения
+    assert stayer.text().startswith('data: {"content": "a"}\n\ndata: {"content": "b"}\n\n')
+    assert '"done": true' in stayer.text()
@@ -0,0 +1,25 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from app.cache import make_cache_key, response_cache
+from app.config import AVAILABLE_MODELS
+from app.routes import app_openrouter
+
+
+def test_cache_hit_reports_model():
+    model = AVAILABLE_MODELS[0]
+    key = make_cache_key(model, "cached prompt", 32, 0.5)
+    asyncio.run(response_cache.set(key, {"response": "hello", "tokens_used": 3}))
+
+    client = TestClient(app_openrouter)
+    response = client.post(
+        "/generate",
+        json={"prompt": "cached prompt", "model": model, "max_tokens": 32, "temperature": 0.5},
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["cached"] is True
+    assert body["model"] == model
+    assert body["response"] == "hello"
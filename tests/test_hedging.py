@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app import hedging
+from app.hedging import hedged_call, model_health
+
+PRIMARY = "primary/model"
+FALLBACK = "fallback/model"
+
+
+@pytest.fixture(autouse=True)
+def fast_hedge(monkeypatch):
+    """Задержка hedging 0.05s: окно латентностей основной модели уже набрано."""
+    monkeypatch.setattr(model_health, "_models", {})
+    monkeypatch.setattr(hedging, "HEDGE_MIN_DELAY", 0.0)
+    health = model_health.get(PRIMARY)
+    for _ in range(hedging.HEDGE_MIN_SAMPLES):
+        health.record_success(0.05)
+
+
+class Calls:
+    """call(model) для hedged_call: поведение по модели, учет запусков и отмен."""
+
+    def __init__(self, **behaviour):
+        self.behaviour = behaviour
+        self.started = []
+        self.cancelled = []
+
+    async def __call__(self, model: str):
+        self.started.append(model)
+        delay, outcome = self.behaviour[model.split("/")[0]]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(model)
+            raise
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+def _run(calls: Calls):
+    return asyncio.run(hedged_call(PRIMARY, calls, FALLBACK, [PRIMARY, FALLBACK]))
+
+
+def test_fast_primary_is_not_hedged():
+    calls = Calls(primary=(0.0, "p"), fallback=(0.0, "f"))
+
+    assert _run(calls) == ("p", PRIMARY, False)
+    assert calls.started == [PRIMARY]
+
+
+def test_secondary_wins_and_slow_primary_is_cancelled():
+    calls = Calls(primary=(1.0, "p"), fallback=(0.0, "f"))
+
+    assert _run(calls) == ("f", FALLBACK, True)
+    assert calls.started == [PRIMARY, FALLBACK]
+    assert calls.cancelled == [PRIMARY]
+
+
+def test_primary_wins_after_hedge_and_secondary_is_cancelled():
+    calls = Calls(primary=(0.1, "p"), fallback=(1.0, "f"))
+
+    assert _run(calls) == ("p", PRIMARY, True)
+    assert calls.cancelled == [FALLBACK]
+
+
+@pytest.mark.parametrize("status", [400, 404, 503])
+def test_fast_non_retryable_primary_error_is_not_hedged(status):
+    calls = Calls(primary=(0.0, HTTPException(status_code=status)), fallback=(0.0, "f"))
+
+    with pytest.raises(HTTPException) as raised:
+        _run(calls)
+
+    assert raised.value.status_code == status
+    assert calls.started == [PRIMARY]
+
+
+def test_slow_non_retryable_primary_error_cancels_secondary():
+    calls = Calls(primary=(0.1, HTTPException(status_code=400)), fallback=(1.0, "f"))
+
+    with pytest.raises(HTTPException) as raised:
+        _run(calls)
+
+    assert raised.value.status_code == 400
+    assert calls.cancelled == [FALLBACK]
+
+
+def test_retryable_primary_error_is_hedged():
+    calls = Calls(primary=(0.0, HTTPException(status_code=502)), fallback=(0.0, "f"))
+
+    assert _run(calls) == ("f", FALLBACK, True)
+
+
+def test_primary_error_is_reported_when_both_fail():
+    calls = Calls(
+        primary=(0.0, HTTPException(status_code=429, detail="primary")),
+        fallback=(0.0, HTTPException(status_code=500, detail="fallback")),
+    )
+
+    with pytest.raises(HTTPException) as raised:
+        _run(calls)
+
+    assert raised.value.detail == "primary"
@@ -0,0 +1,30 @@
+import asyncio
+import io
+
+from app.config import AVAILABLE_MODELS
+from app.jobs import BenchmarkJob, job_manager
+from app.prompts import PromptSource
+
+
+def test_events_send_keepalive_while_job_is_idle():
+    async def collect():
+        job = BenchmarkJob(
+            "job-keepalive",
+            PromptSource(io.BytesIO(b"hello\n")),
+            [AVAILABLE_MODELS[0]],
+            runs=1,
+            concurrency=1,
+            stream=False,
+            resume=False,
+        )
+        events = job_manager.events(job, interval=0.01, keepalive=0.05)
+        frames = [await events.__anext__(), await events.__anext__()]
+        job.status = "cancelled"
+        frames += [frame async for frame in events]
+        return frames
+
+    frames = asyncio.run(collect())
+
+    assert frames[0].startswith("event: progress")
+    assert frames[1] == ": keepalive\n\n"
+    assert frames[-1].startswith("event: done")
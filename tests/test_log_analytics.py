@@ -0,0 +1,69 @@
+import json
+import os
+
+from app.log_analytics import FINGERPRINT_BYTES, analyze
+
+
+def _record(second: int) -> str:
+    record = {
+        "ts": f"2025-09-08T22:44:{second:02d}",
+        "level": "INFO",
+        "message": "Upstream request succeeded in 1.000s",
+        "model": "moonshotai/kimi-k2:free",
+        "latency_seconds": 1.0,
+    }
+    return json.dumps(record) + "\n"
+
+
+def _successes(report):
+    return report["models"]["moonshotai/kimi-k2:free"]["successes"]
+
+
+def test_incremental_file_growing_past_fingerprint(tmp_path):
+    log = tmp_path / "server_logs.txt"
+    state = str(tmp_path / "state.json")
+    log.write_text(_record(0))
+    assert log.stat().st_size < FINGERPRINT_BYTES
+
+    assert _successes(analyze([str(log)], state_path=state)) == 1
+
+    with open(log, "a") as f:
+        f.write(_record(1) + _record(2) + _record(3))
+    assert log.stat().st_size > FINGERPRINT_BYTES
+
+    report = analyze([str(log)], state_path=state)
+    assert _successes(report) == 4
+    assert report["files"][0]["start"] > 0
+
+
+def test_incremental_rotation_is_not_reparsed(tmp_path):
+    log = tmp_path / "server_logs.txt"
+    state = str(tmp_path / "state.json")
+    log.write_text(_record(0) + _record(1))
+    analyze([str(log)], state_path=state)
+
+    rotated = tmp_path / "server_logs.txt.1"
+    os.replace(log, rotated)
+    log.write_text(_record(2))
+
+    report = analyze([str(rotated), str(log)], state_path=state)
+    assert _successes(report) == 3
+
+
+def test_rates_are_shares_of_attempts(tmp_path):
+    log = tmp_path / "server_logs.txt"
+    log.write_text(
+        "2025-09-08 22:44:20 - INFO - Попытка 1/4 для модели moonshotai/kimi-k2:free\n"
+        "2025-09-08 22:44:21 - WARNING - Rate limit (429). Retry after 2s\n"
+        "2025-09-08 22:44:23 - WARNING - Rate limit (429). Retry after 4s\n"
+        "2025-09-08 22:44:27 - INFO - Успешный запрос за 1.50s\n",
+        encoding="utf-8",
+    )
+
+    model = analyze([str(log)])["models"]["moonshotai/kimi-k2:free"]
+
+    assert model["requests"] == 1
+    assert model["retries"] == 2
+    assert model["attempts"] == 3
+    assert model["retry_rate"] == round(2 / 3, 4)
+    assert model["rate_limited_rate"] == round(2 / 3, 4)
@@ -0,0 +1,40 @@
+import time
+
+from app.metrics import METRICS_NAMESPACE, Counter, Gauge, Histogram, MetricsRegistry
+from app.shared import SharedState
+
+
+def _registry():
+    registry = MetricsRegistry()
+    requests = registry.register(Counter("requests_total", "Requests", ("model",)))
+    in_flight = registry.register(Gauge("in_flight", "In flight"))
+    duration = registry.register(Histogram("duration_seconds", "Duration", buckets=(1.0,)))
+    return registry, requests, in_flight, duration
+
+
+def test_shared_render_sums_workers(tmp_path):
+    shared = SharedState(str(tmp_path / "shared.db"))
+    registry, requests, in_flight, duration = _registry()
+    requests.inc("a", amount=2)
+    in_flight.set(value=1)
+    duration.observe(0.5)
+    # снимки двух других воркеров: живого и давно не обновлявшегося
+    other = registry.snapshot()
+    shared.set(METRICS_NAMESPACE, "1", {"heartbeat": time.time(), "metrics": other})
+    shared.set(METRICS_NAMESPACE, "2", {"heartbeat": 0.0, "metrics": other})
+
+    text = registry.render_shared(shared, stale_seconds=15)
+
+    assert 'requests_total{model="a"} 6' in text
+    assert "in_flight 2" in text
+    assert 'duration_seconds_bucket{le="1"} 3' in text
+    assert "duration_seconds_count 3" in text
+    # собственный снимок воркера опубликован при рендере
+    assert len(shared.items(METRICS_NAMESPACE)) == 3
+
+
+def test_local_render_is_unchanged_without_shared_state():
+    registry, requests, _, _ = _registry()
+    requests.inc("a")
+
+    assert 'requests_total{model="a"} 1' in registry.render()
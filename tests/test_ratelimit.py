@@ -0,0 +1,143 @@
+import asyncio
+import sqlite3
+
+import pytest
+from fastapi import HTTPException
+
+from app import ratelimit
+from app.config import RATE_LIMIT_INCREASE_RPS, RATE_LIMIT_MAX_RPS, RATE_LIMIT_MIN_RPS
+from app.ratelimit import ModelRateLimiter
+from app.shared import SharedState
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Ручные часы; asyncio.sleep в лимитере сдвигает их вместо ожидания."""
+    fake = Clock()
+    real_sleep = asyncio.sleep
+
+    async def sleep(seconds, *args, **kwargs):
+        fake.now += seconds
+        await real_sleep(0)
+
+    monkeypatch.setattr(ratelimit.asyncio, "sleep", sleep)
+    return fake
+
+
+def test_bucket_refills_at_rate_up_to_burst(clock):
+    limiter = ModelRateLimiter("m", rate=2, burst=2, clock=clock)
+
+    assert limiter._take(clock()) == 0
+    assert limiter._take(clock()) == 0
+    assert limiter._take(clock()) == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert limiter._take(clock()) == 0
+
+    clock.now += 100
+    limiter._refill(clock())
+    assert limiter.tokens == 2
+
+
+def test_acquire_waits_for_token(clock):
+    limiter = ModelRateLimiter("m", rate=4, burst=1, clock=clock)
+
+    async def scenario():
+        return [await limiter.acquire(), await limiter.acquire(), await limiter.acquire()]
+
+    waits = asyncio.run(scenario())
+
+    assert waits == [0, pytest.approx(0.25), pytest.approx(0.25)]
+    assert limiter.queue_depth == 0
+
+
+def test_acquire_rejects_when_wait_exceeds_max(clock):
+    limiter = ModelRateLimiter("m", rate=0.1, burst=1, clock=clock)
+
+    async def scenario():
+        await limiter.acquire()
+        await limiter.acquire(max_wait=5)
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(scenario())
+
+    assert raised.value.status_code == 429
+    assert raised.value.headers["Retry-After"] == "11"
+
+
+def test_429_halves_rate_and_pauses_for_retry_after(clock):
+    limiter = ModelRateLimiter("m", rate=4, burst=10, clock=clock)
+
+    pause = limiter._observe(clock(), 429, {"retry-after": "3"})
+
+    assert pause == 3
+    assert limiter.rate == 2
+    assert limiter.throttled == 1
+    assert limiter._take(clock()) == pytest.approx(3)
+    clock.now += 3
+    # ведро обнулено: после паузы токен копится со сниженной скоростью
+    assert limiter._take(clock()) == 0
+
+    for _ in range(20):
+        limiter._observe(clock(), 429, {})
+    assert limiter.rate == RATE_LIMIT_MIN_RPS
+
+
+def test_rate_recovers_additively_after_successes(clock):
+    limiter = ModelRateLimiter("m", rate=1, burst=10, clock=clock)
+    limiter._observe(clock(), 429, {"retry-after": "1"})
+    assert limiter.rate == 0.5
+
+    for _ in range(5):
+        limiter._observe(clock(), 200, {})
+
+    assert limiter.rate == pytest.approx(0.5 + 5 * RATE_LIMIT_INCREASE_RPS)
+
+    limiter.rate = RATE_LIMIT_MAX_RPS
+    limiter._observe(clock(), 200, {})
+    assert limiter.rate == RATE_LIMIT_MAX_RPS
+
+
+def test_exhausted_upstream_quota_pauses_until_reset(clock):
+    limiter = ModelRateLimiter("m", rate=5, burst=10, clock=clock)
+
+    limiter._observe(
+        clock(),
+        200,
+        {"x-ratelimit-limit": "20", "x-ratelimit-remaining": "0", "x-ratelimit-reset": "7"},
+    )
+
+    assert limiter.upstream_limit == 20
+    assert limiter.tokens == 0
+    assert limiter._take(clock()) == pytest.approx(7)
+
+
+def test_shared_bucket_is_common_to_workers(tmp_path, clock):
+    path = str(tmp_path / "shared.db")
+    # у каждого воркера свое соединение с общей базой
+    first = ModelRateLimiter("m", rate=1, burst=2, shared=SharedState(path), clock=clock)
+    second = ModelRateLimiter("m", rate=1, burst=2, shared=SharedState(path), clock=clock)
+
+    async def scenario():
+        await first.acquire()
+        await first.acquire()
+        before = clock()
+        await second.acquire()
+        return clock() - before
+
+    waited = asyncio.run(scenario())
+
+    assert waited == pytest.approx(1)
+    assert sqlite3.connect(path).execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    second.shared._connect().execute("DROP TABLE shared_state")
+    # без общей базы запросы не блокируются
+    assert asyncio.run(second.acquire()) == 0
@@ -0,0 +1,25 @@
+from app.registry import ModelSettings, ModelSpec
+
+
+def test_clamp_max_tokens_with_limit():
+    spec = ModelSpec("model-a", ModelSettings(max_tokens_limit=100), None)
+
+    assert spec.clamp_max_tokens(50) == 50
+    assert spec.clamp_max_tokens(500) == 100
+    assert spec.clamp_max_tokens(None) == 100
+
+
+def test_clamp_max_tokens_uses_catalog_limit():
+    spec = ModelSpec(
+        "model-a", ModelSettings(max_tokens_limit=100), None, info={"max_completion_tokens": 40}
+    )
+
+    assert spec.clamp_max_tokens(None) == 40
+    assert spec.clamp_max_tokens(60) == 40
+
+
+def test_clamp_max_tokens_without_limit():
+    spec = ModelSpec("model-a", ModelSettings(), None)
+
+    assert spec.clamp_max_tokens(None) is None
+    assert spec.clamp_max_tokens(500) == 500
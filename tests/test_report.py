@@ -0,0 +1,26 @@
+from app.report import render_benchmark_report
+
+
+def test_detailed_rows_show_model():
+    results = [
+        {
+            "run_id": 1,
+            "prompt_id": i,
+            "model": model,
+            "prompt": "hello",
+            "response": "hi",
+            "latency_seconds": 0.5 + i,
+            "tokens_used": 2,
+            "response_length": 2,
+            "timestamp": "2025-09-09T18:50:23",
+        }
+        for i, model in enumerate(["model-a", "model-b"])
+    ]
+
+    html = "".join(
+        render_benchmark_report(results, {}, {}, "model-a, model-b", runs=1)
+    )
+
+    assert "<th>Model</th>" in html
+    assert "<td>0</td><td>model-a</td>" in html
+    assert "<td>1</td><td>model-b</td>" in html
@@ -0,0 +1,38 @@
+import threading
+
+from app.shared import SharedState
+
+
+def test_concurrent_updates_are_not_lost(tmp_path):
+    path = str(tmp_path / "shared.db")
+    workers, increments = 4, 50
+    # у каждого «воркера» свое соединение, как у отдельных процессов
+    states = [SharedState(path) for _ in range(workers)]
+    start = threading.Barrier(workers)
+
+    def increment(old):
+        value = (old or 0) + 1
+        return value, value
+
+    def worker(state: SharedState):
+        start.wait()
+        for _ in range(increments):
+            state.update("counters", "hits", increment)
+
+    threads = [threading.Thread(target=worker, args=(state,)) for state in states]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert SharedState(path).get("counters", "hits") == workers * increments
+    for state in states:
+        state.close()
+
+
+def test_update_result_and_delete(tmp_path):
+    state = SharedState(str(tmp_path / "shared.db"))
+
+    assert state.update("ns", "k", lambda old: ({"n": 1}, old)) is None
+    assert state.update("ns", "k", lambda old: (None, old)) == {"n": 1}
+    assert state.get("ns", "k") is None
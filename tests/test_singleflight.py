@@ -0,0 +1,142 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from app import routes
+from app.config import AVAILABLE_MODELS
+from app.singleflight import SingleFlight
+
+MODEL = AVAILABLE_MODELS[0]
+
+
+def _payload(prompt: str) -> dict:
+    return {"prompt": prompt, "model": MODEL, "max_tokens": 16}
+
+
+def test_identical_concurrent_requests_share_one_upstream_call(upstream, proxy):
+    upstream.delay = 0.2
+
+    async def scenario():
+        async with proxy() as client:
+            return await asyncio.gather(
+                *(client.post("/generate", json=_payload("same")) for _ in range(5))
+            )
+
+    responses = asyncio.run(scenario())
+
+    assert len(upstream.calls) == 1
+    assert [r.status_code for r in responses] == [200] * 5
+    bodies = [r.json() for r in responses]
+    assert {b["response"] for b in bodies} == {"echo: same"}
+    # один запрос ведущий, остальные получили его результат
+    assert sorted(b["coalesced"] for b in bodies) == [False, True, True, True, True]
+    assert routes.single_flight.stats()["in_flight"] == 0
+
+
+def test_leader_failure_reaches_every_waiter(upstream, proxy):
+    async def reject(request, payload):
+        await asyncio.sleep(0.1)
+        return httpx.Response(400, text="bad input")
+
+    upstream.handler = reject
+
+    async def scenario():
+        async with proxy() as client:
+            failed = await asyncio.gather(
+                *(client.post("/generate", json=_payload("bad")) for _ in range(4))
+            )
+            upstream.handler = None
+            retry = await client.post("/generate", json=_payload("bad"))
+        return failed, retry
+
+    failed, retry = asyncio.run(scenario())
+
+    assert [r.status_code for r in failed] == [400] * 4
+    assert routes.single_flight.stats()["in_flight"] == 0
+    # ключ не залип: следующий запрос снова идет в апстрим
+    assert retry.status_code == 200
+    assert len(upstream.calls) == 2
+
+
+def test_cancelled_leader_call_reaches_waiters_and_frees_key():
+    async def scenario():
+        flight = SingleFlight()
+        started = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(10)
+
+        waiters = [asyncio.ensure_future(flight.do("key", slow)) for _ in range(3)]
+        await started.wait()
+        flight._calls["key"].task.cancel()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        return flight, results
+
+    flight, results = asyncio.run(scenario())
+
+    assert all(isinstance(r, asyncio.CancelledError) for r in results)
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_departing_waiter_does_not_cancel_shared_call():
+    async def scenario():
+        flight = SingleFlight()
+        calls = 0
+
+        async def slow():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.1)
+            return "done"
+
+        first = asyncio.ensure_future(flight.do("key", slow))
+        second = asyncio.ensure_future(flight.do("key", slow))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        result = await second
+        return flight, calls, result, first
+
+    flight, calls, result, first = asyncio.run(scenario())
+
+    assert first.cancelled()
+    assert result == ("done", True)
+    assert calls == 1
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_stream_open_error_reaches_every_subscriber():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def start():
+            await asyncio.sleep(0.05)
+            raise HTTPException(status_code=503, detail="down")
+
+        return flight, await asyncio.gather(
+            *(flight.stream("key", start) for _ in range(3)), return_exceptions=True
+        )
+
+    flight, results = asyncio.run(scenario())
+
+    assert all(isinstance(r, HTTPException) and r.status_code == 503 for r in results)
+    assert flight.stats()["streams_in_flight"] == 0
+
+
+@pytest.mark.parametrize("prompt", ["a", "b"])
+def test_different_requests_are_not_coalesced(upstream, proxy, prompt):
+    upstream.delay = 0.05
+
+    async def scenario():
+        async with proxy() as client:
+            return await asyncio.gather(
+                client.post("/generate", json=_payload(prompt)),
+                client.post("/generate", json={**_payload(prompt), "max_tokens": 32}),
+            )
+
+    responses = asyncio.run(scenario())
+
+    assert len(upstream.calls) == 2
+    assert not any(r.json()["coalesced"] for r in responses)
@@ -0,0 +1,86 @@
+import random
+import statistics
+
+import pytest
+
+from app.sketch import SKETCH_RELATIVE_ACCURACY, BenchmarkStats, QuantileSketch
+from app.utils import percentile
+
+
+@pytest.mark.parametrize("n", [1, 2, 6, 20])
+@pytest.mark.parametrize("q", [0, 10, 50, 90, 95, 99, 100])
+def test_quantile_matches_exact_percentile(n, q):
+    values = [random.Random(n * 100 + i).uniform(0.1, 30.0) for i in range(n)]
+    sketch = QuantileSketch()
+    sketch.update(values)
+
+    expected = percentile(values, q)
+    assert sketch.quantile(q) == pytest.approx(expected, rel=SKETCH_RELATIVE_ACCURACY)
+
+
+@pytest.mark.parametrize("n", [2, 6, 20])
+def test_quantile_matches_statistics_quantiles(n):
+    values = [float(i + 1) for i in range(n)]
+    sketch = QuantileSketch()
+    sketch.update(values)
+
+    quartiles = statistics.quantiles(values, n=4, method="inclusive")
+    for q, expected in zip((25, 50, 75), quartiles):
+        assert sketch.quantile(q) == pytest.approx(expected, rel=SKETCH_RELATIVE_ACCURACY)
+
+
+def test_quantile_of_empty_and_zero_values():
+    sketch = QuantileSketch()
+    assert sketch.quantile(50) is None
+    sketch.update([0.0, 0.0, 4.0])
+    assert sketch.quantile(50) == 0.0
+    assert sketch.quantile(75) == pytest.approx(2.0, rel=SKETCH_RELATIVE_ACCURACY)
+
+
+def _row(run_id, prompt_id, latency):
+    return {"run_id": run_id, "prompt_id": prompt_id, "latency_seconds": latency, "tokens_used": 5}
+
+
+def test_per_prompt_breakdown_is_capped():
+    stats = BenchmarkStats(max_prompts=3)
+    for prompt_id in range(1, 11):
+        stats.add(_row(1, prompt_id, 1.0 + prompt_id))
+
+    latency = stats.latency_stats()
+    assert sorted(latency["per_prompt"]) == ["1", "2", "3"]
+    assert latency["per_prompt_truncated"] is True
+    assert latency["count"] == 10
+    assert stats.tokens_stats()["per_prompt_truncated"] is True
+
+    merged = BenchmarkStats(max_prompts=3).merge(stats)
+    assert len(merged.latency_by_prompt) == 3
+    assert merged.prompts_truncated is True
+
+
+def test_per_prompt_breakdown_can_be_disabled():
+    stats = BenchmarkStats(max_prompts=0)
+    stats.add(_row(1, 1, 1.0))
+
+    assert stats.latency_stats()["per_prompt"] == {}
+    assert stats.latency_stats()["per_run"]["1"]["count"] == 1
+
+
+def test_per_prompt_cap_boundary():
+    stats = BenchmarkStats(max_prompts=3)
+    for prompt_id in (1, 2, 3):
+        stats.add(_row(1, prompt_id, 1.0))
+
+    assert sorted(stats.latency_by_prompt) == [1, 2, 3]
+    assert stats.latency_stats()["per_prompt_truncated"] is False
+
+    stats.add(_row(1, 4, 1.0))
+    assert sorted(stats.latency_by_prompt) == [1, 2, 3]
+    assert stats.latency_stats()["per_prompt_truncated"] is True
+
+    merged = BenchmarkStats(max_prompts=3)
+    other = BenchmarkStats(max_prompts=10)
+    for prompt_id in (3, 4):
+        other.add(_row(1, prompt_id, 1.0))
+    merged.merge(other)
+    assert sorted(merged.latency_by_prompt) == [3]
+    assert merged.prompts_truncated is True
@@ -0,0 +1,30 @@
+import sqlite3
+
+from app.store import SCHEMA_VERSION, ResultStore
+
+
+def _row(model, latency):
+    return {
+        "run_id": 1,
+        "prompt_id": 1,
+        "model": model,
+        "prompt": "hello",
+        "response": "hi",
+        "latency_seconds": latency,
+        "tokens_used": 2,
+        "timestamp": "2025-09-09T18:50:23",
+    }
+
+
+def test_models_with_same_prompt_are_kept_apart(tmp_path):
+    path = str(tmp_path / "results.db")
+    store = ResultStore(path)
+    store.insert_rows("bench", [_row("model-a", 1.0), _row("model-b", 2.0)])
+    store.insert_rows("bench", [_row("model-a", 3.0)])
+
+    db = sqlite3.connect(path)
+    rows = db.execute(
+        "SELECT model, latency_seconds FROM benchmark_results ORDER BY model"
+    ).fetchall()
+    assert rows == [("model-a", 3.0), ("model-b", 2.0)]
+    assert db.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION